@@ -7,21 +7,44 @@
 ################################################################################
 import argparse
 import os
+import sys
+from contextlib import ExitStack
 
-from utils.fasta import get_coordinates
-from utils.heatmap import SimpleHeatmapMaker, make_heatmap
-from utils.histogram import (
-    MultipleDataHistogramMaker,
-    SingleDataHistogramMaker,
-    make_histogram,
+from utils.cache import DEFAULT_CACHE_SIZE, ExtractionCache
+from utils.fasta import get_contig_coordinates
+from utils.meth_data import SAM_EXTENSIONS, MethylationData, MethylationSummary, SiteCounter, sample_name
+from utils.profile import StageProfiler
+from utils.sam import ReadCounter, extract_meth, extract_meth_by_contig, stream_reads, stream_reads_by_contig
+from utils.save import (
+    StreamingCSVWriter,
+    StreamingReadsWriter,
+    WriteEpialleles2CSV,
+    WriteMethlation2CSV,
+    WriteMethylation2Binary,
+    WriteSites2CSV,
+    save_data,
 )
-from utils.meth_data import MethylationData
-from utils.sam import extract_meth
-from utils.save import WriteMethlation2CSV, save_data
 
+# Start of the stderr line reporting a failed sam file with --keep-going
+FAILED_SAM_PREFIX = "FAILED SAM\t"
 
-def main():
+# Outputs which can be selected with --outputs, and the ones produced by default
+OUTPUTS = ("csv", "histogram", "heatmap", "npy", "tsv", "sites")
+DEFAULT_OUTPUTS = ("csv", "histogram", "heatmap")
+
+# Motif of the sites read from the fasta file
+MOTIF = "CG"
+
+# Name of the --profile file when none is given
+PROFILE_NAME = "allelicMeth{}_profile.json"
+
+
+def main(argv: list = None):
     """Computes methylation of individual reads.
+
+    argv: command line arguments, sys.argv[1:] if not given. Lets the analysis be run
+    from other scripts without starting a new interpreter.
+    Returns a dict of sam files that failed with --keep-going and their errors.
     
     Inputs
     ------
@@ -77,7 +100,94 @@ def main():
         required=False,
         default="",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--engine",
+        help="Options: python or numpy. Defines how reads are called, numpy calls blocks of reads at once (default: numpy).",
+        type=str,
+        required=False,
+        default="numpy",
+        choices=["python", "numpy"],
+    )
+    parser.add_argument(
+        "--stream",
+        help="If set, process sam files chunk by chunk in constant memory: csv is written while reading, histograms are built from running counts and heatmaps from a random sample of reads (default: False).",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--epialleles",
+        help="If set, collapse reads with identical methylation patterns into epialleles with read counts and save them to an additional csv file (default: False).",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--jobs",
+        help="Number of processes for extraction. Sam files are extracted in parallel, or a file is split into parts when there are fewer files than jobs (default: 1).",
+        type=int,
+        required=False,
+        default=1,
+    )
+    parser.add_argument(
+        "--keep-going",
+        help="If set, a sam file that fails is reported on stderr as a 'FAILED SAM<tab><file><tab><error>' line and the remaining files are still processed (default: False).",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--outputs",
+        help=f"Comma separated list of outputs to produce, any of: {','.join(OUTPUTS)} (default: {','.join(DEFAULT_OUTPUTS)}). Plotting libraries are only loaded when a plot is requested. npy saves patterns, levels and read names of every sample as memory-mappable numpy files. tsv writes one line per read (name, position, pattern, called CpGs, level) while streaming, needs --stream. sites writes methylated, unmethylated and missing calls, coverage and level of every CpG site, counted over all called reads including the ones dropped for partial coverage.",
+        type=str,
+        required=False,
+        default=",".join(DEFAULT_OUTPUTS),
+    )
+    parser.add_argument(
+        "--tsv-gzip",
+        help="If set, gzip compress the read level tsv files of --outputs tsv (default: False).",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--no-plots",
+        help="If set, only extract methylation and save the csv file, same as --outputs csv (default: False).",
+        action="store_true",
+        required=False,
+    )
+    parser.add_argument(
+        "--heatmap-renderer",
+        help="How heatmaps are drawn: 'raster' draws the reads as one image and averages reads when there are more than pixel rows, fast for large --reads2plot; 'seaborn' draws every cell (default: raster).",
+        type=str,
+        choices=("raster", "seaborn"),
+        required=False,
+        default="raster",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory caching extracted reads by the content of the sam and fasta file and the extraction options. Runs changing only plots, --reads2plot, --mode or --output-suffix load the reads from the cache instead of parsing sam files. Not used with --stream (default: no cache).",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--cache-size",
+        help=f"Size limit of --cache-dir in MB, least recently used entries are removed above it (default: {DEFAULT_CACHE_SIZE >> 20}).",
+        type=int,
+        required=False,
+        default=DEFAULT_CACHE_SIZE >> 20,
+    )
+    parser.add_argument(
+        "--profile",
+        help=f"Record wall time, CPU time, reads parsed/retained/dropped, reads/s and peak RSS of every stage and sam file to a JSON file (default file: {PROFILE_NAME.format('<output-suffix>')}). Sam files are then processed one after the other.",
+        nargs="?",
+        const="",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed for the random selection of reads shown on heatmaps, and of the reads kept with --stream. Makes runs reproducible (default: random).",
+        type=int,
+        required=False,
+    )
+    args = parser.parse_args(argv)
 
     workdir = os.getcwd()
     filenames = os.listdir(workdir)
@@ -97,26 +207,40 @@ def main():
         print(f"There is more than one fasta file in the working dir, leave only one.")
         return
     print(f"Fasta file: {fastafile}")
+    args.fasta = fastafile[0]
 
     # get sam files
     samfiles = []
     if args.sam:
         samfiles += args.sam
     else:
-        samfiles = [f for f in filenames if f.endswith(".sam")]
+        samfiles = [f for f in filenames if f.endswith(SAM_EXTENSIONS)]
     print(f"SAM files: {samfiles}")
 
     # histogram plotting mode
     if not args.mode:
-        histmode = SingleDataHistogramMaker()
-    elif args.mode == "multiple":
-        histmode = MultipleDataHistogramMaker()
-    elif args.mode == "single":
-        histmode = SingleDataHistogramMaker()
+        histmode = "single"
+    elif args.mode in ("single", "multiple"):
+        histmode = args.mode
     else:
         print(f'--mode can take only one of two parameters "single" or "multiple"')
         return
 
+    # outputs to produce
+    outputs = {"csv"} if args.no_plots else {o.strip() for o in args.outputs.split(",") if o.strip()}
+    unknown = outputs.difference(OUTPUTS)
+    if unknown:
+        print(f"--outputs can only contain {', '.join(OUTPUTS)}, got: {', '.join(sorted(unknown))}")
+        return
+    if "npy" in outputs and args.stream:
+        print("npy output needs all reads and is skipped with --stream.")
+        outputs.discard("npy")
+    if "tsv" in outputs and not args.stream:
+        print("tsv output is written while reads are streamed and is skipped without --stream.")
+        outputs.discard("tsv")
+    args.outputs = outputs
+    print(f"Outputs: {sorted(outputs)}")
+
     # reads to plot on a heatmap
     reads2plot = 10000
     if args.reads2plot:
@@ -126,13 +250,221 @@ def main():
     ####################################################################################
     # analysis
     ####################################################################################
-    coordinates = get_coordinates(fastafile[0])
+    profiler = StageProfiler(args.profile is not None)
+    with profiler.stage("coordinates"):
+        contig_coordinates = get_contig_coordinates(fastafile[0], motif=MOTIF)
+    if len(contig_coordinates) > 1:
+        # reads are routed to their contig by RNAME, every contig is saved and plotted as its own sample
+        coordinates = contig_coordinates
+        print(f"Contigs: {len(contig_coordinates)}")
+    else:
+        coordinates = next(iter(contig_coordinates.values()), [])
+    failed = {}
+    if args.keep_going or profiler.enabled:
+        # every sam file is extracted and saved on its own: profiled per file, and with --keep-going
+        # a failing file does not stop the others
+        meth_data = MethylationData()
+        sample_histmode = None if histmode == "multiple" else histmode
+        for samfile in samfiles:
+            try:
+                sample_data = _extract(coordinates, [samfile], reads2plot, args, profiler)
+                _save_outputs(sample_data, sample_histmode, reads2plot, args, coordinates, profiler)
+                meth_data.data += sample_data.data
+            except Exception as e:
+                if not args.keep_going:
+                    raise
+                failed[samfile] = f"{type(e).__name__}: {e}"
+                print(f"{FAILED_SAM_PREFIX}{samfile}\t{failed[samfile]}", file=sys.stderr)
+        if sample_histmode is None and meth_data.data and "histogram" in args.outputs:
+            with profiler.stage("histogram"):
+                _plot_histogram(meth_data, histmode, args.output_suffix)
+    else:
+        meth_data = _extract(coordinates, samfiles, reads2plot, args)
+        _save_outputs(meth_data, histmode, reads2plot, args, coordinates)
+    if profiler.enabled:
+        profile = args.profile or PROFILE_NAME.format(args.output_suffix)
+        profiler.save(
+            profile,
+            fasta=args.fasta,
+            sam=samfiles,
+            failed=failed,
+            options={"engine": args.engine, "jobs": args.jobs, "stream": args.stream, "epialleles": args.epialleles, "retain_methylated": args.retain_methylated},
+        )
+        print(f"Profile: {profile}")
+    return failed
+
+
+def _extract(coordinates, samfiles: list, reads2plot: int, args: argparse.Namespace, profiler: StageProfiler = None) -> MethylationData:
+    """Extracts methylation of sam files as set by the command line options.
+
+    coordinates is a list of CpG coordinates, or a dict of contig: list for references with several contigs.
+    """
+    profiler = profiler or StageProfiler(enabled=False)
+    with profiler.stage("extract", samfiles[0] if len(samfiles) == 1 else None) as record:
+        if args.cache_dir and not args.stream:
+            meth_data = _extract_cached(coordinates, samfiles, reads2plot, args)
+        else:
+            meth_data = _extract_uncached(coordinates, samfiles, reads2plot, args)
+        record["reads_retained"] = sum(d.reads_number for d in meth_data.data)
+        parsed = [d.parsed_reads for d in meth_data.data]
+        if None not in parsed:
+            record["reads_parsed"] = sum(parsed)
+            record["reads_dropped"] = record["reads_parsed"] - record["reads_retained"]
+    return meth_data
+
+
+def _extract_uncached(coordinates, samfiles: list, reads2plot: int, args: argparse.Namespace) -> MethylationData:
     meth_data = MethylationData()
-    extract_meth(coordinates, samfiles, meth_data, retain_methylated=args.retain_methylated)
-    make_histogram(meth_data, histmode, args.output_suffix)
-    make_heatmap(meth_data, SimpleHeatmapMaker(), reads2plot, args.output_suffix)
-    save_data(meth_data, WriteMethlation2CSV(args.output_suffix))
+    # read names are only kept when they are saved
+    read_ids = "npy" in args.outputs
+    sites = "sites" in args.outputs
+    if isinstance(coordinates, dict):
+        if args.stream:
+            for samfile in samfiles:
+                _stream_contigs(coordinates, samfile, meth_data, reads2plot, args)
+        else:
+            extract_meth_by_contig(coordinates, samfiles, meth_data, retain_methylated=args.retain_methylated, epialleles=args.epialleles, jobs=args.jobs, read_ids=read_ids, sites=sites)
+    elif args.stream:
+        for samfile in samfiles:
+            summary = MethylationSummary(samfile, len(coordinates), reads2plot, seed=args.seed)
+            counter = ReadCounter()
+            site_counter = SiteCounter(len(coordinates)) if sites else None
+            chunks = stream_reads(coordinates, samfile, retain_methylated=args.retain_methylated, counter=counter, sites=site_counter)
+            with ExitStack() as stack:
+                writers = _open_streaming_writers(samfile, args, stack)
+                for meth_patterns, meth_levels, read_ids, positions in chunks:
+                    summary.update(meth_patterns, meth_levels)
+                    _write_chunk(writers, meth_patterns, meth_levels, read_ids, positions)
+            sample = summary.to_sample()
+            sample.parsed_reads = counter.reads
+            sample.sites = site_counter
+            meth_data.add(sample)
+    else:
+        extract_meth(coordinates, samfiles, meth_data, retain_methylated=args.retain_methylated, engine=args.engine, epialleles=args.epialleles, jobs=args.jobs, read_ids=read_ids, sites=sites)
+    return meth_data
+
+
+def _extract_cached(coordinates, samfiles: list, reads2plot: int, args: argparse.Namespace) -> MethylationData:
+    """Same as _extract, sam files found in --cache-dir are loaded, the others extracted and added to the cache."""
+    cache = ExtractionCache(args.cache_dir, args.cache_size << 20)
+    options = {
+        "motif": MOTIF,
+        "retain_methylated": args.retain_methylated,
+        "epialleles": args.epialleles,
+        "read_ids": "npy" in args.outputs,
+        "sites": "sites" in args.outputs,
+    }
+    keys = {samfile: cache.key(samfile, args.fasta, **options) for samfile in samfiles}
+    samples = {samfile: cache.load(keys[samfile], samfile) for samfile in samfiles}
+    missing = [samfile for samfile in samfiles if samples[samfile] is None]
+    print(f"Cached sam files: {len(samfiles) - len(missing)} of {len(samfiles)}")
+    if missing:
+        extracted = _extract_uncached(coordinates, missing, reads2plot, args)
+        for samfile in missing:
+            samples[samfile] = [d for d in extracted.data if d.file_name == samfile]
+            cache.store(keys[samfile], samples[samfile])
+    meth_data = MethylationData()
+    for samfile in samfiles:
+        meth_data.data += samples[samfile]
+    return meth_data
+
+
+def _stream_contigs(contig_coordinates: dict, samfile: str, meth_data: MethylationData, reads2plot: int, args: argparse.Namespace) -> None:
+    """Streams a sam file aligned to several contigs, keeps a summary and streaming writers per contig."""
+    summaries = {}
+    writers = {}
+    counter = ReadCounter()
+    sites = {} if "sites" in args.outputs else None
+    with ExitStack() as stack:
+        chunks = stream_reads_by_contig(contig_coordinates, samfile, retain_methylated=args.retain_methylated, counter=counter, sites=sites)
+        for contig, meth_patterns, meth_levels, read_ids, positions in chunks:
+            if contig not in summaries:
+                summaries[contig] = MethylationSummary(samfile, len(contig_coordinates[contig]), reads2plot, seed=args.seed)
+                writers[contig] = _open_streaming_writers(f"{sample_name(samfile)}_{contig}", args, stack)
+            summaries[contig].update(meth_patterns, meth_levels)
+            _write_chunk(writers[contig], meth_patterns, meth_levels, read_ids, positions)
+    for contig in contig_coordinates:
+        if contig not in summaries:
+            if sites is None or contig not in sites:
+                continue
+            # every read of the contig was dropped, the sample only carries its site counts
+            summaries[contig] = MethylationSummary(samfile, len(contig_coordinates[contig]), reads2plot, seed=args.seed)
+        sample = summaries[contig].to_sample()
+        sample.contig = contig
+        sample.parsed_reads = counter.contigs[contig]
+        sample.sites = sites[contig] if sites is not None else None
+        meth_data.add(sample)
+
+
+def _open_streaming_writers(file_name: str, args: argparse.Namespace, stack: ExitStack) -> tuple:
+    """Opens the csv and read level tsv writers selected by --outputs, None if not selected."""
+    csv_writer = None
+    reads_writer = None
+    if "csv" in args.outputs:
+        csv_writer = stack.enter_context(StreamingCSVWriter(file_name, args.output_suffix))
+    if "tsv" in args.outputs:
+        reads_writer = stack.enter_context(StreamingReadsWriter(file_name, args.output_suffix, args.tsv_gzip))
+    return csv_writer, reads_writer
+
+
+def _write_chunk(writers: tuple, meth_patterns, meth_levels, read_ids, positions) -> None:
+    csv_writer, reads_writer = writers
+    if csv_writer is not None:
+        csv_writer.write(meth_levels)
+    if reads_writer is not None:
+        reads_writer.write(meth_patterns, meth_levels, read_ids, positions)
+
+
+def _save_outputs(meth_data: MethylationData, histmode: str, reads2plot: int, args: argparse.Namespace, coordinates=None, profiler: StageProfiler = None) -> None:
+    """Plots and saves extracted data as selected by --outputs, histmode None skips the histogram."""
+    profiler = profiler or StageProfiler(enabled=False)
+    samfiles = {d.file_name for d in meth_data.data}
+    samfile = samfiles.pop() if len(samfiles) == 1 else None
+    reads_number = sum(d.reads_number for d in meth_data.data)
+    if histmode is not None and "histogram" in args.outputs:
+        with profiler.stage("histogram", samfile) as record:
+            record["reads_retained"] = reads_number
+            _plot_histogram(meth_data, histmode, args.output_suffix)
+    if "heatmap" in args.outputs:
+        with profiler.stage("heatmap", samfile):
+            # plotting modules pull in matplotlib and seaborn, import them only when needed
+            from utils.heatmap import RasterHeatmapMaker, SimpleHeatmapMaker, make_heatmap
+
+            heatmap_maker = RasterHeatmapMaker(args.seed) if args.heatmap_renderer == "raster" else SimpleHeatmapMaker(args.seed)
+            make_heatmap(meth_data, heatmap_maker, reads2plot, args.output_suffix)
+    if "csv" in args.outputs and not args.stream:
+        with profiler.stage("csv", samfile) as record:
+            record["reads_retained"] = reads_number
+            save_data(meth_data, WriteMethlation2CSV(args.output_suffix))
+    if args.epialleles and not args.stream:
+        with profiler.stage("epialleles", samfile) as record:
+            record["reads_retained"] = reads_number
+            save_data(meth_data, WriteEpialleles2CSV(args.output_suffix))
+    if "sites" in args.outputs:
+        with profiler.stage("sites", samfile):
+            save_data(meth_data, WriteSites2CSV(args.output_suffix, coordinates))
+    if "npy" in args.outputs:
+        metadata = {
+            "fasta": args.fasta,
+            "motif": MOTIF,
+            "options": {
+                "retain_methylated": args.retain_methylated,
+                "epialleles": args.epialleles,
+                "engine": args.engine,
+                "output_suffix": args.output_suffix,
+            },
+        }
+        with profiler.stage("npy", samfile) as record:
+            record["reads_retained"] = reads_number
+            save_data(meth_data, WriteMethylation2Binary(args.output_suffix, metadata, coordinates))
+
+
+def _plot_histogram(meth_data: MethylationData, histmode: str, output_suffix: str) -> None:
+    from utils.histogram import MultipleDataHistogramMaker, SingleDataHistogramMaker, make_histogram
+
+    hist_maker = MultipleDataHistogramMaker() if histmode == "multiple" else SingleDataHistogramMaker()
+    make_histogram(meth_data, hist_maker, output_suffix)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(1 if main() else 0)
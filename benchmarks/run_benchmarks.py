@@ -0,0 +1,214 @@
+#!/usr/bin/env python3.10
+"""
+Benchmarks of the analysis stages on synthetic data.
+
+Every stage is timed (best of --repeat runs) and run once more under tracemalloc
+for its peak memory. Results can be saved as a baseline JSON, and later runs
+compared against it: stages slower or using more memory than the baseline by
+more than --tolerance are reported as regressions and the script exits with 1.
+Slowdowns under --min-delta-ms are timer noise and never reported.
+
+    python benchmarks/run_benchmarks.py --reads 200000 --save-baseline baseline.json
+    python benchmarks/run_benchmarks.py --reads 200000 --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset, make_reference, write_fasta
+from utils.fasta import get_coordinates
+from utils.meth_data import MethylationData, MethylationSummary
+from utils.sam import extract_meth, stream_meth
+from utils.save import WriteMethlation2CSV, save_data
+
+BASELINE_VERSION = 1
+# Slowdowns under this many seconds are not regressions, short stages vary by more than the tolerance
+MIN_DELTA_SECONDS = 0.01
+# Reads shown on heatmaps of the plotting stages
+HEATMAP_READS = 10000
+
+
+def _stages(fastafile: str, samfile: str, genomefile: str, workdir: str) -> dict:
+    """Stage name -> function running it, returning the number of reads it processed (None if it does not process reads).
+
+    genomefile is a long reference for the get_coordinates stage, the amplicon of fastafile is too short to time.
+    """
+    coordinates = get_coordinates(fastafile, cache=False)
+    extracted = MethylationData()
+    extract_meth(coordinates, [samfile], extracted, engine="numpy")
+    # plots and csv files are written next to the sample
+    extracted.data[0].file_name = os.path.join(workdir, "benchmark.sam")
+
+    def coordinates_stage():
+        get_coordinates(genomefile, cache=False)
+
+    def extract_stage(engine, epialleles=False):
+        def run():
+            storage = MethylationData()
+            extract_meth(coordinates, [samfile], storage, engine=engine, epialleles=epialleles)
+            return storage.data[0].reads_number
+        return run
+
+    def stream_stage():
+        summary = MethylationSummary(samfile, len(coordinates), HEATMAP_READS, seed=0)
+        for matrix, levels in stream_meth(coordinates, samfile):
+            summary.update(matrix, levels)
+        return summary.reads_number
+
+    def csv_stage():
+        save_data(extracted, WriteMethlation2CSV())
+        return extracted.data[0].reads_number
+
+    def histogram_stage():
+        from utils.histogram import SingleDataHistogramMaker, make_histogram
+
+        make_histogram(extracted, SingleDataHistogramMaker())
+        return extracted.data[0].reads_number
+
+    def heatmap_stage(renderer):
+        def run():
+            from utils.heatmap import RasterHeatmapMaker, SimpleHeatmapMaker, make_heatmap
+
+            maker = RasterHeatmapMaker(seed=0) if renderer == "raster" else SimpleHeatmapMaker(seed=0)
+            make_heatmap(extracted, maker, HEATMAP_READS)
+            return min(HEATMAP_READS, extracted.data[0].reads_number)
+        return run
+
+    return {
+        "get_coordinates": coordinates_stage,
+        "extract_python": extract_stage("python"),
+        "extract_numpy": extract_stage("numpy"),
+        "extract_epialleles": extract_stage("numpy", epialleles=True),
+        "stream": stream_stage,
+        "csv": csv_stage,
+        "histogram": histogram_stage,
+        "heatmap_raster": heatmap_stage("raster"),
+        "heatmap_seaborn": heatmap_stage("seaborn"),
+    }
+
+
+def run_stage(stage, repeat: int) -> dict:
+    """Times a stage and measures its peak traced memory."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reads = stage()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"seconds": min(seconds), "peak_mb": peak / 2**20}
+    if reads is not None:
+        result["reads_per_second"] = reads / result["seconds"]
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float = MIN_DELTA_SECONDS) -> list:
+    """Returns messages for stages slower or using more memory than the baseline by more than tolerance.
+
+    A stage is only slower if it also takes at least min_delta seconds longer.
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        slowdown = result["seconds"] - reference["seconds"]
+        if result["seconds"] > reference["seconds"] * (1 + tolerance) and slowdown >= min_delta:
+            regressions.append(f"{name}: {result['seconds']:.3f} s, baseline {reference['seconds']:.3f} s")
+        if result["peak_mb"] > reference["peak_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['peak_mb']:.1f} MB peak, baseline {reference['peak_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis stages on a synthetic bisulfite data set")
+    parser.add_argument("--reads", type=int, default=100000, help="Number of reads (default: 100000)")
+    parser.add_argument("--read-length", type=int, default=150, help="Read and amplicon length (default: 150)")
+    parser.add_argument("--cpg-density", type=float, default=0.05, help="Fraction of reference positions starting a CpG site (default: 0.05)")
+    parser.add_argument("--methylation", type=str, default="beta:2,2", help="Per read methylation probability: a number, beta:A,B or alleles:P1,P2,... (default: beta:2,2)")
+    parser.add_argument("--partial-rate", type=float, default=0.1, help="Fraction of reads not covering all CpG sites (default: 0.1)")
+    parser.add_argument("--reference-length", type=int, default=1000000, help="Length of the reference of the get_coordinates stage (default: 1000000)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data generator (default: 0)")
+    parser.add_argument("--stages", type=str, help="Comma separated stages to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage, the fastest is reported (default: 3)")
+    parser.add_argument("--baseline", type=str, help="Baseline JSON to compare with, regressions make the script exit with 1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown and memory growth over the baseline (default: 0.2)")
+    parser.add_argument("--min-delta-ms", type=float, default=MIN_DELTA_SECONDS * 1000, help=f"Smallest slowdown reported as a regression, in milliseconds (default: {MIN_DELTA_SECONDS * 1000:g})")
+    parser.add_argument("--save-baseline", type=str, help="Save the results as a baseline JSON")
+    args = parser.parse_args(argv)
+
+    parameters = {
+        "reads": args.reads,
+        "read_length": args.read_length,
+        "cpg_density": args.cpg_density,
+        "methylation": args.methylation,
+        "partial_rate": args.partial_rate,
+        "reference_length": args.reference_length,
+        "seed": args.seed,
+    }
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="allelicMeth_benchmark_") as tmpdir:
+        fastafile, samfile = make_dataset(
+            tmpdir, args.reads, args.read_length, args.cpg_density, args.methylation, args.partial_rate, args.seed
+        )
+        genomefile = os.path.join(tmpdir, "genome.fasta")
+        write_fasta(genomefile, make_reference(args.reference_length, args.cpg_density, args.seed))
+        stages = _stages(fastafile, samfile, genomefile, tmpdir)
+        selected = args.stages.split(",") if args.stages else list(stages)
+        unknown = set(selected).difference(stages)
+        if unknown:
+            print(f"Unknown stages: {', '.join(sorted(unknown))}, use any of: {', '.join(stages)}")
+            return 1
+        print(f"{'stage':<20}{'seconds':>10}{'reads/s':>14}{'peak MB':>10}")
+        for name in selected:
+            results[name] = run_stage(stages[name], args.repeat)
+            reads_per_second = results[name].get("reads_per_second")
+            rate = f"{reads_per_second:,.0f}" if reads_per_second is not None else "-"
+            print(f"{name:<20}{results[name]['seconds']:>10.3f}{rate:>14}{results[name]['peak_mb']:>10.1f}")
+
+    if args.save_baseline:
+        baseline = {
+            "version": BASELINE_VERSION,
+            "parameters": parameters,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "stages": results,
+        }
+        with open(args.save_baseline, "w") as fh:
+            json.dump(baseline, fh, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline.get("parameters") != parameters:
+            print("Warning: the baseline was measured with other parameters, results are not comparable")
+        regressions = compare(results, baseline["stages"], args.tolerance, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"Regressions over {args.tolerance:.0%} of the baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"No regressions over {args.tolerance:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Deterministic generator of bisulfite converted references and SAM files for benchmarks.
+
+Reads are generated in blocks with numpy, every file is fully determined by its parameters and seed.
+"""
+
+import os
+
+import numpy as np
+
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+_C, _G, _T = (ord(base) for base in "CGT")
+# Reads generated at once
+_BLOCK_READS = 10000
+
+
+def parse_methylation(spec: str):
+    """
+    Parse a distribution of per read methylation probabilities.
+
+    Args:
+        spec: "0.3" fixed probability, "beta:A,B" Beta(A, B) distributed,
+            "alleles:P1,P2,..." reads drawn evenly from alleles with the given probabilities
+
+    Returns:
+        Function (rng, reads_number) -> float array of probabilities
+    """
+    kind, _, values = spec.partition(":")
+    if not values:
+        probability = float(kind)
+        return lambda rng, n: np.full(n, probability)
+    values = [float(v) for v in values.split(",")]
+    if kind == "beta":
+        a, b = values
+        return lambda rng, n: rng.beta(a, b, n)
+    if kind == "alleles":
+        alleles = np.array(values)
+        return lambda rng, n: alleles[rng.integers(0, len(alleles), n)]
+    raise ValueError(f"Unknown methylation distribution '{spec}', use a probability, beta:A,B or alleles:P1,P2")
+
+
+def make_reference(length: int, cpg_density: float = 0.05, seed: int = 0) -> str:
+    """
+    Generate a random reference sequence.
+
+    Args:
+        length: Length of the sequence
+        cpg_density: Fraction of positions starting a CpG site
+        seed: Seed of the random generator
+
+    Returns:
+        str: Reference sequence
+    """
+    rng = np.random.default_rng(seed)
+    sequence = _BASES[rng.integers(0, 4, length)]
+    # remove random CpG sites, then place the requested number of sites
+    sequence[:-1][(sequence[:-1] == _C) & (sequence[1:] == _G)] = _T
+    sites = rng.choice(max(length - 1, 0), size=int(cpg_density * length), replace=False)
+    sequence[sites] = _C
+    sequence[sites + 1] = _G
+    return sequence.tobytes().decode("ascii")
+
+
+def write_fasta(path: str, reference: str, name: str = "ref") -> None:
+    with open(path, "w") as fh:
+        fh.write(f">{name}\n")
+        for start in range(0, len(reference), 60):
+            fh.write(reference[start:start + 60] + "\n")
+
+
+def write_sam(path: str, reference: str, reads_number: int, read_length: int = None, methylation: str = "beta:2,2",
+              partial_rate: float = 0.1, seed: int = 0, name: str = "ref") -> None:
+    """
+    Write bisulfite converted reads of a reference to a SAM file.
+
+    Full reads start at the reference start, partial reads start after the first CpG site
+    and do not cover all CpG sites. CpG sites are methylated with the probability of their
+    read, every other C is converted to T.
+
+    Args:
+        path: SAM file to write
+        reference: Reference sequence
+        reads_number: Number of reads
+        read_length: Length of full reads (default: length of the reference)
+        methylation: Distribution of methylation probabilities, see parse_methylation
+        partial_rate: Fraction of partial reads
+        seed: Seed of the random generator
+        name: Reference name (RNAME)
+    """
+    rng = np.random.default_rng(seed)
+    methylation_probability = parse_methylation(methylation)
+    read_length = min(read_length or len(reference), len(reference))
+    sequence = np.frombuffer(reference[:read_length].encode("ascii"), dtype=np.uint8)
+    cpg = np.zeros(read_length, dtype=bool)
+    cpg[:-1] = (sequence[:-1] == _C) & (sequence[1:] == _G)
+    converted = np.where(sequence == _C, _T, sequence).astype(np.uint8)
+    cpg_positions = np.flatnonzero(cpg)
+    first_partial_start = cpg_positions[0] + 1 if len(cpg_positions) else 1
+
+    with open(path, "w") as fh:
+        fh.write(f"@HD\tVN:1.6\tSO:unsorted\n@SQ\tSN:{name}\tLN:{len(reference)}\n")
+        for first in range(0, reads_number, _BLOCK_READS):
+            n = min(_BLOCK_READS, reads_number - first)
+            reads = np.repeat(converted[None, :], n, axis=0)
+            methylated = rng.random((n, len(cpg_positions))) < methylation_probability(rng, n)[:, None]
+            reads[:, cpg_positions] = np.where(methylated, _C, _T)
+            partial = rng.random(n) < partial_rate
+            starts = np.where(partial, rng.integers(first_partial_start, max(read_length, first_partial_start + 1), n), 0)
+            lines = []
+            for i, (read, start) in enumerate(zip(reads, starts.tolist())):
+                read = read[start:].tobytes().decode("ascii")
+                lines.append(f"read{first + i}\t0\t{name}\t{start + 1}\t60\t{len(read)}M\t*\t0\t0\t{read}\t*\n")
+            fh.write("".join(lines))
+
+
+def make_dataset(directory: str, reads_number: int, read_length: int = 150, cpg_density: float = 0.05,
+                 methylation: str = "beta:2,2", partial_rate: float = 0.1, seed: int = 0) -> tuple:
+    """
+    Write an amplicon reference and a SAM file of its reads to a directory.
+
+    Returns:
+        Tuple (fasta file, sam file)
+    """
+    reference = make_reference(read_length, cpg_density, seed)
+    fastafile = os.path.join(directory, "synthetic.fasta")
+    samfile = os.path.join(directory, "synthetic.sam")
+    write_fasta(fastafile, reference)
+    write_sam(samfile, reference, reads_number, read_length, methylation, partial_rate, seed)
+    return fastafile, samfile
@@ -7,14 +7,170 @@
 ################################################################################
 
 import argparse
+import io
+import json
 import logging
 import os
 import sys
 import subprocess
 import re
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stderr, redirect_stdout
 from datetime import datetime
 from pathlib import Path
 
+from allelicMeth import FAILED_SAM_PREFIX
+from utils.fasta import file_digest, get_contig_coordinates
+from utils.meth_data import SAM_EXTENSIONS, sample_name
+from utils.profile import merge_profiles, share_process
+
+
+def _init_analysis_worker():
+    """Prepare a worker process: import the analysis once, render plots without a display."""
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    import allelicMeth  # noqa: F401
+
+
+def _run_analysis_in_worker(args):
+    """
+    Run allelicMeth.main in a worker process, capturing its output.
+
+    Args:
+        args: Command line arguments of allelicMeth.py
+
+    Returns:
+        Tuple (success: bool, stdout: str, stderr: str)
+    """
+    import allelicMeth
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            failed = allelicMeth.main(args)
+        return not failed, stdout.getvalue(), stderr.getvalue()
+    except SystemExit as e:
+        # argparse exits on invalid arguments
+        return e.code in (None, 0), stdout.getvalue(), stderr.getvalue()
+    except Exception:
+        return False, stdout.getvalue(), stderr.getvalue() + traceback.format_exc()
+    finally:
+        # the peak RSS of this process now includes this run, later runs in the worker cannot report their own
+        share_process()
+
+
+# Time limit of one run of allelicMeth.py, in seconds
+RUN_TIMEOUT = 3600
+
+# Manifest of finished SAM files, written to the scanned directory in directory mode
+MANIFEST_NAME = "allelicMeth_manifest.json"
+MANIFEST_VERSION = 1
+
+# Endings of the outputs allelicMeth.py writes per sample, after the sample name and output suffix
+OUTPUT_ENDINGS = (
+    ".csv", "_histogram.png", "_heatmap.png", "_epialleles.csv", "_sites.csv", "_reads.tsv", "_reads.tsv.gz", "_meth",
+)
+
+# Profile allelicMeth.py --profile writes next to the first SAM file of a run with --profile
+PROFILE_SUFFIX = "_profile.json"
+
+
+class RunManifest:
+    """
+    Records the SAM files finished by directory mode runs in a JSON file.
+
+    Every entry holds size, mtime and sha256 of the SAM file and its FASTA file,
+    the options of the run and the outputs it produced. The manifest is rewritten
+    atomically after every finished run, so an interrupted batch resumes with the
+    SAM files that were not finished.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self._digests = {}
+        try:
+            with open(self.path) as fh:
+                manifest = json.load(fh)
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.entries = manifest["entries"]
+        except (OSError, ValueError, KeyError):
+            # no manifest yet, or an unreadable one: every SAM file is processed
+            pass
+
+    def is_done(self, fasta_file, sam_file, options):
+        """
+        Check whether a SAM file was finished with the same inputs and options.
+
+        Size and mtime are checked first, the content hash only when the mtime differs,
+        e.g. after the files were copied or touched.
+
+        Returns:
+            bool: True if inputs and options are unchanged and all recorded outputs exist
+        """
+        entry = self.entries.get(Path(sam_file).name)
+        if not entry or entry["options"] != options:
+            return False
+        if not self._same_file(fasta_file, entry["fasta"]) or not self._same_file(sam_file, entry["sam"]):
+            return False
+        return all((Path(sam_file).parent / output).exists() for output in entry["outputs"])
+
+    def record(self, fasta_file, sam_file, options, outputs):
+        """Record a finished SAM file with its outputs (file names in the SAM file directory)."""
+        self.entries[Path(sam_file).name] = {
+            "fasta": self._file_record(fasta_file),
+            "sam": self._file_record(sam_file),
+            "options": options,
+            "outputs": sorted(outputs),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def forget(self, sam_file):
+        """Drop the entry of a SAM file, e.g. after it failed."""
+        self.entries.pop(Path(sam_file).name, None)
+
+    def save(self):
+        """Write the manifest atomically: a crash leaves the previous manifest in place."""
+        fd, tmp_name = tempfile.mkstemp(dir=self.path.parent, prefix=".manifest_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, fh, indent=1, sort_keys=True)
+            os.replace(tmp_name, self.path)
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def _digest(self, path):
+        # FASTA files are shared by many SAM files, hash every file once per run
+        stat = os.stat(path)
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = file_digest(path)
+        return self._digests[key]
+
+    def _file_record(self, path):
+        stat = os.stat(path)
+        return {"name": Path(path).name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": self._digest(path)}
+
+    def _same_file(self, path, record):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != record["size"]:
+            return False
+        if stat.st_mtime_ns != record["mtime_ns"]:
+            if self._digest(path) != record["sha256"]:
+                return False
+            # same content, the new mtime saves hashing on the next run
+            record["mtime_ns"] = stat.st_mtime_ns
+        return True
+
 
 class AllelicMethOrchestrator:
     """Orchestrates execution of allelicMeth.py with intelligent file matching."""
@@ -75,9 +231,9 @@ class AllelicMethOrchestrator:
         self.logger.debug(f"allelicMeth.py found at {self.allelicmeth_script}")
         return True
 
-    def _run_allelicmeth(self, fasta_file, sam_files, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None):
+    def _build_allelicmeth_args(self, fasta_file, sam_files, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None, keep_going=False, profile=None):
         """
-        Execute allelicMeth.py with given parameters.
+        Build the command line arguments of allelicMeth.py.
 
         Args:
             fasta_file: Path to FASTA file
@@ -86,25 +242,53 @@ class AllelicMethOrchestrator:
             reads2plot: Optional number of reads to plot
             retain_methylated: Optional flag to retain only methylated reads
             output_suffix: Optional suffix for output filenames
+            keep_going: Optional flag to continue with the other SAM files when one fails
+            profile: Optional path of the profile JSON to record
 
         Returns:
-            Tuple (success: bool, stdout: str, stderr: str)
+            list: Arguments without interpreter and script
         """
-        cmd = [
-            "python3.10",
-            str(self.allelicmeth_script),
+        args = [
             "--fasta", str(fasta_file),
             "--sam", *[str(f) for f in sam_files]
         ]
 
         if mode:
-            cmd.extend(["--mode", mode])
+            args.extend(["--mode", mode])
         if reads2plot:
-            cmd.extend(["--reads2plot", str(reads2plot)])
+            args.extend(["--reads2plot", str(reads2plot)])
         if retain_methylated:
-            cmd.append("--retain-methylated")
+            args.append("--retain-methylated")
         if output_suffix:
-            cmd.extend(["--output-suffix", output_suffix])
+            args.extend(["--output-suffix", output_suffix])
+        if keep_going:
+            args.append("--keep-going")
+        if profile:
+            args.extend(["--profile", str(profile)])
+        return args
+
+    def _run_allelicmeth(self, fasta_file, sam_files, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None, keep_going=False, profile=None):
+        """
+        Execute allelicMeth.py with given parameters.
+
+        Args:
+            fasta_file: Path to FASTA file
+            sam_files: List of SAM file paths
+            mode: Optional mode (single/multiple)
+            reads2plot: Optional number of reads to plot
+            retain_methylated: Optional flag to retain only methylated reads
+            output_suffix: Optional suffix for output filenames
+            keep_going: Optional flag to continue with the other SAM files when one fails
+            profile: Optional path of the profile JSON to record
+
+        Returns:
+            Tuple (success: bool, stdout: str, stderr: str)
+        """
+        cmd = [
+            "python3.10",
+            str(self.allelicmeth_script),
+            *self._build_allelicmeth_args(fasta_file, sam_files, mode, reads2plot, retain_methylated, output_suffix, keep_going, profile)
+        ]
 
         self.logger.debug(f"Executing: {' '.join(cmd)}")
 
@@ -113,7 +297,7 @@ class AllelicMethOrchestrator:
                 cmd,
                 capture_output=True,
                 text=True,
-                timeout=3600  # 1 hour timeout
+                timeout=RUN_TIMEOUT
             )
 
             if result.returncode == 0:
@@ -130,7 +314,99 @@ class AllelicMethOrchestrator:
             self.logger.error(f"Error executing allelicMeth.py: {e}")
             return False, "", str(e)
 
-    def run_explicit_mode(self, fasta_file, sam_files, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None):
+    def _failed_sam_files(self, sam_files, success, stderr):
+        """
+        Find out which SAM files of a run failed.
+
+        Args:
+            sam_files: SAM files passed to allelicMeth.py
+            success: Whether the run succeeded
+            stderr: Error output of the run
+
+        Returns:
+            list: Failed SAM files; all of them if the run failed without reporting single files
+        """
+        if success:
+            return []
+        reported = set()
+        for line in (stderr or "").splitlines():
+            if line.startswith(FAILED_SAM_PREFIX):
+                reported.add(line[len(FAILED_SAM_PREFIX):].split("\t")[0])
+        failed = [f for f in sam_files if str(f) in reported]
+        return failed or list(sam_files)
+
+    def _collect_worker_result(self, future):
+        """
+        Wait for an analysis submitted to the worker pool.
+
+        Args:
+            future: Future returned by _run_analysis_in_worker
+
+        Returns:
+            Tuple (success: bool, stdout: str, stderr: str)
+
+        Raises:
+            BrokenProcessPool: If a worker process died
+        """
+        try:
+            success, stdout, stderr = future.result(timeout=RUN_TIMEOUT)
+        except BrokenProcessPool:
+            # a worker died, the caller restarts the pool
+            raise
+        except TimeoutError:
+            future.cancel()
+            self.logger.error("Process timed out after 1 hour")
+            return False, "", "Process timed out"
+        except Exception as e:
+            self.logger.error(f"Error executing allelicMeth.py: {e}")
+            return False, "", str(e)
+
+        if success:
+            self.logger.debug(f"Process stdout: {stdout}")
+        else:
+            self.logger.error(f"Process stderr: {stderr}")
+        return success, stdout, stderr
+
+    def _profile_path(self, sam_files, output_suffix):
+        """Profile file of a run, next to its first SAM file and named after it."""
+        sam_file = Path(sam_files[0])
+        return sam_file.parent / f"{sample_name(sam_file.name)}{output_suffix or ''}{PROFILE_SUFFIX}"
+
+    def _read_profile(self, path, since=None):
+        """
+        Read the profile a run wrote.
+
+        Args:
+            path: Profile file of the run
+            since: Optional start time of the run, an older file is left from another run
+
+        Returns:
+            dict: Profile, None if the run wrote none or it cannot be read
+        """
+        try:
+            if since is not None and os.path.getmtime(path) < since - 1:
+                return None
+            with open(path) as fh:
+                return json.load(fh)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not read profile {path}: {e}")
+            return None
+
+    def _log_profile_summary(self, profiles):
+        """Log the totals of the stages of all profiled runs."""
+        if not profiles:
+            return
+        self.logger.info("PROFILE")
+        self.logger.info(f"{'stage':<12}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'parsed':>12}{'retained':>12}{'reads/s':>14}{'peak RSS MB':>13}")
+        for stage, total in merge_profiles(profiles).items():
+            rate = f"{total['reads_per_second']:,.0f}" if total["reads_per_second"] is not None else "-"
+            peak = f"{total['peak_rss_mb']:.1f}" if total["peak_rss_mb"] is not None else "-"
+            self.logger.info(
+                f"{stage:<12}{total['runs']:>6}{total['wall_seconds']:>10.2f}{total['cpu_seconds']:>10.2f}"
+                f"{total['reads_parsed']:>12}{total['reads_retained']:>12}{rate:>14}{peak:>13}"
+            )
+
+    def run_explicit_mode(self, fasta_file, sam_files, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None, profile=False):
         """
         Run in explicit mode with provided files.
 
@@ -141,6 +417,7 @@ class AllelicMethOrchestrator:
             reads2plot: Optional number of reads to plot
             retain_methylated: Optional flag to retain only methylated reads
             output_suffix: Optional suffix for output filenames
+            profile: Optional flag to profile the run and log its stages
 
         Returns:
             bool: Success status
@@ -167,8 +444,9 @@ class AllelicMethOrchestrator:
         self.logger.info(f"Input SAM files: {sam_files}")
 
         # Run analysis
+        profile_path = self._profile_path(sam_paths, output_suffix) if profile else None
         success, stdout, stderr = self._run_allelicmeth(
-            fasta_path, sam_paths, mode, reads2plot, retain_methylated, output_suffix
+            fasta_path, sam_paths, mode, reads2plot, retain_methylated, output_suffix, profile=profile_path
         )
 
         if success:
@@ -176,6 +454,11 @@ class AllelicMethOrchestrator:
         else:
             self.logger.error("Execution failed")
 
+        if profile_path and success:
+            run_profile = self._read_profile(profile_path)
+            self.logger.info("=" * 80)
+            self._log_profile_summary([run_profile] if run_profile else [])
+
         self.logger.info("=" * 80)
         self.logger.info(f"Log file: {self.log_file}")
         self.logger.info("=" * 80)
@@ -218,11 +501,47 @@ class AllelicMethOrchestrator:
         """
         matching_files = []
         for filename in os.listdir(directory):
-            if filename.endswith(".sam") and region_identifier in filename:
+            if filename.endswith(SAM_EXTENSIONS) and region_identifier in filename:
                 matching_files.append(Path(directory) / filename)
         return sorted(matching_files)
 
-    def run_directory_mode(self, directory, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None):
+    def _find_outputs(self, sam_file, output_suffix, since, fasta_file=None):
+        """
+        Find the outputs allelicMeth.py wrote for a SAM file.
+
+        Outputs are written next to the SAM file and named after its samples: the SAM file
+        name without extension, followed by "_<record>" for every record of a FASTA file with
+        several records, the output suffix and one of OUTPUT_ENDINGS. Only these exact names
+        are looked up, so outputs of SAM files with longer names (S1_trim.sam for S1.sam) are not taken.
+
+        Args:
+            sam_file: Path to the SAM file
+            output_suffix: Suffix of the run
+            since: Start time of the run, older files are not outputs of the run
+            fasta_file: FASTA file of the run, its records name the samples of multi-record references
+
+        Returns:
+            list: Output file and directory names
+        """
+        sam_file = Path(sam_file)
+        samples = [sample_name(sam_file.name)]
+        if fasta_file is not None:
+            # allelicMeth.py caches the coordinates next to the FASTA, reading their record names is cheap
+            contigs = list(get_contig_coordinates(str(fasta_file)))
+            if len(contigs) > 1:
+                samples = [f"{samples[0]}_{contig}" for contig in contigs]
+        outputs = []
+        for sample in samples:
+            for ending in OUTPUT_ENDINGS:
+                name = sample + (output_suffix or "") + ending
+                try:
+                    if (sam_file.parent / name).stat().st_mtime >= since - 1:
+                        outputs.append(name)
+                except OSError:
+                    continue
+        return sorted(outputs)
+
+    def run_directory_mode(self, directory, mode=None, reads2plot=None, retain_methylated=False, output_suffix=None, jobs=1, group_by_region=False, force=False, profile=False):
         """
         Run in directory mode - scan for matching FASTA/SAM pairs.
 
@@ -232,6 +551,10 @@ class AllelicMethOrchestrator:
             reads2plot: Optional number of reads to plot
             retain_methylated: Optional flag to retain only methylated reads
             output_suffix: Optional suffix for output filenames
+            jobs: Number of pairs analysed in parallel worker processes (default: 1, one subprocess per pair)
+            group_by_region: Analyse all SAM files of a region in one run, so the FASTA is read once
+            force: Process all pairs, also the ones the manifest records as unchanged
+            profile: Profile every run and add the totals of its stages to the summary
 
         Returns:
             bool: Success status (True if all pairs processed successfully)
@@ -284,51 +607,146 @@ class AllelicMethOrchestrator:
             self.logger.info(f"Found {len(sam_files)} SAM file(s) for region '{region_id}'")
             for sam_file in sam_files:
                 self.logger.debug(f"  - {sam_file.name}")
-                file_pairs.append((fasta_file, [sam_file]))
+            if group_by_region:
+                file_pairs.append((fasta_file, sam_files))
+            else:
+                file_pairs.extend((fasta_file, [sam_file]) for sam_file in sam_files)
 
         if not file_pairs:
             self.logger.error("No valid FASTA/SAM file pairs found")
             return False
 
-        self.logger.info(f"Created {len(file_pairs)} file pair(s)")
+        # SAM files finished with unchanged inputs and options are skipped
+        manifest = RunManifest(directory / MANIFEST_NAME)
+        options = {
+            "mode": mode,
+            "reads2plot": reads2plot,
+            "retain_methylated": retain_methylated,
+            "output_suffix": output_suffix,
+        }
+        skipped_count = 0
+        if not force:
+            pending_pairs = []
+            for fasta_file, sam_files in file_pairs:
+                pending = [f for f in sam_files if not manifest.is_done(fasta_file, f, options)]
+                skipped_count += len(sam_files) - len(pending)
+                if pending:
+                    pending_pairs.append((fasta_file, pending))
+            file_pairs = pending_pairs
+            if skipped_count:
+                self.logger.info(f"Skipping {skipped_count} unchanged pair(s) recorded in {MANIFEST_NAME}")
+                manifest.save()
+        if not file_pairs:
+            self.logger.info("All pairs are up to date")
+            return True
+
+        pairs_number = sum(len(sam_files) for _, sam_files in file_pairs)
+        self.logger.info(f"Created {pairs_number} file pair(s)")
+        if group_by_region:
+            self.logger.info(f"Grouped into {len(file_pairs)} run(s), one per region")
         self.logger.info("=" * 80)
-        self.logger.info(f"Processing {len(file_pairs)} pair(s)...")
+        self.logger.info(f"Processing {pairs_number} pair(s)...")
         self.logger.info("=" * 80)
 
         # Process each pair
         success_count = 0
         failure_count = 0
         failed_pairs = []
+        profiles = []
+
+        # With several jobs all pairs are submitted to long-lived worker processes up front,
+        # results are then collected in the original order
+        executor = None
+        futures = []
+        run_args = []
+        workers = jobs
+        started = time.time()
+        if jobs > 1:
+            self.logger.info(f"Running analysis in {jobs} worker processes")
+            run_args = [
+                self._build_allelicmeth_args(
+                    fasta_file, sam_files, mode, reads2plot, retain_methylated, output_suffix, group_by_region,
+                    self._profile_path(sam_files, output_suffix) if profile else None
+                )
+                for fasta_file, sam_files in file_pairs
+            ]
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_analysis_worker)
+            futures = [executor.submit(_run_analysis_in_worker, args) for args in run_args]
 
         for idx, (fasta_file, sam_files) in enumerate(file_pairs, 1):
             self.logger.info(f"[{idx}/{len(file_pairs)}] Processing: {fasta_file.name} + {[f.name for f in sam_files]}")
 
             try:
-                success, stdout, stderr = self._run_allelicmeth(
-                    fasta_file, sam_files, mode, reads2plot, retain_methylated, output_suffix
-                )
-
-                if success:
+                if executor:
+                    while True:
+                        try:
+                            success, stdout, stderr = self._collect_worker_result(futures[idx - 1])
+                            break
+                        except BrokenProcessPool as e:
+                            # a worker died (crash, out of memory) and took the pool down with the pairs
+                            # not collected yet. They run again one at a time, so a pair breaking that
+                            # pool is the one that crashed and fails on its own
+                            crashed = workers == 1
+                            self.logger.error(f"Worker process died, restarting the pool: {e}")
+                            executor.shutdown(wait=False, cancel_futures=True)
+                            workers = 1
+                            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_analysis_worker)
+                            for i in range(idx if crashed else idx - 1, len(file_pairs)):
+                                finished = futures[i].done() and not futures[i].cancelled() and futures[i].exception() is None
+                                if not finished:
+                                    futures[i] = executor.submit(_run_analysis_in_worker, run_args[i])
+                            if crashed:
+                                success, stdout, stderr = False, "", f"Worker process died: {e}"
+                                break
+                else:
+                    success, stdout, stderr = self._run_allelicmeth(
+                        fasta_file, sam_files, mode, reads2plot, retain_methylated, output_suffix, group_by_region,
+                        self._profile_path(sam_files, output_suffix) if profile else None
+                    )
+                if profile and (success or group_by_region):
+                    # a grouped run with --keep-going still writes the profile of its other SAM files
+                    run_profile = self._read_profile(self._profile_path(sam_files, output_suffix), started)
+                    if run_profile:
+                        profiles.append(run_profile)
+
+                # every SAM file of a grouped run is accounted for on its own
+                failed_sams = self._failed_sam_files(sam_files, success, stderr)
+                success_count += len(sam_files) - len(failed_sams)
+                failure_count += len(failed_sams)
+                for sam_file in sam_files:
+                    if sam_file in failed_sams:
+                        manifest.forget(sam_file)
+                    else:
+                        manifest.record(fasta_file, sam_file, options, self._find_outputs(sam_file, output_suffix, started, fasta_file))
+                manifest.save()
+                if not failed_sams:
                     self.logger.info(f"[{idx}/{len(file_pairs)}] SUCCESS")
-                    success_count += 1
                 else:
+                    for sam_file in sam_files:
+                        status = "FAILED" if sam_file in failed_sams else "SUCCESS"
+                        if len(sam_files) > 1:
+                            self.logger.info(f"[{idx}/{len(file_pairs)}]   {sam_file.name}: {status}")
                     self.logger.error(f"[{idx}/{len(file_pairs)}] FAILED")
                     if stderr:
                         self.logger.error(f"Error details: {stderr}")
-                    failure_count += 1
-                    failed_pairs.append((fasta_file.name, [f.name for f in sam_files]))
+                    failed_pairs.extend((fasta_file.name, [f.name]) for f in failed_sams)
             except Exception as e:
                 self.logger.error(f"[{idx}/{len(file_pairs)}] FAILED with exception: {e}", exc_info=True)
-                failure_count += 1
-                failed_pairs.append((fasta_file.name, [f.name for f in sam_files]))
+                failure_count += len(sam_files)
+                failed_pairs.extend((fasta_file.name, [f.name]) for f in sam_files)
 
             self.logger.info("-" * 80)
 
+        if executor:
+            executor.shutdown()
+
         # Summary report
         self.logger.info("=" * 80)
         self.logger.info("BATCH PROCESSING COMPLETE")
         self.logger.info("=" * 80)
-        self.logger.info(f"Total pairs: {len(file_pairs)}")
+        self.logger.info(f"Total pairs: {pairs_number}")
+        if skipped_count:
+            self.logger.info(f"Skipped (unchanged): {skipped_count}")
         self.logger.info(f"Successful: {success_count}")
         self.logger.info(f"Failed: {failure_count}")
 
@@ -337,6 +755,10 @@ class AllelicMethOrchestrator:
             for fasta_name, sam_names in failed_pairs:
                 self.logger.warning(f"  - {fasta_name} + {sam_names}")
 
+        if profiles:
+            self.logger.info("-" * 80)
+            self._log_profile_summary(profiles)
+
         self.logger.info("=" * 80)
         self.logger.info(f"Log file: {self.log_file}")
         self.logger.info("=" * 80)
@@ -359,6 +781,15 @@ Examples:
 
   # Directory mode with custom log file
   python run_allelicMeth.py --mode directory --dir ./data/ --log ./logs/batch.log
+
+  # Directory mode with 8 worker processes
+  python run_allelicMeth.py --mode directory --dir ./data/ --jobs 8
+
+  # Directory mode reprocessing pairs already recorded in the manifest
+  python run_allelicMeth.py --mode directory --dir ./data/ --force
+
+  # Directory mode with a per stage profile of every run in the summary
+  python run_allelicMeth.py --mode directory --dir ./data/ --profile
         """
     )
 
@@ -423,6 +854,31 @@ Examples:
         help="Suffix to append to output filenames before extension (e.g., '_retained', '_20240218'). Useful for distinguishing different analysis runs."
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Directory mode: number of pairs analysed in parallel worker processes (default: 1)"
+    )
+
+    parser.add_argument(
+        "--group-by-region",
+        action="store_true",
+        help="Directory mode: analyse all SAM files of a region in one run, reading its FASTA once; failures are still reported per SAM file"
+    )
+
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=f"Directory mode: process all pairs, also the ones {MANIFEST_NAME} records as finished with unchanged inputs and options"
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Profile every run with allelicMeth.py --profile, writing <sam name><suffix>{PROFILE_SUFFIX} next to its first SAM file, and log the stage totals in the summary"
+    )
+
     args = parser.parse_args()
 
     # Determine log level
@@ -447,7 +903,8 @@ Examples:
                 mode=args.allelicmeth_mode,
                 reads2plot=args.reads2plot,
                 retain_methylated=args.retain_methylated,
-                output_suffix=args.output_suffix
+                output_suffix=args.output_suffix,
+                profile=args.profile
             )
 
         else:  # directory mode
@@ -461,7 +918,11 @@ Examples:
                 mode=args.allelicmeth_mode,
                 reads2plot=args.reads2plot,
                 retain_methylated=args.retain_methylated,
-                output_suffix=args.output_suffix
+                output_suffix=args.output_suffix,
+                jobs=args.jobs,
+                group_by_region=args.group_by_region,
+                force=args.force,
+                profile=args.profile
             )
 
         return 0 if success else 1
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the synthetic data generator and the benchmark runner in benchmarks/.
+"""
+
+import filecmp
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from benchmarks import run_benchmarks
+from benchmarks.synthetic import make_dataset, make_reference, parse_methylation
+from utils.fasta import get_coordinates
+from utils.meth_data import MethylationData
+from utils.sam import extract_meth
+
+
+def test_reference_cpg_density():
+    reference = make_reference(100000, cpg_density=0.03, seed=1)
+    assert reference == make_reference(100000, cpg_density=0.03, seed=1)
+    assert set(reference) == set("ACGT")
+    assert abs(reference.count("CG") / len(reference) - 0.03) < 0.005
+    print("✓ reference cpg density")
+
+
+def test_dataset_is_deterministic():
+    with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+        files = make_dataset(first, 3000, seed=4)
+        assert all(filecmp.cmp(a, b, shallow=False) for a, b in zip(files, make_dataset(second, 3000, seed=4)))
+    print("✓ data set is deterministic")
+
+
+def test_reads_follow_the_parameters():
+    """Partial reads are dropped, levels follow the methylation distribution."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # unmethylated reads are dropped by the extraction like partial reads
+        for methylation, expected_reads in (("1", 3000), ("alleles:0,1", 1500), ("0", 0)):
+            fastafile, samfile = make_dataset(tmpdir, 4000, read_length=100, methylation=methylation, partial_rate=0.25, seed=2)
+            storage = MethylationData()
+            extract_meth(get_coordinates(fastafile, cache=False), [samfile], storage, engine="numpy")
+            sample = storage.data[0]
+            assert abs(sample.reads_number - expected_reads) < 150
+            assert set(sample.levels.tolist()) <= {1.0}
+
+        fastafile, samfile = make_dataset(tmpdir, 4000, read_length=100, methylation="beta:6,2", partial_rate=0, seed=2)
+        storage = MethylationData()
+        extract_meth(get_coordinates(fastafile, cache=False), [samfile], storage, engine="numpy")
+        assert abs(storage.data[0].reads_number - 4000) < 40
+        assert abs(storage.data[0].levels.mean() - 0.75) < 0.02
+    assert parse_methylation("beta:1,1")(np.random.default_rng(0), 5).shape == (5,)
+    print("✓ reads follow the parameters")
+
+
+def test_baseline_comparison():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        baseline = os.path.join(tmpdir, "baseline.json")
+        argv = ["--reads", "2000", "--reference-length", "10000", "--repeat", "1", "--stages", "extract_numpy,csv"]
+        assert run_benchmarks.main(argv + ["--save-baseline", baseline]) == 0
+        with open(baseline) as fh:
+            saved = json.load(fh)
+        assert set(saved["stages"]) == {"extract_numpy", "csv"}
+        assert saved["stages"]["extract_numpy"]["reads_per_second"] > 0
+
+        # a baseline much faster than any run is flagged
+        for stage in saved["stages"].values():
+            stage["seconds"] /= 1000
+        with open(baseline, "w") as fh:
+            json.dump(saved, fh)
+        assert run_benchmarks.main(argv + ["--baseline", baseline, "--min-delta-ms", "0"]) == 1
+        assert run_benchmarks.compare({"csv": {"seconds": 1.0, "peak_mb": 1.0}}, {"csv": {"seconds": 1.0, "peak_mb": 1.0}}, 0.2) == []
+        # short stages are compared with an absolute floor
+        assert run_benchmarks.compare({"csv": {"seconds": 0.006, "peak_mb": 1.0}}, {"csv": {"seconds": 0.004, "peak_mb": 1.0}}, 0.2) == []
+        assert len(run_benchmarks.compare({"csv": {"seconds": 0.02, "peak_mb": 1.0}}, {"csv": {"seconds": 0.004, "peak_mb": 1.0}}, 0.2)) == 1
+    print("✓ baseline comparison")
+
+
+def main():
+    print("=" * 60)
+    print("Testing benchmarks")
+    print("=" * 60)
+
+    try:
+        test_reference_cpg_density()
+        test_dataset_is_deterministic()
+        test_reads_follow_the_parameters()
+        test_baseline_comparison()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the binary result format: read names kept during extraction and
+the directory of numpy files written by WriteMethylation2Binary.
+"""
+
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+import allelicMeth
+from test_compressed_input import _sam_to_bam
+from test_sam_engines import REFERENCE, _coordinates, _write_test_sam
+from utils.meth_data import MethylationData
+from utils.sam import extract_meth
+from utils.save import WriteMethylation2Binary, load_binary_results, save_data
+
+
+def test_read_ids_match_across_engines():
+    """Every engine keeps the names of the same reads, in the order of their patterns."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        bamfile = os.path.join(tmpdir, "sample.bam")
+        _write_test_sam(samfile, reads_number=500)
+        _sam_to_bam(samfile, bamfile)
+
+        results = []
+        for engine, samfiles, jobs in (("python", [samfile], 1), ("numpy", [samfile], 1), ("numpy", [samfile], 3), ("numpy", [bamfile], 1)):
+            storage = MethylationData()
+            extract_meth(coordinates, samfiles, storage, retain_methylated=True, engine=engine, jobs=jobs, read_ids=True)
+            results.append(storage.data[0])
+        reference = results[0]
+        assert 0 < len(reference.read_ids) == reference.reads_number < 500
+        for result in results:
+            assert result.read_ids.tolist() == reference.read_ids.tolist()
+            assert (result.matrix() == reference.matrix()).all()
+
+        # read names are only kept when asked for
+        storage = MethylationData()
+        extract_meth(coordinates, [samfile], storage, engine="numpy")
+        assert storage.data[0].read_ids is None
+    print("✓ read ids match across engines")
+
+
+def test_binary_results_round_trip():
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile)
+        storage = MethylationData()
+        extract_meth(coordinates, [samfile], storage, engine="numpy", read_ids=True)
+        save_data(storage, WriteMethylation2Binary("_run1", {"motif": "CG"}, coordinates))
+
+        results = load_binary_results(os.path.join(tmpdir, "sample_run1_meth"))
+        sample = storage.data[0]
+        assert isinstance(results["matrix"], np.memmap)
+        assert results["matrix"].dtype == np.int8
+        assert (results["matrix"] == sample.matrix()).all()
+        assert np.allclose(results["levels"], sample.levels)
+        assert results["read_ids"].tolist() == sample.read_ids.tolist()
+        assert results["coordinates"].tolist() == coordinates
+        assert "weights" not in results
+        assert results["metadata"]["motif"] == "CG"
+        assert results["metadata"]["reads_number"] == sample.reads_number
+    print("✓ binary results round trip")
+
+
+def test_npy_output_from_command_line():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        _write_test_sam(samfile)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            allelicMeth.main(["--fasta", fastafile, "--sam", samfile, "--outputs", "csv,npy", "--epialleles"])
+        finally:
+            os.chdir(cwd)
+
+        results = load_binary_results(os.path.join(tmpdir, "sample_meth"), mmap_mode=None)
+        with open(os.path.join(tmpdir, "sample.csv")) as fh:
+            levels = [float(line) for line in fh]
+        # epialleles are stored once with their read counts, without read names
+        assert np.allclose(np.repeat(results["levels"], results["weights"]), levels)
+        assert "read_ids" not in results
+        with open(os.path.join(tmpdir, "sample_meth", "metadata.json")) as fh:
+            metadata = json.load(fh)
+        assert metadata["fasta"] == fastafile
+        assert metadata["options"]["epialleles"] is True
+    print("✓ npy output from the command line")
+
+
+def main():
+    print("=" * 60)
+    print("Testing binary results")
+    print("=" * 60)
+
+    try:
+        test_read_ids_match_across_engines()
+        test_binary_results_round_trip()
+        test_npy_output_from_command_line()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3.10
+"""
+Tests for CIGAR aware calling: CpG sites are projected onto read offsets along the alignment.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+from test_sam_engines import REFERENCE, _bisulfite_read, _coordinates
+from utils.cigar import CigarProjection
+from utils.meth_data import METHYLATED_CALL, MISSING_CALL, MethylationData
+from utils.sam import _call_meth_batch, extract_meth
+
+
+def _gapped_read(read: str, rng: random.Random) -> tuple:
+    """Adds soft clips, an insertion or a deletion to an ungapped read, returns (sequence, cigar)."""
+    kind = rng.choice(["clip", "insertion", "deletion", "none"])
+    if kind == "clip":
+        return "GGA" + read + "TT", f"3S{len(read)}M2S"
+    if kind == "insertion":
+        # the insertion is placed between bases which are not part of a CpG site
+        at = 4
+        return read[:at] + "AAT" + read[at:], f"{at}M3I{len(read) - at}M"
+    if kind == "deletion":
+        at = 10
+        return read[:at] + read[at + 2 :], f"{at}M2D{len(read) - at - 2}M"
+    return read, f"{len(read)}M"
+
+
+def test_projection_offsets():
+    coordinates = _coordinates()
+    projection = CigarProjection(coordinates)
+    c_offsets, g_offsets = projection.offsets("3S10M2I5M1D30M", 0)
+    for coordinate, c, g in zip(coordinates, c_offsets.tolist(), g_offsets.tolist()):
+        for position, offset in ((coordinate, c), (coordinate + 1, g)):
+            if position < 10:
+                assert offset == position + 3
+            elif position < 15:
+                assert offset == position + 5
+            elif position == 15:
+                assert offset == -1  # deleted
+            else:
+                assert offset == position + 4
+    assert projection.offsets("3S10M2I5M1D30M", 0) is projection.offsets("3S10M2I5M1D30M", 0)
+    print("✓ cigar projection offsets")
+
+
+def test_gapped_reads_match_ungapped():
+    """A read called through its cigar gives the pattern of the same read without the gaps."""
+    coordinates = _coordinates()
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        gapped_sam = os.path.join(tmpdir, "gapped.sam")
+        plain_sam = os.path.join(tmpdir, "plain.sam")
+        deleted = []
+        with open(gapped_sam, "w") as gapped, open(plain_sam, "w") as plain:
+            for n in range(400):
+                read = _bisulfite_read(REFERENCE, 0, len(REFERENCE), rng)
+                sequence, cigar = _gapped_read(read, rng)
+                gapped.write(f"read{n}\t0\tref\t1\t60\t{cigar}\t*\t0\t0\t{sequence}\t*\n")
+                if "D" in cigar:
+                    # the deleted bases hold a CpG site, the read loses the site and is dropped
+                    deleted.append(n)
+                    read = read[:10] + "NN" + read[12:]
+                plain.write(f"read{n}\t0\tref\t1\t60\t{len(read)}M\t*\t0\t0\t{read}\t*\n")
+        assert deleted and any(REFERENCE[i : i + 2] == "CG" for i in range(9, 12))
+
+        results = []
+        for engine in ("python", "numpy"):
+            for samfile in (gapped_sam, plain_sam):
+                storage = MethylationData()
+                extract_meth(coordinates, [samfile], storage, engine=engine)
+                results.append(storage.data[0])
+        reference = results[-1]
+        assert reference.reads_number > 0
+        for result in results:
+            assert (result.matrix() == reference.matrix()).all()
+            assert result.reads_number == reference.reads_number
+    print("✓ gapped reads match ungapped reads")
+
+
+def test_soft_clip_is_not_called():
+    """Soft clipped bases are not read as the CpG sites next to the alignment start."""
+    coordinates = _coordinates()
+    read = REFERENCE[3:]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "clipped.sam")
+        with open(samfile, "w") as fh:
+            # the clipped "ACG" would otherwise be called as the CpG at reference position 1
+            fh.write(f"read0\t0\tref\t4\t60\t3S{len(read)}M\t*\t0\t0\tACG{read}\t*\n")
+        storage = MethylationData()
+        extract_meth(coordinates, [samfile], storage, engine="numpy")
+    projected = {0: CigarProjection(coordinates).offsets(f"3S{len(read)}M", 3)}
+    matrix, _ = _call_meth_batch(np.asarray(coordinates), ["ACG" + read], [3], projected)
+    assert matrix[0, 0] == MISSING_CALL
+    assert (matrix[0, 1:] == METHYLATED_CALL).all()
+    assert storage.data[0].reads_number == 0
+    print("✓ soft clipped bases are not called")
+
+
+def test_missing_sequence_is_not_called():
+    """Alignments with SEQ '*' but a real CIGAR, e.g. secondary alignments, are dropped by every engine."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "secondary.sam")
+        with open(samfile, "w") as fh:
+            fh.write(f"read0\t0\tref\t1\t60\t{len(REFERENCE)}M\t*\t0\t0\t{REFERENCE}\t*\n")
+            fh.write(f"read0\t256\tref\t1\t60\t{len(REFERENCE)}M\t*\t0\t0\t*\t*\n")
+            fh.write(f"read1\t256\tref\t1\t60\t3S{len(REFERENCE)}M\t*\t0\t0\t*\t*\n")
+        for engine in ("python", "numpy"):
+            storage = MethylationData()
+            extract_meth(coordinates, [samfile], storage, engine=engine)
+            assert storage.data[0].reads_number == 1, engine
+            assert storage.data[0].parsed_reads == 3, engine
+    print("✓ missing sequences are not called")
+
+
+def main():
+    print("=" * 60)
+    print("Testing cigar aware calling")
+    print("=" * 60)
+
+    try:
+        test_projection_offsets()
+        test_gapped_reads_match_ungapped()
+        test_soft_clip_is_not_called()
+        test_missing_sequence_is_not_called()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
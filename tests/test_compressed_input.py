@@ -0,0 +1,141 @@
+#!/usr/bin/env python3.10
+"""
+Tests for reading gzip compressed sam and bam files in utils/sam.py.
+Checks that compressed input gives the same results as the plain sam file.
+"""
+
+import gzip
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+from test_sam_engines import REFERENCE, _coordinates, _write_test_sam
+from utils.bam import iter_bam_records
+from utils.meth_data import MethylationData, sample_name
+from utils.sam import extract_meth
+
+_SEQ_CODES = "=ACMGRSVTWYHKDBN"
+
+
+def _bgzf_block(data: bytes) -> bytes:
+    """Compresses data into one BGZF block, a gzip member with the BC extra field."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    extra = struct.pack("<BBHH", 66, 67, 2, len(deflated) + 25)
+    header = b"\x1f\x8b\x08\x04" + b"\x00" * 4 + b"\x00\xff" + struct.pack("<H", len(extra)) + extra
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+def _sam_to_bam(samfile: str, bamfile: str, block_size: int = 1000) -> None:
+    """Writes the reads of a sam file as a bam file, split into small blocks so records cross block borders."""
+    text = b""
+    records = []
+    with open(samfile) as fh:
+        for line in fh:
+            if line.startswith("@"):
+                text += line.encode()
+                continue
+            name, flag, _, pos, mapq, _, _, _, _, seq, _ = line.rstrip("\n").split("\t")
+            read_name = name.encode() + b"\x00"
+            cigar = struct.pack("<I", len(seq) << 4)  # one M operation
+            packed = bytearray()
+            padded = seq + "=" * (len(seq) % 2)
+            for i in range(0, len(padded), 2):
+                packed.append(_SEQ_CODES.index(padded[i]) << 4 | _SEQ_CODES.index(padded[i + 1]))
+            body = struct.pack(
+                "<iiBBHHHIiii", 0, int(pos) - 1, len(read_name), int(mapq), 0, 1, int(flag), len(seq), -1, -1, 0
+            ) + read_name + cigar + bytes(packed) + b"\xff" * len(seq)
+            records.append(struct.pack("<i", len(body)) + body)
+    data = b"BAM\x01" + struct.pack("<i", len(text)) + text
+    data += struct.pack("<ii", 1, 4) + b"ref\x00" + struct.pack("<i", len(REFERENCE))
+    data += b"".join(records)
+    with open(bamfile, "wb") as fh:
+        for i in range(0, len(data), block_size):
+            fh.write(_bgzf_block(data[i : i + block_size]))
+        fh.write(_bgzf_block(b""))  # end of file marker
+
+
+def test_bam_records_match_sam():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        bamfile = os.path.join(tmpdir, "sample.bam")
+        _write_test_sam(samfile, 200, seed=3)
+        _sam_to_bam(samfile, bamfile)
+        with open(samfile) as fh:
+            expected = [line.split("\t") for line in fh if not line.startswith("@")]
+        records = list(iter_bam_records(bamfile))
+        assert len(records) == len(expected)
+        for (sequence, pos, flag, cigar, reference, name), fields in zip(records, expected):
+            assert sequence == fields[9]
+            assert pos == int(fields[3]) - 1
+            assert flag == int(fields[1])
+            assert cigar == fields[5]
+            assert reference == fields[2]
+            assert name == fields[0]
+    print("✓ bam records decode to the sam fields")
+
+
+def test_compressed_input_matches_sam():
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile, 500, seed=4)
+        with open(samfile, "rb") as src, gzip.open(samfile + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        _sam_to_bam(samfile, os.path.join(tmpdir, "sample.bam"))
+
+        for engine in ("python", "numpy"):
+            results = {}
+            for extension in (".sam", ".sam.gz", ".bam"):
+                storage = MethylationData()
+                extract_meth(coordinates, [os.path.join(tmpdir, "sample" + extension)], storage, engine=engine)
+                results[extension] = storage.data[0]
+            expected = results[".sam"]
+            assert expected.reads_number > 0
+            for extension in (".sam.gz", ".bam"):
+                assert (results[extension].matrix() == expected.matrix()).all(), (engine, extension)
+                assert np.allclose(results[extension].meth_levels, expected.meth_levels)
+    print("✓ sam.gz and bam input match plain sam")
+
+
+def test_sample_name_strips_extension():
+    assert sample_name("Gx_a.sam") == "Gx_a"
+    assert sample_name("dir/sample.sam.gz") == "dir/sample"
+    assert sample_name("sample.bam") == "sample"
+    print("✓ sample names drop the alignment file extension")
+
+
+def main():
+    print("=" * 60)
+    print("Testing compressed sam and bam input")
+    print("=" * 60)
+
+    try:
+        test_bam_records_match_sam()
+        test_compressed_input_matches_sam()
+        test_sample_name_strips_extension()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
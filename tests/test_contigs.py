@@ -0,0 +1,126 @@
+#!/usr/bin/env python3.10
+"""
+Tests for references with several contigs: reads are routed to their contig by RNAME.
+Checks that one pass over a mixed sam file gives the same samples as one sam file per contig.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+from test_sam_engines import REFERENCE, _bisulfite_read
+from utils.fasta import get_contig_coordinates
+from utils.meth_data import MethylationData
+from utils.sam import extract_meth, extract_meth_by_contig, stream_meth_by_contig
+
+CONTIGS = {"amplicon1": REFERENCE, "amplicon2": "TTCGCGAACGTTACGGA", "no_cpg": "TTAATTAA"}
+
+
+def _write_fasta(path: str) -> None:
+    with open(path, "w") as fh:
+        for name, sequence in CONTIGS.items():
+            fh.write(f">{name} amplicon\n{sequence}\n")
+
+
+def _write_mixed_sam(path: str, reads_number: int = 600, seed: int = 5) -> None:
+    """Writes reads of all contigs in random order, plus unmapped reads and reads of an unknown contig."""
+    rng = random.Random(seed)
+    with open(path, "w") as fh:
+        fh.write("@HD\tVN:1.6\n")
+        for n in range(reads_number):
+            contig = rng.choice(list(CONTIGS) + ["*", "other"])
+            reference = CONTIGS.get(contig, REFERENCE)
+            sequence = _bisulfite_read(reference, 0, len(reference), rng)
+            fh.write(f"read{n}\t0\t{contig}\t1\t60\t{len(sequence)}M\t*\t0\t0\t{sequence}\t*\n")
+
+
+def _split_by_contig(samfile: str, tmpdir: str) -> dict:
+    """Writes the reads of every contig to its own sam file."""
+    files = {}
+    with open(samfile) as fh:
+        for line in fh:
+            if line.startswith("@"):
+                continue
+            contig = line.split("\t")[2]
+            path = os.path.join(tmpdir, f"{contig}.sam")
+            with open(path, "a") as out:
+                out.write(line)
+            files[contig] = path
+    return files
+
+
+def test_contig_coordinates():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        _write_fasta(fastafile)
+        for cache in (False, True, True):
+            contig_coordinates = get_contig_coordinates(fastafile, cache=cache)
+            assert list(contig_coordinates) == list(CONTIGS)
+            for name, sequence in CONTIGS.items():
+                assert contig_coordinates[name] == [i for i in range(len(sequence) - 1) if sequence[i : i + 2] == "CG"]
+    print("✓ coordinates per contig")
+
+
+def test_routing_matches_one_file_per_contig():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        samfile = os.path.join(tmpdir, "mixed.sam")
+        _write_fasta(fastafile)
+        _write_mixed_sam(samfile)
+        contig_coordinates = get_contig_coordinates(fastafile, cache=False)
+        per_contig = _split_by_contig(samfile, tmpdir)
+
+        for epialleles in (False, True):
+            routed = MethylationData()
+            extract_meth_by_contig(contig_coordinates, [samfile], routed, epialleles=epialleles)
+            # contigs without CpG sites and reads of unknown contigs are skipped
+            assert [d.contig for d in routed.data] == ["amplicon1", "amplicon2"]
+            for meth in routed.data:
+                expected = MethylationData()
+                extract_meth(contig_coordinates[meth.contig], [per_contig[meth.contig]], expected, engine="numpy", epialleles=epialleles)
+                assert meth.reads_number == expected.data[0].reads_number > 0
+                assert (meth.matrix() == expected.data[0].matrix()).all()
+                assert (meth.weights == expected.data[0].weights).all()
+                assert meth.name == f"{samfile[:-4]}_{meth.contig}"
+
+        levels = {}
+        for contig, _, meth_levels in stream_meth_by_contig(contig_coordinates, samfile, chunk_size=50):
+            levels.setdefault(contig, []).append(meth_levels)
+        routed = MethylationData()
+        extract_meth_by_contig(contig_coordinates, [samfile], routed)
+        for meth in routed.data:
+            assert np.allclose(np.concatenate(levels[meth.contig]), meth.levels)
+    print("✓ routing by RNAME matches one sam file per contig")
+
+
+def main():
+    print("=" * 60)
+    print("Testing references with several contigs")
+    print("=" * 60)
+
+    try:
+        test_contig_coordinates()
+        test_routing_matches_one_file_per_contig()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the extraction cache in utils/cache.py and --cache-dir of allelicMeth.py.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import allelicMeth
+from test_contigs import _write_fasta, _write_mixed_sam
+from test_sam_engines import REFERENCE, _coordinates, _write_test_sam
+from utils.cache import EXTRACTION_CACHE_SUFFIX, ExtractionCache
+from utils.fasta import get_contig_coordinates
+from utils.meth_data import MethylationData
+from utils.sam import extract_meth, extract_meth_by_contig
+
+
+def _same_samples(first: list, second: list) -> bool:
+    return len(first) == len(second) and all(
+        a.reads_number == b.reads_number
+        and a.contig == b.contig
+        and (a.matrix() == b.matrix()).all()
+        and (a.weights == b.weights).all()
+        and (a.read_ids is None) == (b.read_ids is None)
+        for a, b in zip(first, second)
+    )
+
+
+def test_cache_round_trip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        samfile = os.path.join(tmpdir, "mixed.sam")
+        _write_fasta(fastafile)
+        _write_mixed_sam(samfile)
+        cache = ExtractionCache(os.path.join(tmpdir, "cache"))
+        for epialleles in (False, True):
+            storage = MethylationData()
+            extract_meth_by_contig(get_contig_coordinates(fastafile, cache=False), [samfile], storage, epialleles=epialleles, read_ids=not epialleles)
+            key = cache.key(samfile, fastafile, motif="CG", epialleles=epialleles)
+            assert cache.load(key, samfile) is None
+            cache.store(key, storage.data)
+            assert _same_samples(cache.load(key, samfile), storage.data)
+
+        # keys follow the content: a copy hits, other options or a changed file miss
+        copy = os.path.join(tmpdir, "copy.sam")
+        shutil.copy(samfile, copy)
+        key = cache.key(samfile, fastafile, motif="CG", epialleles=False)
+        assert cache.key(copy, fastafile, motif="CG", epialleles=False) == key
+        assert cache.load(key, copy)[0].file_name == copy
+        assert cache.key(samfile, fastafile, motif="CG", epialleles=False, retain_methylated=True) != key
+        with open(copy, "a") as fh:
+            fh.write(f"extra\t0\tamplicon1\t1\t60\t{len(REFERENCE)}M\t*\t0\t0\t{REFERENCE}\t*\n")
+        assert cache.key(copy, fastafile, motif="CG", epialleles=False) != key
+    print("✓ cache round trip")
+
+
+def test_least_recently_used_are_evicted():
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        cache = ExtractionCache(os.path.join(tmpdir, "cache"))
+        keys = []
+        for n in range(4):
+            samfile = os.path.join(tmpdir, f"s{n}.sam")
+            _write_test_sam(samfile, seed=n)
+            storage = MethylationData()
+            extract_meth(coordinates, [samfile], storage, engine="numpy")
+            keys.append(cache.key(samfile, fastafile))
+            cache.store(keys[-1], storage.data)
+            time.sleep(0.01)
+        entry_size = os.path.getsize(os.path.join(cache.directory, keys[0] + EXTRACTION_CACHE_SUFFIX))
+
+        # s0 is used again, s1 is now the least recently used entry
+        assert cache.load(keys[0], "s0.sam") is not None
+        cache.max_bytes = 3 * entry_size + entry_size // 2
+        cache.evict()
+        assert [cache.load(key, "s.sam") is not None for key in keys] == [True, False, True, True]
+    print("✓ least recently used entries are evicted")
+
+
+def test_cached_run_does_not_parse_sam_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        _write_test_sam(samfile)
+        argv = ["--fasta", fastafile, "--sam", samfile, "--outputs", "csv", "--cache-dir", os.path.join(tmpdir, "cache")]
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        extract = allelicMeth.extract_meth
+        try:
+            allelicMeth.main(argv)
+            with open("sample.csv") as fh:
+                expected = fh.read()
+
+            def fail(*args, **kwargs):
+                raise AssertionError("sam file parsed despite the cache")
+
+            allelicMeth.extract_meth = fail
+            allelicMeth.main(argv + ["--output-suffix", "_replot"])
+            with open("sample_replot.csv") as fh:
+                assert fh.read() == expected
+        finally:
+            allelicMeth.extract_meth = extract
+            os.chdir(cwd)
+    print("✓ cached run does not parse sam files")
+
+
+def test_truncated_entry_is_extracted_again():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        _write_test_sam(samfile)
+        cache_dir = os.path.join(tmpdir, "cache")
+        argv = ["--fasta", fastafile, "--sam", samfile, "--outputs", "csv", "--cache-dir", cache_dir]
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        extract = allelicMeth.extract_meth
+        calls = []
+        try:
+            allelicMeth.main(argv)
+            with open("sample.csv") as fh:
+                expected = fh.read()
+            (entry,) = [name for name in os.listdir(cache_dir) if name.endswith(EXTRACTION_CACHE_SUFFIX)]
+            entry = os.path.join(cache_dir, entry)
+            with open(entry, "r+b") as fh:
+                fh.truncate(os.path.getsize(entry) // 2)
+
+            def counted(*args, **kwargs):
+                calls.append(args)
+                return extract(*args, **kwargs)
+
+            allelicMeth.extract_meth = counted
+            allelicMeth.main(argv + ["--output-suffix", "_again"])
+            assert len(calls) == 1
+            with open("sample_again.csv") as fh:
+                assert fh.read() == expected
+            # the fresh extraction replaced the truncated entry
+            cache = ExtractionCache(cache_dir)
+            assert cache.load(os.path.basename(entry)[: -len(EXTRACTION_CACHE_SUFFIX)], samfile) is not None
+        finally:
+            allelicMeth.extract_meth = extract
+            os.chdir(cwd)
+    print("✓ truncated entry is extracted again")
+
+
+def main():
+    print("=" * 60)
+    print("Testing the extraction cache")
+    print("=" * 60)
+
+    try:
+        test_cache_round_trip()
+        test_least_recently_used_are_evicted()
+        test_cached_run_does_not_parse_sam_files()
+        test_truncated_entry_is_extracted_again()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
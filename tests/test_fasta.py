@@ -0,0 +1,115 @@
+#!/usr/bin/env python3.10
+"""
+Tests for fasta loading, the coordinate cache and the faidx index in utils/fasta.py.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import fasta
+from utils.fasta import build_fai, fetch_sequence, get_coordinates
+
+RECORDS = {"chr1": "ACGTTCGAACGGTACGCCGTAAACGTTGCGATCGA" * 3, "chr2": "ttcgaCGCGnnACG"}
+
+
+def _write_fasta(path: str, line_width: int = 20) -> None:
+    with open(path, "w") as fh:
+        for name, sequence in RECORDS.items():
+            fh.write(f">{name} description\n")
+            for i in range(0, len(sequence), line_width):
+                fh.write(sequence[i : i + line_width] + "\n")
+
+
+def test_coordinates_cache():
+    """Cached coordinates equal a fresh scan, a changed fasta file is scanned again."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        _write_fasta(fastafile)
+        expected = fasta._find_motif_coordates("".join(RECORDS.values()), "CG")
+
+        assert get_coordinates(fastafile, cache=False) == expected
+        assert get_coordinates(fastafile) == expected
+        assert os.path.exists(fastafile + ".CG.coords.npz")
+
+        # a cache hit must not read the fasta file
+        scan = fasta._get_seq_from_fasta
+        fasta._get_seq_from_fasta = None
+        try:
+            assert get_coordinates(fastafile) == expected
+            # touching the file changes mtime only, the content hash keeps the cache valid
+            os.utime(fastafile, ns=(0, 10**9))
+            assert get_coordinates(fastafile) == expected
+        finally:
+            fasta._get_seq_from_fasta = scan
+
+        with open(fastafile, "a") as fh:
+            fh.write(">chr3\nCGCG\n")
+        changed = get_coordinates(fastafile)
+        assert changed == get_coordinates(fastafile, cache=False) and len(changed) == len(expected) + 2
+        assert get_coordinates(fastafile, motif="GC") == get_coordinates(fastafile, motif="GC", cache=False)
+    print("✓ coordinate cache")
+
+
+def test_corrupt_coordinates_cache():
+    """A truncated or corrupt cache file is scanned again and rewritten."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        _write_fasta(fastafile)
+        expected = get_coordinates(fastafile)
+        cache_file = fastafile + ".CG.coords.npz"
+        for corrupt in (lambda fh: fh.truncate(os.path.getsize(cache_file) // 2), lambda fh: fh.write(b"garbage")):
+            with open(cache_file, "r+b") as fh:
+                corrupt(fh)
+            assert get_coordinates(fastafile) == expected
+            # the rescan replaced the cache file
+            scan = fasta._get_seq_from_fasta
+            fasta._get_seq_from_fasta = None
+            try:
+                assert get_coordinates(fastafile) == expected
+            finally:
+                fasta._get_seq_from_fasta = scan
+    print("✓ corrupt coordinate cache")
+
+
+def test_fai_fetch():
+    """Subsequences fetched through the index equal slices of the records."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        _write_fasta(fastafile, line_width=7)
+        entries = build_fai(fastafile)
+        assert [(name, length) for name, length, *_ in entries] == [(n, len(s)) for n, s in RECORDS.items()]
+        for name, sequence in RECORDS.items():
+            for start, end in [(0, None), (0, 7), (5, 23), (6, 8), (len(sequence) - 3, len(sequence) + 5)]:
+                assert fetch_sequence(fastafile, name, start, end) == sequence[start:end]
+    print("✓ faidx fetch")
+
+
+def main():
+    print("=" * 60)
+    print("Testing fasta loading")
+    print("=" * 60)
+
+    try:
+        test_coordinates_cache()
+        test_corrupt_coordinates_cache()
+        test_fai_fetch()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3.10
+"""
+Tests for --group-by-region of run_allelicMeth.py and --keep-going of allelicMeth.py:
+a bad SAM file of a grouped run fails on its own, the other SAM files of its region succeed.
+"""
+
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import allelicMeth
+from run_allelicMeth import FAILED_SAM_PREFIX, AllelicMethOrchestrator
+from test_sam_engines import REFERENCE, _write_test_sam
+
+BAD_SAM = "Galaxy3-[sgRNA_Region1_Rep2].sam"
+
+
+def _write_directory(directory: str) -> None:
+    """Region1 with three good SAM files and one with an invalid POS."""
+    with open(os.path.join(directory, "Galaxy2-[SNCA_Region1.fasta].fasta"), "w") as fh:
+        fh.write(f">Region1\n{REFERENCE}\n")
+    for n in range(4):
+        _write_test_sam(os.path.join(directory, f"Galaxy3-[sgRNA_Region1_Rep{n}].sam"), seed=n)
+    with open(os.path.join(directory, BAD_SAM), "a") as fh:
+        fh.write(f"broken\t0\tRegion1\tx1\t60\t{len(REFERENCE)}M\t*\t0\t0\t{REFERENCE}\t*\n")
+
+
+def test_keep_going_reports_failed_sam():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        fastafile = os.path.join(tmpdir, "Galaxy2-[SNCA_Region1.fasta].fasta")
+        samfiles = [os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}].sam") for n in range(4)]
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr):
+            failed = allelicMeth.main(["--fasta", fastafile, "--sam", *samfiles, "--outputs", "csv", "--keep-going"])
+        assert list(failed) == [samfiles[2]]
+        lines = [line for line in stderr.getvalue().splitlines() if line.startswith(FAILED_SAM_PREFIX)]
+        assert len(lines) == 1 and lines[0].split("\t")[1] == samfiles[2]
+        for n in (0, 1, 3):
+            assert os.path.exists(os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}].csv"))
+
+        # failures are mapped back to the SAM files of the run
+        orchestrator = AllelicMethOrchestrator(os.path.join(tmpdir, "logs", "run.log"), logging.WARNING)
+        paths = [Path(samfile) for samfile in samfiles]
+        assert orchestrator._failed_sam_files(paths, False, stderr.getvalue()) == [paths[2]]
+        assert orchestrator._failed_sam_files(paths, True, stderr.getvalue()) == []
+        # a run failing without reporting single files fails all of them
+        assert orchestrator._failed_sam_files(paths, False, "Traceback ...") == paths
+    print("✓ --keep-going reports the failed SAM file")
+
+
+def test_grouped_run_counts_every_sam():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        log_file = os.path.join(tmpdir, "logs", "run.log")
+        orchestrator = AllelicMethOrchestrator(log_file, logging.INFO)
+        # worker processes run allelicMeth.main in-process, without a python3.10 interpreter on PATH
+        assert not orchestrator.run_directory_mode(tmpdir, jobs=2, group_by_region=True)
+        with open(log_file) as fh:
+            log = fh.read()
+        # the four SAM files of the region are analysed in one run
+        assert "[1/1] Processing" in log
+        assert "Successful: 3" in log and "Failed: 1" in log
+        failed_pairs = [line for line in log.split("Failed pairs:")[1].splitlines() if "  - " in line]
+        assert len(failed_pairs) == 1 and BAD_SAM in failed_pairs[0], failed_pairs
+        for n in (0, 1, 3):
+            assert os.path.exists(os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}]_histogram.png"))
+    print("✓ grouped runs count every SAM file")
+
+
+def main():
+    print("=" * 60)
+    print("Testing grouped directory mode runs")
+    print("=" * 60)
+
+    try:
+        test_keep_going_reports_failed_sam()
+        test_grouped_run_counts_every_sam()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the heatmap renderers in utils/heatmap.py.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+
+from utils.heatmap import (
+    RasterHeatmapMaker,
+    _downsample_rows,
+    _get_random_reads_for_heatmap,
+    _thin_ticks,
+    make_heatmap,
+)
+from utils.meth_data import MethylationData, OneSampleMethylationData
+
+
+def _sample(file_name: str, reads_number: int, sites_number: int = 12, seed: int = 2) -> OneSampleMethylationData:
+    rng = np.random.default_rng(seed)
+    matrix = rng.integers(0, 2, size=(reads_number, sites_number), dtype=np.int8)
+    return OneSampleMethylationData.from_matrices(file_name, sites_number, [matrix])
+
+
+def test_selected_reads_are_sorted_like_before():
+    """Reads are sorted by methylated sites, most first, keeping the sampling order of ties."""
+    sample = _sample("sample.sam", 500)
+    random.seed(4)
+    selected = _get_random_reads_for_heatmap(sample, 200)
+    random.seed(4)
+    indices = random.sample(range(0, 500), 200)
+    expected = sorted(sample.matrix(indices).tolist(), key=lambda x: sum(x), reverse=True)
+    assert selected == expected
+    print("✓ selected reads sorted like before")
+
+
+def test_downsample_rows():
+    data = np.array([[1, 0], [1, 1], [0, 0], [0, 1], [1, 1]], dtype=np.int8)
+    assert (_downsample_rows(data, 10) == data).all()
+    downsampled = _downsample_rows(data, 2)
+    assert downsampled.shape == (2, 2)
+    assert np.allclose(downsampled, [[1, 0.5], [1 / 3, 2 / 3]])
+    assert np.allclose(_downsample_rows(np.ones((100000, 3)), 616), 1)
+    assert _thin_ticks(8, 30).tolist() == list(range(8))
+    assert _thin_ticks(100, 30).tolist() == list(range(0, 100, 4))
+    print("✓ rows are averaged down to pixel rows")
+
+
+def test_raster_heatmap_is_saved():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        meth_data = MethylationData()
+        meth_data.add(_sample(os.path.join(tmpdir, "large.sam"), 50000, sites_number=60))
+        meth_data.add(_sample(os.path.join(tmpdir, "empty.sam"), 0))
+        make_heatmap(meth_data, RasterHeatmapMaker(), 50000)
+        assert os.path.exists(os.path.join(tmpdir, "large_heatmap.png"))
+        assert not os.path.exists(os.path.join(tmpdir, "empty_heatmap.png"))
+    print("✓ raster heatmap saved")
+
+
+def main():
+    print("=" * 60)
+    print("Testing heatmaps")
+    print("=" * 60)
+
+    try:
+        test_selected_reads_are_sorted_like_before()
+        test_downsample_rows()
+        test_raster_heatmap_is_saved()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the histograms in utils/histogram.py, drawn from binned counts.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import numpy as np
+
+from utils.histogram import MultipleDataHistogramMaker, SingleDataHistogramMaker, make_histogram
+from utils.meth_data import LEVEL_BINS, EpialleleCounter, MethylationData, MethylationSummary, OneSampleMethylationData
+
+
+def _matrix(reads_number: int, sites_number: int = 10, seed: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 2, size=(reads_number, sites_number), dtype=np.int8)
+
+
+def test_level_counts():
+    """Bins of stored, collapsed and streamed samples count the same reads."""
+    matrix = _matrix(2000)
+    levels = matrix.sum(axis=1) / matrix.shape[1]
+    expected = np.histogram(levels, bins=LEVEL_BINS)[0]
+
+    sample = OneSampleMethylationData.from_matrices("sample.sam", 10, [matrix])
+    counter = EpialleleCounter(10)
+    counter.add_matrix(matrix)
+    summary = MethylationSummary("sample.sam", 10, reads2plot=10)
+    summary.update(matrix, levels)
+    for data in (sample, counter.to_sample("sample.sam"), summary.to_sample()):
+        assert data.level_counts().tolist() == expected.tolist()
+    print("✓ level counts")
+
+
+def test_histograms_without_pandas():
+    """Histograms of many samples are saved, pandas is not imported."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        meth_data = MethylationData()
+        for i in range(50):
+            meth_data.add(OneSampleMethylationData.from_matrices(os.path.join(tmpdir, f"s{i}.sam"), 10, [_matrix(100, seed=i)]))
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            make_histogram(meth_data, MultipleDataHistogramMaker())
+            make_histogram(MethylationData(meth_data.data[:2]), SingleDataHistogramMaker())
+        finally:
+            os.chdir(cwd)
+        assert os.path.exists(os.path.join(tmpdir, "overlay_histogram.png"))
+        assert os.path.exists(os.path.join(tmpdir, "s1_histogram.png"))
+
+    code = "import sys, utils.histogram; sys.exit('pandas' in sys.modules)"
+    root = str(Path(__file__).resolve().parent.parent)
+    assert subprocess.run([sys.executable, "-c", code], cwd=root, env={**os.environ, "MPLBACKEND": "Agg"}).returncode == 0
+    print("✓ histograms without pandas")
+
+
+def main():
+    print("=" * 60)
+    print("Testing histograms")
+    print("=" * 60)
+
+    try:
+        test_level_counts()
+        test_histograms_without_pandas()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the lazy plotting imports and --outputs selection of allelicMeth.py: extraction only
+runs never load matplotlib, seaborn or pandas. Run in fresh interpreters, as other tests load them.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from test_sam_engines import REFERENCE, _write_test_sam
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+PLOTTING_MODULES = ("matplotlib", "seaborn", "pandas")
+
+# Runs allelicMeth.main with the arguments of the script, then prints the plotting modules loaded
+_CODE = f"""
+import sys
+import allelicMeth
+if len(sys.argv) > 1:
+    allelicMeth.main(sys.argv[1:])
+print("LOADED:" + ",".join(m for m in {PLOTTING_MODULES!r} if m in sys.modules))
+"""
+
+
+def _loaded_modules(args: list, cwd: str) -> tuple:
+    """(plotting modules loaded, stdout) of a fresh interpreter running allelicMeth with args."""
+    env = {**os.environ, "MPLBACKEND": "Agg", "PYTHONPATH": ROOT}
+    result = subprocess.run([sys.executable, "-c", _CODE, *args], cwd=cwd, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    loaded = result.stdout.strip().splitlines()[-1][len("LOADED:"):]
+    return [m for m in loaded.split(",") if m], result.stdout
+
+
+def test_extraction_only_runs_skip_plotting_modules():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile)
+
+        assert _loaded_modules([], tmpdir)[0] == []
+        for outputs in (["--no-plots"], ["--outputs", "csv,sites"]):
+            assert _loaded_modules(["--fasta", fastafile, "--sam", samfile, *outputs], tmpdir)[0] == [], outputs
+            assert os.path.exists(os.path.join(tmpdir, "sample.csv"))
+            os.remove(os.path.join(tmpdir, "sample.csv"))
+
+        loaded, _ = _loaded_modules(["--fasta", fastafile, "--sam", samfile, "--outputs", "heatmap"], tmpdir)
+        assert "matplotlib" in loaded
+    print("✓ extraction only runs skip plotting modules")
+
+
+def test_unknown_outputs_are_rejected():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile)
+        loaded, stdout = _loaded_modules(["--fasta", fastafile, "--sam", samfile, "--outputs", "csv,pdf,bogus"], tmpdir)
+        assert "--outputs can only contain" in stdout and "got: bogus, pdf" in stdout
+        assert loaded == []
+        # nothing is extracted or written
+        assert not os.path.exists(os.path.join(tmpdir, "sample.csv"))
+    print("✓ unknown outputs are rejected")
+
+
+def main():
+    print("=" * 60)
+    print("Testing lazy plotting imports")
+    print("=" * 60)
+
+    try:
+        test_extraction_only_runs_skip_plotting_modules()
+        test_unknown_outputs_are_rejected()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the manifest of directory mode runs in run_allelicMeth.py:
+unchanged pairs are skipped, changed and unfinished pairs are processed again.
+"""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from run_allelicMeth import MANIFEST_NAME, AllelicMethOrchestrator, RunManifest
+from test_sam_engines import REFERENCE, _write_test_sam
+
+
+def _write_directory(directory: str, samples: int = 3) -> None:
+    with open(os.path.join(directory, "Galaxy2-[SNCA_Region1.fasta].fasta"), "w") as fh:
+        fh.write(f">Region1\n{REFERENCE}\n")
+    for n in range(samples):
+        _write_test_sam(os.path.join(directory, f"Galaxy3-[sgRNA_Region1_Rep{n}].sam"), seed=n)
+
+
+def _run(orchestrator: AllelicMethOrchestrator, directory: str, **kwargs) -> list:
+    """Runs directory mode and returns the SAM files the orchestrator processed."""
+    processed = []
+    collect = orchestrator._collect_worker_result
+
+    def collect_and_log(future):
+        result = collect(future)
+        processed.append(result)
+        return result
+
+    orchestrator._collect_worker_result = collect_and_log
+    assert orchestrator.run_directory_mode(directory, jobs=2, **kwargs)
+    orchestrator._collect_worker_result = collect
+    return processed
+
+
+def test_unchanged_pairs_are_skipped():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        orchestrator = AllelicMethOrchestrator(os.path.join(tmpdir, "logs", "run.log"), logging.WARNING)
+        assert len(_run(orchestrator, tmpdir)) == 3
+
+        with open(os.path.join(tmpdir, MANIFEST_NAME)) as fh:
+            entries = json.load(fh)["entries"]
+        entry = entries["Galaxy3-[sgRNA_Region1_Rep0].sam"]
+        assert "Galaxy3-[sgRNA_Region1_Rep0].csv" in entry["outputs"]
+        assert "Galaxy3-[sgRNA_Region1_Rep0]_heatmap.png" in entry["outputs"]
+        assert not any("Rep1" in output for output in entry["outputs"])
+
+        # nothing changed
+        assert _run(orchestrator, tmpdir) == []
+
+        # a touched file with the same content is still skipped, a new sample and changed options are not
+        os.utime(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep0].sam"), (0, 0))
+        _write_test_sam(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep3].sam"), seed=3)
+        assert len(_run(orchestrator, tmpdir)) == 1
+        assert len(_run(orchestrator, tmpdir, retain_methylated=True)) == 4
+        assert len(_run(orchestrator, tmpdir, retain_methylated=True, force=True)) == 4
+
+        # a missing output or a changed sam file is processed again
+        os.remove(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep1]_histogram.png"))
+        _write_test_sam(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep2].sam"), reads_number=100, seed=9)
+        assert len(_run(orchestrator, tmpdir, retain_methylated=True)) == 2
+    print("✓ unchanged pairs are skipped")
+
+
+def test_interrupted_run_resumes():
+    """SAM files without an entry, e.g. after a crash, are processed; a broken manifest is ignored."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        orchestrator = AllelicMethOrchestrator(os.path.join(tmpdir, "logs", "run.log"), logging.WARNING)
+        _run(orchestrator, tmpdir)
+
+        manifest = RunManifest(os.path.join(tmpdir, MANIFEST_NAME))
+        manifest.forget(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep2].sam"))
+        manifest.save()
+        assert len(_run(orchestrator, tmpdir)) == 1
+
+        shutil.copy(os.path.join(tmpdir, "Galaxy2-[SNCA_Region1.fasta].fasta"), os.path.join(tmpdir, "broken"))
+        os.replace(os.path.join(tmpdir, "broken"), os.path.join(tmpdir, MANIFEST_NAME))
+        assert len(_run(orchestrator, tmpdir)) == 3
+    print("✓ interrupted run resumes")
+
+
+def test_outputs_of_other_samples_are_not_recorded():
+    """Outputs of Rep0_trim.sam start with the name of Rep0.sam, but belong to Rep0_trim only."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir, samples=1)
+        _write_test_sam(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep0]_trim.sam"), seed=7)
+        orchestrator = AllelicMethOrchestrator(os.path.join(tmpdir, "logs", "run.log"), logging.WARNING)
+        assert len(_run(orchestrator, tmpdir)) == 2
+
+        with open(os.path.join(tmpdir, MANIFEST_NAME)) as fh:
+            entries = json.load(fh)["entries"]
+        assert entries["Galaxy3-[sgRNA_Region1_Rep0].sam"]["outputs"] == [
+            "Galaxy3-[sgRNA_Region1_Rep0].csv",
+            "Galaxy3-[sgRNA_Region1_Rep0]_heatmap.png",
+            "Galaxy3-[sgRNA_Region1_Rep0]_histogram.png",
+        ]
+
+        # only the sample whose output is missing is processed again
+        os.remove(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep0]_trim_heatmap.png"))
+        assert len(_run(orchestrator, tmpdir)) == 1
+    print("✓ outputs of other samples are not recorded")
+
+
+def main():
+    print("=" * 60)
+    print("Testing the manifest of directory mode runs")
+    print("=" * 60)
+
+    try:
+        test_unchanged_pairs_are_skipped()
+        test_interrupted_run_resumes()
+        test_outputs_of_other_samples_are_not_recorded()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the sample containers in utils/meth_data.py.
+"""
+
+import sys
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from utils.meth_data import MISSING_CALL, MethylationSummary, OneSampleMethylationData
+
+
+def test_packed_patterns_round_trip():
+    """Patterns survive packing into covered/methylated masks, levels come from popcount."""
+    patterns = [
+        [1, 0, 1, 1, 0, 0, 1, 1, 1, 0, 1],
+        [0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+        [1, "!", 0, 1, 1, 1, 1, 1, 1, 1, "!"],
+    ]
+    sample = OneSampleMethylationData.from_patterns("sample.sam", 11, patterns)
+
+    assert sample.reads_number == 3
+    assert sample.covered.shape == (3, 2) and sample.covered.dtype == np.uint8
+    assert sample.meth_patterns == patterns
+    assert sample.meth_levels == [7 / 11, 1 / 11, 8 / 11]
+    assert sample.matrix([2]).tolist() == [[1, MISSING_CALL, 0, 1, 1, 1, 1, 1, 1, 1, MISSING_CALL]]
+    print("✓ packed patterns round trip")
+
+
+def test_empty_sample():
+    """A sample without reads keeps its number of sites."""
+    sample = OneSampleMethylationData.from_matrices("empty.sam", 5, [])
+    assert sample.reads_number == 0
+    assert sample.matrix().shape == (0, 5)
+    assert sample.meth_levels == []
+    print("✓ empty sample")
+
+
+def test_reservoir_sample_is_uniform_and_seeded():
+    """Every read ends up in the heatmap sample with probability reads2plot / reads, whatever the chunk."""
+    reads_number, reads2plot, trials = 20, 5, 4000
+    # every read is a row of sites_number calls holding its index in binary
+    matrix = ((np.arange(reads_number)[:, None] >> np.arange(5)) & 1).astype(np.int8)
+    levels = np.full(reads_number, 0.5)
+    counts = np.zeros(reads_number)
+    for seed in range(trials):
+        summary = MethylationSummary("sample.sam", 5, reads2plot, seed=seed)
+        for start in range(0, reads_number, 3):
+            summary.update(matrix[start : start + 3], levels[start : start + 3])
+        sampled = summary.heatmap_reads[: summary.heatmap_size]
+        indices = (sampled.astype(np.int64) << np.arange(5)).sum(axis=1)
+        assert len(set(indices.tolist())) == reads2plot
+        counts[indices] += 1
+    assert np.allclose(counts / trials, reads2plot / reads_number, atol=0.03)
+
+    def sample(seed):
+        summary = MethylationSummary("sample.sam", 5, reads2plot, seed=seed)
+        summary.update(matrix, levels)
+        return summary.heatmap_reads.tolist()
+
+    assert sample(11) == sample(11)
+    print("✓ reservoir sample is uniform and reproducible")
+
+
+def main():
+    print("=" * 60)
+    print("Testing methylation data containers")
+    print("=" * 60)
+
+    try:
+        test_packed_patterns_round_trip()
+        test_empty_sample()
+        test_reservoir_sample_is_uniform_and_seeded()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
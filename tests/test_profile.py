@@ -0,0 +1,183 @@
+#!/usr/bin/env python3.10
+"""
+Tests for --profile of allelicMeth.py and the profile summary of run_allelicMeth.py.
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import allelicMeth
+import utils.profile
+from run_allelicMeth import AllelicMethOrchestrator, _run_analysis_in_worker
+from test_contigs import _write_fasta, _write_mixed_sam
+from test_sam_engines import REFERENCE, _coordinates, _write_test_sam
+from utils.fasta import get_contig_coordinates
+from utils.meth_data import MethylationData
+from utils.profile import StageProfiler, merge_profiles
+from utils.sam import ReadCounter, extract_meth, extract_meth_by_contig, stream_reads_by_contig
+
+
+def test_stage_profiler():
+    profiler = StageProfiler()
+    with profiler.stage("extract", "a.sam") as record:
+        record["reads_parsed"] = 10
+        record["reads_retained"] = 8
+    with profiler.stage("heatmap", "a.sam"):
+        pass
+    extract, heatmap = profiler.records
+    assert extract["wall_seconds"] >= 0 and extract["cpu_seconds"] >= 0
+    assert extract["reads_per_second"] == 10 / extract["wall_seconds"]
+    assert "reads_per_second" not in heatmap
+
+    disabled = StageProfiler(enabled=False)
+    with disabled.stage("extract") as record:
+        record["reads_parsed"] = 10
+    assert disabled.records == []
+
+    totals = merge_profiles([{"stages": profiler.records}, {"stages": [dict(extract, peak_rss_mb=1e6)]}])
+    assert list(totals) == ["extract", "heatmap"]
+    assert totals["extract"]["runs"] == 2 and totals["extract"]["reads_parsed"] == 20
+    assert totals["extract"]["peak_rss_mb"] == 1e6
+    assert totals["heatmap"]["reads_per_second"] is None
+    print("✓ stage profiler")
+
+
+def test_parsed_reads_of_every_engine():
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile, reads_number=300)
+        for options in ({"engine": "python"}, {"engine": "numpy"}, {"engine": "numpy", "jobs": 2}, {"epialleles": True}):
+            storage = MethylationData()
+            extract_meth(coordinates, [samfile], storage, **options)
+            assert storage.data[0].parsed_reads == 300, options
+            assert storage.data[0].reads_number < 300
+
+        # by contig every sample counts the reads of its contig
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        _write_fasta(fastafile)
+        _write_mixed_sam(samfile)
+        contig_coordinates = get_contig_coordinates(fastafile, cache=False)
+        storage = MethylationData()
+        extract_meth_by_contig(contig_coordinates, [samfile], storage)
+        counter = ReadCounter()
+        for _ in stream_reads_by_contig(contig_coordinates, samfile, counter=counter):
+            pass
+        assert counter.reads == 600
+        assert {d.contig: d.parsed_reads for d in storage.data} == {d.contig: counter.contigs[d.contig] for d in storage.data}
+    print("✓ parsed reads of every engine")
+
+
+def test_profile_of_a_run():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        samfiles = [os.path.join(tmpdir, f"s{n}.sam") for n in range(2)]
+        for n, samfile in enumerate(samfiles):
+            _write_test_sam(samfile, reads_number=200 + 100 * n, seed=n)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            for stream in (False, True):
+                argv = ["--fasta", fastafile, "--sam", *samfiles, "--outputs", "csv,histogram", "--profile"]
+                allelicMeth.main(argv + (["--stream"] if stream else []))
+                with open("allelicMeth_profile.json") as fh:
+                    profile = json.load(fh)
+                stages = [(r["stage"], r["sam"]) for r in profile["stages"]]
+                expected = [("coordinates", None)]
+                for samfile in samfiles:
+                    expected += [("extract", samfile), ("histogram", samfile)] + ([] if stream else [("csv", samfile)])
+                assert stages == expected, stages
+                extracts = [r for r in profile["stages"] if r["stage"] == "extract"]
+                assert [r["reads_parsed"] for r in extracts] == [200, 300]
+                for record in extracts:
+                    assert record["reads_parsed"] == record["reads_retained"] + record["reads_dropped"]
+                    assert record["reads_per_second"] > 0
+                    assert record["cpu_seconds"] >= 0
+                    assert record["peak_rss_mb"] is None or record["peak_rss_mb"] > 0
+
+            allelicMeth.main(["--fasta", fastafile, "--sam", *samfiles, "--outputs", "csv", "--profile", "named.json"])
+            assert os.path.exists("named.json")
+        finally:
+            os.chdir(cwd)
+    print("✓ profile of a run")
+
+
+def test_reused_worker_has_no_peak_rss():
+    """Pool workers run several analyses, only the first can report its own peak RSS."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        samfile = os.path.join(tmpdir, "s.sam")
+        _write_test_sam(samfile)
+        peaks = []
+        try:
+            for n in range(2):
+                profile = os.path.join(tmpdir, f"run{n}.json")
+                success, _, _ = _run_analysis_in_worker(["--fasta", fastafile, "--sam", samfile, "--outputs", "csv", "--profile", profile])
+                assert success
+                with open(profile) as fh:
+                    peaks.append({r["peak_rss_mb"] for r in json.load(fh)["stages"]})
+        finally:
+            # this test process is not a pool worker
+            utils.profile._shared_process = False
+        assert None not in peaks[0] or utils.profile.resource is None
+        assert peaks[1] == {None}
+    print("✓ reused worker has no peak RSS")
+
+
+def test_directory_mode_summary():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "Galaxy2-[SNCA_Region1.fasta].fasta"), "w") as fh:
+            fh.write(f">Region1\n{REFERENCE}\n")
+        for n in range(2):
+            _write_test_sam(os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}].sam"), seed=n)
+        log_file = os.path.join(tmpdir, "logs", "run.log")
+        orchestrator = AllelicMethOrchestrator(log_file, logging.WARNING)
+        assert orchestrator.run_directory_mode(tmpdir, jobs=2, profile=True)
+        assert os.path.exists(os.path.join(tmpdir, "Galaxy3-[sgRNA_Region1_Rep0]_profile.json"))
+        with open(log_file) as fh:
+            log = fh.read()
+        assert "PROFILE" in log
+        # stage, runs, wall s, cpu s, parsed, retained, reads/s, peak RSS MB
+        row = next(line for line in log.splitlines() if "INFO: extract " in line).split("INFO: ")[1].split()
+        assert row[1] == "2" and row[4] == "600"
+    print("✓ directory mode summary")
+
+
+def main():
+    print("=" * 60)
+    print("Testing profiling")
+    print("=" * 60)
+
+    try:
+        test_stage_profiler()
+        test_parsed_reads_of_every_engine()
+        test_profile_of_a_run()
+        test_reused_worker_has_no_peak_rss()
+        test_directory_mode_summary()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the read level tsv written while sam files are streamed, and the
+block wise csv writer of stored samples.
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+import allelicMeth
+from test_sam_engines import REFERENCE, _coordinates, _write_test_sam
+from utils.meth_data import MethylationData
+from utils.sam import extract_meth, stream_reads
+from utils.save import StreamingReadsWriter, WriteMethlation2CSV, save_data
+
+
+def _read_tsv(path: str) -> list:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as fh:
+        return [line.rstrip("\n").split("\t") for line in fh]
+
+
+def test_reads_tsv_matches_extraction():
+    """Every retained read is written once, with its name, position, pattern and level."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile, reads_number=500)
+        for compress in (False, True):
+            with StreamingReadsWriter(samfile, "_run1", compress) as writer:
+                for chunk in stream_reads(coordinates, samfile, chunk_size=64):
+                    writer.write(*chunk)
+        rows = _read_tsv(os.path.join(tmpdir, "sample_run1_reads.tsv"))
+        assert rows == _read_tsv(os.path.join(tmpdir, "sample_run1_reads.tsv.gz"))
+
+        storage = MethylationData()
+        extract_meth(coordinates, [samfile], storage, engine="numpy", read_ids=True)
+        sample = storage.data[0]
+        assert rows[0] == ["read_name", "position", "pattern", "covered_cpgs", "meth_level"]
+        assert [row[0] for row in rows[1:]] == sample.read_ids.astype(str).tolist()
+        assert np.allclose([float(row[4]) for row in rows[1:]], sample.levels)
+        expected = ["".join(str(call) for call in pattern) for pattern in sample.matrix().tolist()]
+        assert [row[2] for row in rows[1:]] == expected
+        assert all(int(row[3]) == len(coordinates) for row in rows[1:])
+
+        with open(samfile) as fh:
+            positions = {line.split("\t")[0]: line.split("\t")[3] for line in fh if not line.startswith("@")}
+        assert all(positions[row[0]] == row[1] for row in rows[1:])
+    print("✓ read level tsv matches extraction")
+
+
+def test_csv_written_in_blocks():
+    """Stored samples are written block by block to the same csv as one join of all levels."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(samfile, reads_number=500)
+        for epialleles in (False, True):
+            storage = MethylationData()
+            extract_meth(coordinates, [samfile], storage, engine="numpy", epialleles=epialleles)
+            save_data(storage, WriteMethlation2CSV())
+            sample = storage.data[0]
+            with open(os.path.join(tmpdir, "sample.csv")) as fh:
+                written = fh.read()
+            assert written == "\n".join([str(i) for i in np.repeat(sample.levels, sample.weights).tolist()])
+    print("✓ csv written in blocks")
+
+
+def test_tsv_output_from_command_line():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        _write_test_sam(samfile)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            # without --stream the tsv is skipped
+            allelicMeth.main(["--fasta", fastafile, "--sam", samfile, "--outputs", "tsv"])
+            assert not os.path.exists(os.path.join(tmpdir, "sample_reads.tsv"))
+            allelicMeth.main(["--fasta", fastafile, "--sam", samfile, "--outputs", "csv,tsv", "--stream", "--tsv-gzip"])
+        finally:
+            os.chdir(cwd)
+        rows = _read_tsv(os.path.join(tmpdir, "sample_reads.tsv.gz"))
+        with open(os.path.join(tmpdir, "sample.csv")) as fh:
+            levels = [float(line) for line in fh]
+        assert np.allclose([float(row[4]) for row in rows[1:]], levels)
+    print("✓ tsv output from the command line")
+
+
+def main():
+    print("=" * 60)
+    print("Testing read level tsv")
+    print("=" * 60)
+
+    try:
+        test_reads_tsv_matches_extraction()
+        test_csv_written_in_blocks()
+        test_tsv_output_from_command_line()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the methylation calling engines in utils/sam.py.
+Checks that the numpy engine gives the same results as the python engine.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from utils.meth_data import LEVEL_BINS, MethylationData, MethylationSummary
+from utils.sam import (
+    MISSING_CALL,
+    _call_meth_batch,
+    _covered_cpg_range,
+    _get_meth_pattern,
+    _split_sam,
+    extract_meth,
+    stream_meth,
+)
+
+REFERENCE = "ACGTTCGAACGGTACGCCGTAAACGTTGCGATCGA"
+
+
+def _bisulfite_read(reference: str, start: int, length: int, rng: random.Random) -> str:
+    """Converts a fragment of the reference, every CpG is randomly methylated or not."""
+    read = list(reference[start : start + length])
+    for i, base in enumerate(read):
+        if base != "C":
+            continue
+        is_cpg = i + 1 < len(read) and read[i + 1] == "G"
+        if not is_cpg or rng.random() < 0.5:
+            read[i] = "T"
+    return "".join(read)
+
+
+def _write_test_sam(path: str, reads_number: int = 300, seed: int = 1) -> None:
+    """Writes a SAM file with full length, partial and mismatching reads."""
+    rng = random.Random(seed)
+    with open(path, "w") as fh:
+        fh.write("@HD\tVN:1.6\n")
+        for n in range(reads_number):
+            start = rng.choice([0, 0, 0, 3])
+            length = rng.choice([len(REFERENCE) - start, 20])
+            sequence = _bisulfite_read(REFERENCE, start, length, rng)
+            if rng.random() < 0.1:
+                sequence = sequence.replace("G", "A", 1)
+            fh.write(f"read{n}\t0\tref\t{start + 1}\t60\t{len(sequence)}M\t*\t0\t0\t{sequence}\t*\n")
+
+
+def _coordinates() -> list:
+    return [i for i in range(len(REFERENCE) - 1) if REFERENCE[i : i + 2] == "CG"]
+
+
+def test_call_meth_batch_matches_pattern():
+    """Every row of the batch matrix equals the pattern of _get_meth_pattern."""
+    coordinates = _coordinates()
+    sequences = ["ACGTTCGAACG", "ATGTTTGAACGGTACG", "GTTCGAACGGTACGCCGTA"]
+    positions = [0, 0, 3]
+    matrix, levels = _call_meth_batch(np.asarray(coordinates), sequences, positions)
+    for row, sequence, position in zip(matrix.tolist(), sequences, positions):
+        expected = _get_meth_pattern(coordinates, sequence, position)
+        assert row == [MISSING_CALL if c == "!" else c for c in expected], f"{row} != {expected}"
+    assert np.isnan(levels).all(), f"Partial reads must have no level, got {levels}"
+    print("✓ _call_meth_batch matches _get_meth_pattern")
+
+
+def _full_scan_pattern(coordinates: list, sequence: str, sam_position: int) -> list:
+    """Reference implementation looking at every CpG site for every read."""
+    pattern = []
+    for start in coordinates:
+        read_pos = start - sam_position
+        fragment = sequence[read_pos : read_pos + 2] if 0 <= read_pos < len(sequence) - 1 else ""
+        pattern.append({"CG": 1, "TG": 0}.get(fragment, "!"))
+    return pattern
+
+
+def test_windowed_pattern_matches_full_scan():
+    """Looking only at CpGs inside the read span gives the same pattern as a full scan."""
+    coordinates = _coordinates()
+    rng = random.Random(2)
+    for _ in range(200):
+        start = rng.randrange(-5, len(REFERENCE))
+        length = rng.randrange(1, len(REFERENCE) + 5)
+        sequence = _bisulfite_read(REFERENCE, max(start, 0), length, rng)
+        expected = _full_scan_pattern(coordinates, sequence, start)
+        assert _get_meth_pattern(coordinates, sequence, start) == expected
+    assert _covered_cpg_range([1, 5, 10], 1, 11) == (0, 3)
+    assert _covered_cpg_range([1, 5, 10], 1, 10) == (0, 2)
+    assert _covered_cpg_range([1, 5, 10], 2, 20) == (1, 3)
+    print("✓ windowed _get_meth_pattern matches a full scan")
+
+
+def test_engines_give_same_results():
+    """Python and numpy engines extract identical patterns and levels."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sam_file = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(sam_file)
+        for retain_methylated in (False, True):
+            results = {}
+            for engine in ("python", "numpy"):
+                storage = MethylationData()
+                extract_meth(coordinates, [sam_file], storage, retain_methylated=retain_methylated, engine=engine)
+                results[engine] = storage.data[0]
+            python_data, numpy_data = results["python"], results["numpy"]
+            assert python_data.reads_number > 0
+            assert python_data.reads_number == numpy_data.reads_number
+            assert python_data.meth_patterns == numpy_data.meth_patterns
+            assert python_data.meth_levels == numpy_data.meth_levels
+    print("✓ python and numpy engines give the same results")
+
+
+def test_epialleles_match_individual_reads():
+    """Epiallele counts of both engines add up to the reads stored one by one."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sam_file = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(sam_file)
+        storage = MethylationData()
+        extract_meth(coordinates, [sam_file], storage, engine="numpy")
+        extract_meth(coordinates, [sam_file], storage, engine="python", epialleles=True)
+        extract_meth(coordinates, [sam_file], storage, engine="numpy", epialleles=True)
+    reads, python_epialleles, numpy_epialleles = storage.data
+
+    expected = {}
+    for pattern in reads.meth_patterns:
+        expected[tuple(pattern)] = expected.get(tuple(pattern), 0) + 1
+    for epialleles in (python_epialleles, numpy_epialleles):
+        assert epialleles.reads_number == reads.reads_number
+        counts = dict(zip(map(tuple, epialleles.meth_patterns), epialleles.weights.tolist()))
+        assert counts == expected
+        assert sorted(np.repeat(epialleles.levels, epialleles.weights)) == sorted(reads.meth_levels)
+    assert python_epialleles.meth_patterns == numpy_epialleles.meth_patterns
+    print("✓ epiallele counts match individual reads")
+
+
+def test_parallel_extraction_keeps_input_order():
+    """Sam files extracted in worker processes are stored in the order they were given."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sam_files = []
+        for seed, reads_number in enumerate([300, 50, 200]):
+            sam_files.append(os.path.join(tmpdir, f"sample{seed}.sam"))
+            _write_test_sam(sam_files[-1], reads_number=reads_number, seed=seed)
+        serial, parallel = MethylationData(), MethylationData()
+        extract_meth(coordinates, sam_files, serial, engine="numpy")
+        extract_meth(coordinates, sam_files, parallel, engine="numpy", jobs=2)
+    assert [d.file_name for d in parallel.data] == sam_files
+    for serial_data, parallel_data in zip(serial.data, parallel.data):
+        assert serial_data.meth_patterns == parallel_data.meth_patterns
+    print("✓ parallel extraction keeps input order")
+
+
+def test_chunked_extraction_matches_serial():
+    """One sam file split into byte ranges gives the same reads in the same order."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sam_file = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(sam_file, reads_number=1000)
+        ranges = _split_sam(sam_file, 4)
+        with open(sam_file, "rb") as fh:
+            content = fh.read()
+        assert content[: ranges[0][0]] == b"@HD\tVN:1.6\n"
+        assert ranges[-1][1] == len(content)
+        for (_, end), (start, _) in zip(ranges[:-1], ranges[1:]):
+            assert end == start and content[end - 1 : end] == b"\n"
+
+        serial, chunked = MethylationData(), MethylationData()
+        extract_meth(coordinates, [sam_file], serial, engine="numpy")
+        extract_meth(coordinates, [sam_file], chunked, engine="numpy", jobs=4)
+        extract_meth(coordinates, [sam_file], chunked, engine="numpy", epialleles=True, jobs=4)
+    assert chunked.data[0].meth_patterns == serial.data[0].meth_patterns
+    assert chunked.data[1].reads_number == serial.data[0].reads_number
+
+    # files with only a header or nothing at all have no range to split
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for content in ("", "@HD\tVN:1.6\n"):
+            sam_file = os.path.join(tmpdir, "empty.sam")
+            with open(sam_file, "w") as fh:
+                fh.write(content)
+            empty = MethylationData()
+            extract_meth(coordinates, [sam_file], empty, engine="numpy", jobs=2)
+            assert empty.data[0].reads_number == 0 and empty.data[0].parsed_reads == 0
+    print("✓ chunked extraction matches serial extraction")
+
+
+def test_streaming_summary_matches_full_extraction():
+    """Running aggregates over small chunks agree with the fully loaded sample."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sam_file = os.path.join(tmpdir, "sample.sam")
+        _write_test_sam(sam_file, reads_number=1000)
+        storage = MethylationData()
+        extract_meth(coordinates, [sam_file], storage, engine="numpy")
+        full = storage.data[0]
+
+        summary = MethylationSummary(sam_file, len(coordinates), reads2plot=50, seed=0)
+        for matrix, levels in stream_meth(coordinates, sam_file, chunk_size=64):
+            summary.update(matrix, levels)
+
+    assert summary.reads_number == full.reads_number
+    assert (summary.level_histogram == np.histogram(full.meth_levels, bins=LEVEL_BINS)[0]).all()
+    sample = summary.to_sample()
+    assert len(sample.meth_patterns) == 50
+    assert all(pattern in full.meth_patterns for pattern in sample.meth_patterns)
+    print("✓ streaming aggregates match full extraction")
+
+
+def main():
+    print("=" * 60)
+    print("Testing methylation calling engines")
+    print("=" * 60)
+
+    try:
+        test_call_meth_batch_matches_pattern()
+        test_windowed_pattern_matches_full_scan()
+        test_engines_give_same_results()
+        test_epialleles_match_individual_reads()
+        test_parallel_extraction_keeps_input_order()
+        test_chunked_extraction_matches_serial()
+        test_streaming_summary_matches_full_extraction()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the memory-mapped sam parser in utils/sam_mmap.py: blocks hold the fields of the
+line parser, and reads called from them match reads called line by line, chunk for chunk.
+"""
+
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+from test_cigar import _gapped_read
+from test_contigs import _write_fasta, _write_mixed_sam
+from test_sam_engines import REFERENCE, _bisulfite_read, _coordinates, _write_test_sam
+from utils.fasta import get_contig_coordinates
+from utils.sam import _call_reads, _call_reads_by_contig, _call_sam_blocks, _iter_sam_reads, _parse_alignment
+from utils.sam_mmap import gather_strings, iter_sam_blocks
+
+
+def _write_gapped_sam(path: str, reads_number: int = 500, seed: int = 3) -> None:
+    """Writes ungapped, gapped and partial reads."""
+    rng = random.Random(seed)
+    with open(path, "w") as fh:
+        fh.write("@HD\tVN:1.6\n@SQ\tSN:ref\tLN:100\n")
+        for n in range(reads_number):
+            start = rng.choice([0, 0, 5])
+            sequence, cigar = _gapped_read(_bisulfite_read(REFERENCE, start, len(REFERENCE) - start, rng), rng)
+            fh.write(f"read{n}\t0\tref\t{start + 1}\t60\t{cigar}\t*\t0\t0\t{sequence}\tIIII\tNM:i:0\n")
+
+
+def _block_fields(samfile: str, **kwargs) -> list:
+    """(sequence, sam_position_0based, reference_name, cigar, read_name) of every alignment of the blocks."""
+    fields = []
+    for block in iter_sam_blocks(samfile, **kwargs):
+        columns = zip(
+            block.seq_start.tolist(), block.seq_end.tolist(), block.positions.tolist(),
+            block.rname_start.tolist(), block.rname_end.tolist(), block.cigar_start.tolist(),
+            block.cigar_end.tolist(), block.qname_start.tolist(), block.qname_end.tolist(),
+        )
+        for seq_start, seq_end, position, rname_start, rname_end, cigar_start, cigar_end, qname_start, qname_end in columns:
+            fields.append((
+                block.text(seq_start, seq_end), position, block.text(rname_start, rname_end),
+                block.text(cigar_start, cigar_end), block.text(qname_start, qname_end),
+            ))
+    return fields
+
+
+def test_blocks_match_line_parser():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_gapped_sam(samfile)
+        expected = list(_iter_sam_reads(samfile))
+        assert _block_fields(samfile) == expected
+        # tiny blocks end inside lines and are moved to the next line end
+        assert _block_fields(samfile, block_size=100) == expected
+        assert _block_fields(samfile, block_size=5) == expected
+
+        # CRLF line ends, lines without QUAL, empty lines and no newline at the end of the file
+        lines = [
+            "r1\t0\tref\t1\t60\t4M\t*\t0\t0\tACGT\t*\r\n",
+            "r2\t16\tchr2\t12\t0\t*\t*\t0\t0\tTTCG\r\n",
+            "\n",
+            "r3\t0\tref\t100\t60\t2S2M\t*\t0\t0\tAC",
+        ]
+        odd = os.path.join(tmpdir, "odd.sam")
+        with open(odd, "w", newline="") as fh:
+            fh.write("".join(lines))
+        assert _block_fields(odd) == [_parse_alignment(line) for line in lines if line.strip()]
+
+        empty = os.path.join(tmpdir, "empty.sam")
+        open(empty, "w").close()
+        assert list(iter_sam_blocks(empty)) == []
+        with open(empty, "w") as fh:
+            fh.write("@HD\tVN:1.6\n")
+        assert list(iter_sam_blocks(empty)) == []
+    print("✓ blocks match the line parser")
+
+
+def test_malformed_lines_are_reported():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "broken.sam")
+        first = "r0\t0\tref\t1\t60\t4M\t*\t0\t0\tACGT\t*\n"
+        for line in ("r1\t0\tref\t1\t60\t4M\tACGT\n", "r1\t0\tref\tx1\t60\t4M\t*\t0\t0\tACGT\t*\n"):
+            with open(samfile, "w") as fh:
+                fh.write(first + line)
+            try:
+                list(iter_sam_blocks(samfile))
+            except ValueError as e:
+                assert f"byte {len(first)}" in str(e)
+            else:
+                raise AssertionError(f"malformed line accepted: {line!r}")
+    print("✓ malformed lines are reported")
+
+
+def test_calls_match_line_by_line():
+    """Same chunks as _call_reads: gapped reads are projected, partial ungapped reads dropped before calling."""
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for write in (_write_gapped_sam, _write_test_sam):
+            samfile = os.path.join(tmpdir, "sample.sam")
+            write(samfile)
+            for retain_methylated in (False, True):
+                expected = list(_call_reads(coordinates, _iter_sam_reads(samfile), retain_methylated, 37, read_ids=True))
+                blocks = iter_sam_blocks(samfile, block_size=1000)
+                chunks = list(_call_sam_blocks(coordinates, blocks, retain_methylated, 37, read_ids=True))
+                assert len(chunks) == len(expected)
+                for chunk, reference in zip(chunks, expected):
+                    for array, reference_array in zip(chunk, reference):
+                        assert np.array_equal(array, reference_array, equal_nan=array.dtype.kind == "f")
+    print("✓ calls match line by line calling")
+
+
+def test_contig_routing_matches_line_by_line():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        samfile = os.path.join(tmpdir, "mixed.sam")
+        _write_fasta(fastafile)
+        _write_mixed_sam(samfile)
+        # gzip compressed sam files are routed read by read
+        with open(samfile, "rb") as src, gzip.open(samfile + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        contig_coordinates = get_contig_coordinates(fastafile, cache=False)
+        by_contig = {}
+        for path in (samfile, samfile + ".gz"):
+            for contig, matrix, levels, read_ids, positions in _call_reads_by_contig(contig_coordinates, path, False, 50, read_ids=True):
+                by_contig.setdefault(path, {}).setdefault(contig, []).append((matrix, read_ids.tolist()))
+        mapped, compressed = by_contig[samfile], by_contig[samfile + ".gz"]
+        assert list(mapped) == list(compressed)
+        for contig in mapped:
+            assert len(mapped[contig]) == len(compressed[contig])
+            for (matrix, names), (reference, reference_names) in zip(mapped[contig], compressed[contig]):
+                assert (matrix == reference).all() and names == reference_names
+    print("✓ contig routing matches line by line routing")
+
+
+def test_gather_strings():
+    buffer = np.frombuffer(b"read1\tr\tlonger_name", dtype=np.uint8)
+    names = gather_strings(buffer, np.array([0, 6, 8]), np.array([5, 7, 19]))
+    assert names.tolist() == [b"read1", b"r", b"longer_name"]
+    assert gather_strings(buffer, np.array([], dtype=np.int64), np.array([], dtype=np.int64)).shape == (0,)
+    print("✓ gather strings")
+
+
+def main():
+    print("=" * 60)
+    print("Testing the memory-mapped sam parser")
+    print("=" * 60)
+
+    try:
+        test_blocks_match_line_parser()
+        test_malformed_lines_are_reported()
+        test_calls_match_line_by_line()
+        test_contig_routing_matches_line_by_line()
+        test_gather_strings()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the per CpG site counts of --outputs sites: every engine counts the calls of all
+reads, also the ones dropped for partial coverage, as a read by read count does.
+"""
+
+import csv
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np
+
+import allelicMeth
+from test_contigs import CONTIGS, _write_fasta, _write_mixed_sam
+from test_sam_engines import REFERENCE, _coordinates
+from test_sam_mmap import _write_gapped_sam
+from utils.cigar import CigarProjection, is_ungapped
+from utils.fasta import get_contig_coordinates
+from utils.meth_data import MethFlags, MethylationData, SiteCounter
+from utils.sam import _get_meth_pattern, _iter_sam_reads, extract_meth, extract_meth_by_contig, stream_meth, stream_reads_by_contig
+
+
+def _count_sites(coordinates: list, samfile: str, contig: str = None) -> tuple:
+    """(reads, methylated, unmethylated) per site of every alignment, called one by one."""
+    projection = CigarProjection(coordinates)
+    reads = 0
+    methylated = np.zeros(len(coordinates), dtype=np.int64)
+    unmethylated = np.zeros(len(coordinates), dtype=np.int64)
+    for sequence, sam_position, reference_name, cigar, _ in _iter_sam_reads(samfile):
+        if contig is not None and reference_name != contig:
+            continue
+        offsets = None if is_ungapped(cigar, len(sequence)) else projection.offsets(cigar, sam_position)
+        pattern = _get_meth_pattern(coordinates, sequence, sam_position, offsets)
+        reads += 1
+        methylated += [flag == MethFlags.methylated_motif_flag for flag in pattern]
+        unmethylated += [flag == MethFlags.unmethylated_motif_flag for flag in pattern]
+    return reads, methylated, unmethylated
+
+
+def _same_counts(sites: SiteCounter, expected: tuple) -> bool:
+    reads, methylated, unmethylated = expected
+    return sites.reads_number == reads and (sites.methylated == methylated).all() and (sites.unmethylated == unmethylated).all()
+
+
+def test_engines_count_all_reads():
+    coordinates = _coordinates()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_gapped_sam(samfile)
+        with open(samfile, "rb") as src, gzip.open(samfile + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        expected = _count_sites(coordinates, samfile)
+        for path in (samfile, samfile + ".gz"):
+            for options in ({"engine": "python"}, {"engine": "numpy"}, {"engine": "numpy", "jobs": 2}, {"epialleles": True}, {"retain_methylated": True}):
+                storage = MethylationData()
+                extract_meth(coordinates, [path], storage, sites=True, **options)
+                sample = storage.data[0]
+                assert _same_counts(sample.sites, expected), (path, options)
+                # partial reads are counted but not stored
+                assert sample.sites.reads_number == sample.parsed_reads > sample.reads_number
+            sites = SiteCounter(len(coordinates))
+            for _ in stream_meth(coordinates, path, chunk_size=37, sites=sites):
+                pass
+            assert _same_counts(sites, expected)
+
+        storage = MethylationData()
+        extract_meth(coordinates, [samfile], storage)
+        assert storage.data[0].sites is None
+        assert ((sites.methylated + sites.unmethylated + sites.missing) == sites.reads_number).all()
+    print("✓ engines count all reads")
+
+
+def test_contig_counts():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        samfile = os.path.join(tmpdir, "mixed.sam")
+        _write_fasta(fastafile)
+        _write_mixed_sam(samfile)
+        with open(samfile, "rb") as src, gzip.open(samfile + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        contig_coordinates = get_contig_coordinates(fastafile, cache=False)
+        for path in (samfile, samfile + ".gz"):
+            storage = MethylationData()
+            extract_meth_by_contig(contig_coordinates, [path], storage, sites=True)
+            assert storage.data
+            for sample in storage.data:
+                assert _same_counts(sample.sites, _count_sites(contig_coordinates[sample.contig], samfile, sample.contig)), (path, sample.contig)
+            sites = {}
+            for _ in stream_reads_by_contig(contig_coordinates, path, chunk_size=50, sites=sites):
+                pass
+            for sample in storage.data:
+                assert _same_counts(sites[sample.contig], (sample.sites.reads_number, sample.sites.methylated, sample.sites.unmethylated))
+    print("✓ contig counts")
+
+
+def test_sites_output():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "ref.fasta")
+        with open(fastafile, "w") as fh:
+            fh.write(f">ref\n{REFERENCE}\n")
+        samfile = os.path.join(tmpdir, "sample.sam")
+        _write_gapped_sam(samfile)
+        coordinates = _coordinates()
+        reads, methylated, unmethylated = _count_sites(coordinates, samfile)
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            for extra in ([], ["--stream"], ["--cache-dir", "cache"], ["--cache-dir", "cache"]):
+                allelicMeth.main(["--fasta", fastafile, "--sam", samfile, "--outputs", "sites", *extra])
+                with open("sample_sites.csv") as fh:
+                    rows = list(csv.DictReader(fh))
+                assert [int(r["position"]) for r in rows] == [c + 1 for c in coordinates]
+                assert [int(r["methylated"]) for r in rows] == methylated.tolist()
+                assert [int(r["unmethylated"]) for r in rows] == unmethylated.tolist()
+                assert [int(r["missing"]) for r in rows] == (reads - methylated - unmethylated).tolist()
+                assert [float(r["meth_level"]) for r in rows] == (methylated / (methylated + unmethylated)).tolist()
+                os.remove("sample_sites.csv")
+        finally:
+            os.chdir(cwd)
+    print("✓ sites output")
+
+
+def test_contig_with_only_dropped_reads():
+    """A contig whose reads all miss a CpG site still gets its site table."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fastafile = os.path.join(tmpdir, "panel.fasta")
+        samfile = os.path.join(tmpdir, "x.sam")
+        _write_fasta(fastafile)
+        amplicon2 = CONTIGS["amplicon2"]
+        with open(samfile, "w") as fh:
+            fh.write("@HD\tVN:1.6\n")
+            for n in range(20):
+                fh.write(f"full{n}\t0\tamplicon1\t1\t60\t{len(REFERENCE)}M\t*\t0\t0\t{REFERENCE}\t*\n")
+                # starts after the first CpG site of amplicon2
+                fh.write(f"partial{n}\t0\tamplicon2\t4\t60\t{len(amplicon2) - 3}M\t*\t0\t0\t{amplicon2[3:]}\t*\n")
+        contig_coordinates = get_contig_coordinates(fastafile, cache=False)
+        expected = _count_sites(contig_coordinates["amplicon2"], samfile, "amplicon2")
+        for epialleles in (False, True):
+            storage = MethylationData()
+            extract_meth_by_contig(contig_coordinates, [samfile], storage, epialleles=epialleles, sites=True)
+            assert [d.contig for d in storage.data] == ["amplicon1", "amplicon2"]
+            assert storage.data[1].reads_number == 0 and _same_counts(storage.data[1].sites, expected)
+        storage = MethylationData()
+        extract_meth_by_contig(contig_coordinates, [samfile], storage)
+        assert [d.contig for d in storage.data] == ["amplicon1"]
+
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        try:
+            for extra in ([], ["--stream"], ["--epialleles"]):
+                allelicMeth.main(["--fasta", fastafile, "--sam", samfile, "--outputs", "csv,histogram,heatmap,sites", *extra])
+                with open("x_amplicon2_sites.csv") as fh:
+                    rows = list(csv.DictReader(fh))
+                assert [int(r["unmethylated"]) + int(r["methylated"]) for r in rows] == (expected[1] + expected[2]).tolist()
+                assert int(rows[0]["missing"]) == 20
+                os.remove("x_amplicon2_sites.csv")
+        finally:
+            os.chdir(cwd)
+    print("✓ contig with only dropped reads")
+
+
+def main():
+    print("=" * 60)
+    print("Testing per CpG site counts")
+    print("=" * 60)
+
+    try:
+        test_engines_count_all_reads()
+        test_contig_counts()
+        test_sites_output()
+        test_contig_with_only_dropped_reads()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
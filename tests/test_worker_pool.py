@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.10
+"""
+Tests for the worker pool of run_allelicMeth.py directory mode: results are collected in input
+order, a worker process that dies takes down the pool, the pairs not collected yet run again
+and only the crashing pair fails.
+"""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import run_allelicMeth
+from run_allelicMeth import MANIFEST_NAME, AllelicMethOrchestrator
+from test_manifest import _write_directory
+from test_sam_engines import REFERENCE
+
+CRASHING_SAM = "Galaxy3-[sgRNA_Region1_Rep1].sam"
+
+_run_analysis_in_worker = run_allelicMeth._run_analysis_in_worker
+# Set before the workers fork: the crashing run exits its worker while this file does not exist
+_crash_marker = None
+
+
+def _crashing_run(args):
+    """Runs the analysis like _run_analysis_in_worker, the run of CRASHING_SAM kills its worker."""
+    if any(arg.endswith(CRASHING_SAM) for arg in args) and not (_crash_marker and os.path.exists(_crash_marker)):
+        if _crash_marker:
+            open(_crash_marker, "w").close()
+        os._exit(1)
+    return _run_analysis_in_worker(args)
+
+
+def _run(directory: str, crash_marker: str = None) -> tuple:
+    """(success, log) of a directory mode run whose CRASHING_SAM kills the worker, once with a crash_marker."""
+    global _crash_marker
+    _crash_marker = crash_marker
+    log_file = os.path.join(directory, "logs", "run.log")
+    if os.path.exists(log_file):
+        os.remove(log_file)
+    run_allelicMeth._run_analysis_in_worker = _crashing_run
+    try:
+        success = AllelicMethOrchestrator(log_file, logging.INFO).run_directory_mode(directory, jobs=2, force=True)
+    finally:
+        run_allelicMeth._run_analysis_in_worker = _run_analysis_in_worker
+    with open(log_file) as fh:
+        return success, fh.read()
+
+
+def test_pool_run_records_results_in_order():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir, samples=4)
+        bad_sam = "Galaxy3-[sgRNA_Region1_Rep2].sam"
+        with open(os.path.join(tmpdir, bad_sam), "a") as fh:
+            fh.write(f"broken\t0\tRegion1\tx1\t60\t{len(REFERENCE)}M\t*\t0\t0\t{REFERENCE}\t*\n")
+        log_file = os.path.join(tmpdir, "logs", "run.log")
+        assert not AllelicMethOrchestrator(log_file, logging.INFO).run_directory_mode(tmpdir, jobs=2)
+        with open(log_file) as fh:
+            log = fh.read()
+
+        processed = [line.split("] Processing: ")[1] for line in log.splitlines() if "] Processing: " in line]
+        assert [p.split("[")[-1].split("]")[0] for p in processed] == [f"sgRNA_Region1_Rep{n}" for n in range(4)], processed
+        assert "Successful: 3" in log and "Failed: 1" in log
+        failed_pairs = [line for line in log.split("Failed pairs:")[1].splitlines() if "  - " in line]
+        assert len(failed_pairs) == 1 and bad_sam in failed_pairs[0], failed_pairs
+
+        with open(os.path.join(tmpdir, MANIFEST_NAME)) as fh:
+            entries = json.load(fh)["entries"]
+        assert sorted(entries) == [f"Galaxy3-[sgRNA_Region1_Rep{n}].sam" for n in (0, 1, 3)]
+        for n in (0, 1, 3):
+            assert entries[f"Galaxy3-[sgRNA_Region1_Rep{n}].sam"]["outputs"] == [
+                f"Galaxy3-[sgRNA_Region1_Rep{n}].csv",
+                f"Galaxy3-[sgRNA_Region1_Rep{n}]_heatmap.png",
+                f"Galaxy3-[sgRNA_Region1_Rep{n}]_histogram.png",
+            ]
+    print("✓ pool run records results in order")
+
+
+def test_crashed_worker_pairs_run_again():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        success, log = _run(tmpdir, os.path.join(tmpdir, "crashed"))
+        assert success, log
+        assert "Worker process died" in log
+        assert "Successful: 3" in log and "Failed: 0" in log
+        for n in range(3):
+            assert os.path.exists(os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}].csv"))
+    print("✓ pairs of a crashed worker run again")
+
+
+def test_crashing_pair_fails_alone():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _write_directory(tmpdir)
+        success, log = _run(tmpdir)
+        assert not success
+        assert "Successful: 2" in log and "Failed: 1" in log
+        failed_pairs = [line for line in log.split("Failed pairs:")[1].splitlines() if "  - " in line]
+        assert len(failed_pairs) == 1 and CRASHING_SAM in failed_pairs[0], failed_pairs
+        for n in (0, 2):
+            assert os.path.exists(os.path.join(tmpdir, f"Galaxy3-[sgRNA_Region1_Rep{n}].csv"))
+    print("✓ a crashing pair fails alone")
+
+
+def main():
+    print("=" * 60)
+    print("Testing the worker pool of directory mode")
+    print("=" * 60)
+
+    try:
+        test_pool_run_records_results_in_order()
+        test_crashed_worker_pairs_run_again()
+        test_crashing_pair_fails_alone()
+
+        print("\n" + "=" * 60)
+        print("✓ All tests PASSED!")
+        print("=" * 60)
+        return 0
+
+    except Exception as e:
+        print(f"\n✗ Test FAILED with exception: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import struct
+import zlib
+from typing import BinaryIO, Iterator
+
+BAM_MAGIC = b"BAM\x01"
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# Fixed part of an alignment record after block_size:
+# refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_refID, next_pos, tlen
+_RECORD = struct.Struct("<iiBBHHHIiii")
+_INT32 = struct.Struct("<i")
+
+CIGAR_OPERATIONS = "MIDNSHP=X"
+_SEQ_CODES = "=ACMGRSVTWYHKDBN"
+# translate a byte of packed sequence into its first (high nibble) and second (low nibble) base
+_HIGH_BASES = bytes(ord(_SEQ_CODES[i >> 4]) for i in range(256))
+_LOW_BASES = bytes(ord(_SEQ_CODES[i & 15]) for i in range(256))
+
+
+def iter_bam_records(bamfile: str) -> Iterator[tuple]:
+    """Yields alignments of a bam file, decoding only the fields needed for methylation calling.
+
+    Returns tuples of (sequence, sam_position_0based, flag, cigar, reference_name, read_name),
+    reference_name is "*" for unmapped reads
+    """
+    with open(bamfile, "rb") as fh:
+        stream = _BgzfStream(fh)
+        if stream.read(4) != BAM_MAGIC:
+            raise ValueError(f"{bamfile} is not a bam file")
+        l_text = _INT32.unpack(stream.read(4))[0]
+        stream.read(l_text)
+        n_ref = _INT32.unpack(stream.read(4))[0]
+        references = []
+        for _ in range(n_ref):
+            l_name = _INT32.unpack(stream.read(4))[0]
+            references.append(stream.read(l_name + 4)[: l_name - 1].decode("ascii"))
+        while True:
+            size = stream.read(4)
+            if not size:
+                return
+            record = stream.read(_INT32.unpack(size)[0])
+            ref_id, *alignment, read_name = _decode_record(record)
+            yield (*alignment, references[ref_id] if ref_id >= 0 else "*", read_name)
+
+
+def _decode_record(record: bytes) -> tuple:
+    ref_id, pos, l_read_name, _, _, n_cigar_op, flag, l_seq, _, _, _ = _RECORD.unpack_from(record)
+    read_name = record[_RECORD.size : _RECORD.size + l_read_name - 1].decode("ascii")
+    offset = _RECORD.size + l_read_name
+    cigar = "".join(
+        f"{op >> 4}{CIGAR_OPERATIONS[op & 15]}"
+        for op in struct.unpack_from(f"<{n_cigar_op}I", record, offset)
+    ) or "*"
+    offset += 4 * n_cigar_op
+    packed = record[offset : offset + (l_seq + 1) // 2]
+    sequence = bytearray(2 * len(packed))
+    sequence[0::2] = packed.translate(_HIGH_BASES)
+    sequence[1::2] = packed.translate(_LOW_BASES)
+    return ref_id, sequence[:l_seq].decode("ascii"), pos, flag, cigar, read_name
+
+
+def _iter_bgzf_blocks(fh: BinaryIO) -> Iterator[bytes]:
+    """Decompresses a BGZF file block by block."""
+    while True:
+        header = fh.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise ValueError("Not a BGZF compressed file")
+        xlen = struct.unpack_from("<H", header, 10)[0]
+        extra = fh.read(xlen)
+        block_size = None
+        offset = 0
+        while offset < xlen:
+            si1, si2, slen = struct.unpack_from("<BBH", extra, offset)
+            if si1 == 66 and si2 == 67:  # "BC" subfield holds total block size - 1
+                block_size = struct.unpack_from("<H", extra, offset + 4)[0] + 1
+            offset += 4 + slen
+        if block_size is None:
+            raise ValueError("BGZF block without BC field")
+        data = fh.read(block_size - 12 - xlen)
+        # raw deflate data, followed by CRC32 and ISIZE
+        yield zlib.decompress(data[:-8], -15)
+
+
+class _BgzfStream:
+    """Reads bytes across BGZF block borders, keeping only the current block in memory."""
+    def __init__(self, fh: BinaryIO):
+        self._blocks = _iter_bgzf_blocks(fh)
+        self._buffer = b""
+        self._offset = 0
+
+    def read(self, size: int) -> bytes:
+        end = self._offset + size
+        if end <= len(self._buffer):
+            data = self._buffer[self._offset : end]
+            self._offset = end
+            return data
+        parts = [self._buffer[self._offset :]]
+        missing = size - len(parts[0])
+        for block in self._blocks:
+            if missing <= len(block):
+                parts.append(block[:missing])
+                self._buffer = block
+                self._offset = missing
+                return b"".join(parts)
+            parts.append(block)
+            missing -= len(block)
+        self._buffer = b""
+        self._offset = 0
+        return b"".join(parts)
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from typing import Optional
+
+import numpy as np
+
+from utils.fasta import file_digest
+from utils.meth_data import OneSampleMethylationData, SiteCounter
+
+# Version of the cached files, part of every key so older entries are never read
+EXTRACTION_CACHE_VERSION = 1
+EXTRACTION_CACHE_SUFFIX = ".meth.npz"
+# Default size limit of the cache directory, in bytes
+DEFAULT_CACHE_SIZE = 10 << 30
+# Hashes of input files by path, size and mtime, so unchanged files are not hashed again
+_DIGEST_INDEX = "digests.json"
+
+
+class ExtractionCache:
+    """Content-addressed cache of extracted samples in a directory.
+
+    Entries are keyed by the hashes of the sam and fasta file and the extraction options,
+    renamed or copied inputs with the same content hit the same entry. Samples are stored
+    bit-packed in one .npz file per sam file. When the directory grows over max_bytes,
+    the least recently used entries are removed.
+    """
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._digests = self._load_digest_index()
+
+    def key(self, samfile: str, fastafile: str, **options) -> str:
+        """Key of the extraction of samfile against fastafile with options, e.g. motif and retain_methylated."""
+        content = json.dumps(
+            {
+                "version": EXTRACTION_CACHE_VERSION,
+                "sam": self.file_digest(samfile),
+                "fasta": self.file_digest(fastafile),
+                "options": options,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def file_digest(self, path: str) -> str:
+        """sha256 of a file, hashed again only when its size or mtime changed since the last time."""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self._digests.get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_digest(path)
+        self._digests[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._save_digest_index()
+        return digest
+
+    def load(self, key: str, samfile: str) -> Optional[list]:
+        """Returns the cached samples of a key named after samfile, None if there is no entry."""
+        path = self._entry(key)
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+            entries = json.loads(str(arrays["metadata"]))
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # missing, truncated or corrupt entries are misses, the sam file is read again
+            return None
+        # the entry is used: it moves to the end of the eviction order
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        samples = []
+        for i, metadata in enumerate(entries):
+            samples.append(
+                OneSampleMethylationData(
+                    samfile,
+                    metadata["sites_number"],
+                    arrays[f"{i}_covered"],
+                    arrays[f"{i}_methylated"],
+                    reads_number=metadata["reads_number"],
+                    counts=arrays.get(f"{i}_counts"),
+                    contig=metadata["contig"],
+                    read_ids=arrays.get(f"{i}_read_ids"),
+                    parsed_reads=metadata.get("parsed_reads"),
+                    sites=_load_sites(arrays, i, metadata),
+                )
+            )
+        return samples
+
+    def store(self, key: str, samples: list) -> None:
+        """Writes the samples of one sam file atomically, then evicts entries over the size limit.
+
+        Samples with only a level histogram (streamed summaries) cannot be cached and are skipped.
+        """
+        if any(sample.level_histogram is not None for sample in samples):
+            return
+        arrays = {}
+        metadata = []
+        for i, sample in enumerate(samples):
+            arrays[f"{i}_covered"] = sample.covered
+            arrays[f"{i}_methylated"] = sample.methylated
+            if sample.counts is not None:
+                arrays[f"{i}_counts"] = sample.counts
+            if sample.read_ids is not None:
+                arrays[f"{i}_read_ids"] = sample.read_ids
+            if sample.sites is not None:
+                arrays[f"{i}_site_methylated"] = sample.sites.methylated
+                arrays[f"{i}_site_unmethylated"] = sample.sites.unmethylated
+            metadata.append(
+                {
+                    "sites_number": sample.sites_number,
+                    "reads_number": sample.reads_number,
+                    "contig": sample.contig,
+                    "parsed_reads": sample.parsed_reads,
+                    "site_reads": sample.sites.reads_number if sample.sites is not None else None,
+                }
+            )
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                np.savez(fh, metadata=np.array(json.dumps(metadata)), **arrays)
+            os.replace(tmp_name, self._entry(key))
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Removes least recently used entries until the cache fits into max_bytes, keep is never removed."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(EXTRACTION_CACHE_SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        keep = keep and os.path.basename(self._entry(keep))
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key + EXTRACTION_CACHE_SUFFIX)
+
+    def _load_digest_index(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, _DIGEST_INDEX)) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_digest_index(self) -> None:
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w") as fh:
+                json.dump(self._digests, fh)
+            os.replace(tmp_name, os.path.join(self.directory, _DIGEST_INDEX))
+        except OSError:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+
+def _load_sites(arrays: dict, i: int, metadata: dict) -> Optional[SiteCounter]:
+    """SiteCounter of sample i of a cache entry, None if its sites were not counted."""
+    if metadata.get("site_reads") is None:
+        return None
+    sites = SiteCounter(metadata["sites_number"])
+    sites.reads_number = metadata["site_reads"]
+    sites.methylated = arrays[f"{i}_site_methylated"]
+    sites.unmethylated = arrays[f"{i}_site_unmethylated"]
+    return sites
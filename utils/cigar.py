@@ -0,0 +1,77 @@
+import re
+
+import numpy as np
+
+_CIGAR_OPERATION = re.compile(r"(\d+)([MIDNSHP=X])")
+# operations aligning a read base to a reference base, consuming the read and consuming the reference
+ALIGNED_OPERATIONS = "M=X"
+READ_OPERATIONS = "MIS=X"
+REFERENCE_OPERATIONS = "MDN=X"
+
+# Number of (cigar, position) projections kept before the cache is emptied
+CACHE_SIZE = 100000
+
+
+def parse_cigar(cigar: str) -> list:
+    """Splits a CIGAR string into a list of (length, operation)."""
+    return [(int(length), operation) for length, operation in _CIGAR_OPERATION.findall(cigar)]
+
+
+def is_ungapped(cigar: str, read_length: int) -> bool:
+    """Checks whether read offsets are reference offsets: no CIGAR, or one match over the whole read."""
+    return cigar == "*" or cigar == f"{read_length}M"
+
+
+class CigarProjection:
+    """Projects reference CpG sites onto read offsets along the alignment of a read.
+
+    Projections are cached by (cigar, sam_position): reads of an amplicon share few distinct alignments.
+    """
+    def __init__(self, coordinates):
+        coordinates = np.asarray(coordinates, dtype=np.int64)
+        # positions of the C and the G of every CpG site
+        self._positions = np.concatenate([coordinates, coordinates + 1])
+        self._cache = {}
+
+    def offsets(self, cigar: str, sam_position: int) -> tuple:
+        """Returns (c_offsets, g_offsets): read offsets of the C and G of every CpG site, -1 if not aligned.
+
+        A site is not aligned when it lies outside the read, in a deletion or a skipped region.
+        """
+        key = (cigar, sam_position)
+        offsets = self._cache.get(key)
+        if offsets is None:
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            offsets = self._cache[key] = self._project(cigar, sam_position)
+        return offsets
+
+    def _project(self, cigar: str, sam_position: int) -> tuple:
+        reference_starts = []
+        read_starts = []
+        lengths = []
+        reference = sam_position
+        read = 0
+        for length, operation in parse_cigar(cigar):
+            if operation in ALIGNED_OPERATIONS:
+                reference_starts.append(reference)
+                read_starts.append(read)
+                lengths.append(length)
+            if operation in READ_OPERATIONS:
+                read += length
+            if operation in REFERENCE_OPERATIONS:
+                reference += length
+        reference_starts = np.asarray(reference_starts, dtype=np.int64)
+        read_starts = np.asarray(read_starts, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+
+        # aligned blocks are sorted by reference position, find the block of every position
+        block = np.searchsorted(reference_starts, self._positions, side="right") - 1
+        offsets = np.full(len(self._positions), -1, dtype=np.int64)
+        if len(reference_starts):
+            valid = block >= 0
+            shift = self._positions[valid] - reference_starts[block[valid]]
+            inside = shift < lengths[block[valid]]
+            offsets[np.flatnonzero(valid)[inside]] = read_starts[block[valid]][inside] + shift[inside]
+        c_offsets, g_offsets = np.split(offsets, 2)
+        return c_offsets, g_offsets
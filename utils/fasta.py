@@ -1,22 +1,90 @@
-def get_coordinates(fastafile: str, motif: str = "CG") -> list:
-    """Gets path to a fasta files and motif. Returns coordinates of the motif in a fasta file as a list. 
+import hashlib
+import os
+import tempfile
+import zipfile
+from typing import Optional
+
+import numpy as np
+
+# Suffix of the coordinate cache written next to the fasta file, the motif is put in front of it
+COORDINATES_CACHE_SUFFIX = ".coords.npz"
+FAI_SUFFIX = ".fai"
+
+
+def get_coordinates(fastafile: str, motif: str = "CG", cache: bool = True) -> list:
+    """Gets path to a fasta files and motif. Returns coordinates of the motif in a fasta file as a list.
+
+    With cache, coordinates are saved next to the fasta file and reused while the file is unchanged.
     """
+    if not cache:
+        sequence = _get_seq_from_fasta(fastafile)
+        return _find_motif_coordates(sequence, motif)
+    cache_file = _coordinates_cache_file(fastafile, motif)
+    cached = _load_cached_coordinates(cache_file, fastafile, motif)
+    if cached is not None:
+        return cached["coordinates"].tolist()
     sequence = _get_seq_from_fasta(fastafile)
-    return _find_motif_coordates(sequence, motif)
+    coordinates = _find_motif_coordates(sequence, motif)
+    _save_cached_coordinates(cache_file, fastafile, motif, coordinates=coordinates)
+    return coordinates
+
+
+def get_contig_coordinates(fastafile: str, motif: str = "CG", cache: bool = True) -> dict:
+    """Returns coordinates of the motif in every record of a fasta file as a dict of record name: list.
+
+    Record names are the first word of the header, as in the RNAME field of sam files.
+    Coordinates are 0-based within the record, records are in file order.
+    """
+    cache_file = _coordinates_cache_file(fastafile, motif, contigs=True)
+    cached = _load_cached_coordinates(cache_file, fastafile, motif) if cache else None
+    if cached is not None:
+        coordinates = cached["coordinates"].tolist()
+        bounds = cached["bounds"].tolist()
+        return {
+            str(name): coordinates[start:end]
+            for name, start, end in zip(cached["names"], bounds[:-1], bounds[1:])
+        }
+    contig_coordinates = {
+        name: _find_motif_coordates(sequence, motif) for name, sequence in _get_records_from_fasta(fastafile)
+    }
+    if cache:
+        bounds = np.cumsum([0] + [len(c) for c in contig_coordinates.values()])
+        _save_cached_coordinates(
+            cache_file,
+            fastafile,
+            motif,
+            names=np.array(list(contig_coordinates), dtype=str),
+            bounds=bounds,
+            coordinates=[c for coordinates in contig_coordinates.values() for c in coordinates],
+        )
+    return contig_coordinates
 
 
 def _get_seq_from_fasta(fastafile: str) -> str:
-    """Gets sequence from a fastafile.
+    """Gets sequence from a fastafile, sequences of all records are joined.
+    """
+    with open(fastafile, "r") as fh:
+        return "".join(line.strip() for line in fh if not line.startswith(">"))
+
+
+def _get_records_from_fasta(fastafile: str) -> list:
+    """Gets (name, sequence) of every record of a fastafile, lines before the first header make a record named "".
     """
-    sequence = ""
+    records = []
+    name = None
+    lines = []
     with open(fastafile, "r") as fh:
-        line = fh.readline()
-        while line:
+        for line in fh:
             if line.startswith(">"):
-                line = fh.readline()
-            sequence += line.strip()
-            line = fh.readline()
-    return sequence
+                if name is not None or lines:
+                    records.append((name or "", "".join(lines)))
+                name = " ".join(line[1:].split()[:1])
+                lines = []
+            else:
+                lines.append(line.strip())
+    if name is not None or lines:
+        records.append((name or "", "".join(lines)))
+    return records
 
 
 def _find_motif_coordates(sequence: str, motif: str = "CG") -> list:
@@ -34,3 +102,137 @@ def _find_motif_coordates(sequence: str, motif: str = "CG") -> list:
         coordinates.append(index)
         index += motif_len
     return coordinates
+
+
+def _coordinates_cache_file(fastafile: str, motif: str, contigs: bool = False) -> str:
+    if contigs:
+        return f"{fastafile}.{motif}.contigs{COORDINATES_CACHE_SUFFIX}"
+    return f"{fastafile}.{motif}{COORDINATES_CACHE_SUFFIX}"
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_cached_coordinates(cache_file: str, fastafile: str, motif: str) -> Optional[dict]:
+    """Returns the cached arrays, None if there is no cache or the fasta file changed.
+
+    Size and mtime are checked first, the content hash only when the mtime differs,
+    e.g. after the fasta file was copied or touched.
+    """
+    try:
+        with np.load(cache_file) as npz:
+            cached = {key: npz[key] for key in npz.files}
+        size, mtime_ns = cached.pop("stat").tolist()
+        digest = str(cached.pop("sha256"))
+        cached_motif = str(cached.pop("motif"))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    stat = os.stat(fastafile)
+    if cached_motif != motif or size != stat.st_size:
+        return None
+    if mtime_ns != stat.st_mtime_ns:
+        if digest != file_digest(fastafile):
+            return None
+        _save_cached_coordinates(cache_file, fastafile, motif, digest, **cached)
+    return cached
+
+
+def _save_cached_coordinates(cache_file: str, fastafile: str, motif: str, digest: str = None, **arrays) -> None:
+    """Writes the coordinate cache atomically, a cache that cannot be written is skipped.
+
+    arrays are saved next to the fasta file size, mtime and hash, coordinates as int64.
+    """
+    stat = os.stat(fastafile)
+    digest = digest or file_digest(fastafile)
+    try:
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)), suffix=".npz")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            np.savez(
+                fh,
+                stat=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64),
+                sha256=np.array(digest),
+                motif=np.array(motif),
+                **{key: np.asarray(value, dtype=np.int64) if key == "coordinates" else value for key, value in arrays.items()},
+            )
+        os.replace(tmp_name, cache_file)
+    except OSError:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def build_fai(fastafile: str) -> list:
+    """Writes a samtools faidx compatible index next to the fasta file and returns its entries.
+
+    Every entry is (name, length, offset, line_bases, line_width), lines of a record must have the same length.
+    """
+    entries = []
+    with open(fastafile, "rb") as fh:
+        name = None
+        offset = line_bases = line_width = length = 0
+        last_line_short = False
+        position = 0
+        for line in fh:
+            if line.startswith(b">"):
+                if name is not None:
+                    entries.append((name, length, offset, line_bases, line_width))
+                name = line[1:].split()[0].decode()
+                offset = position + len(line)
+                line_bases = line_width = length = 0
+                last_line_short = False
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases == 0:
+                    position += len(line)
+                    continue
+                if last_line_short:
+                    raise ValueError(f"{fastafile}: lines of record {name} differ in length")
+                if line_bases == 0:
+                    line_bases, line_width = bases, len(line)
+                elif bases > line_bases:
+                    raise ValueError(f"{fastafile}: lines of record {name} differ in length")
+                last_line_short = bases < line_bases
+                length += bases
+            position += len(line)
+        if name is not None:
+            entries.append((name, length, offset, line_bases, line_width))
+    with open(fastafile + FAI_SUFFIX, "w") as fh:
+        for entry in entries:
+            fh.write("\t".join(str(v) for v in entry) + "\n")
+    return entries
+
+
+def read_fai(fastafile: str) -> dict:
+    """Returns the faidx index of a fasta file as a dict of name: (length, offset, line_bases, line_width).
+
+    The index is built when missing or older than the fasta file.
+    """
+    fai = fastafile + FAI_SUFFIX
+    if not os.path.exists(fai) or os.path.getmtime(fai) < os.path.getmtime(fastafile):
+        entries = build_fai(fastafile)
+    else:
+        with open(fai) as fh:
+            entries = [line.rstrip("\n").split("\t")[:5] for line in fh if line.strip()]
+    return {name: tuple(int(v) for v in values) for name, *values in entries}
+
+
+def fetch_sequence(fastafile: str, name: str, start: int = 0, end: int = None) -> str:
+    """Returns the 0-based, end exclusive subsequence of a fasta record, reading only the lines it spans."""
+    length, offset, line_bases, line_width = read_fai(fastafile)[name]
+    end = length if end is None else min(end, length)
+    if start >= end:
+        return ""
+    first = offset + start // line_bases * line_width + start % line_bases
+    last = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases
+    with open(fastafile, "rb") as fh:
+        fh.seek(first)
+        data = fh.read(last - first + 1)
+    return data.replace(b"\n", b"").replace(b"\r", b"").decode()
@@ -1,12 +1,16 @@
 import random
-from typing import Protocol
-import seaborn as sns
+from typing import Optional, Protocol
 import matplotlib.pyplot as plt
 import numpy as np
 
 from utils.meth_data import MethylationData, OneSampleMethylationData
 
 
+HEATMAP_DPI = 200
+# At most this many CpG sites are labelled on the x axis of raster heatmaps
+MAX_SITE_LABELS = 30
+
+
 class HeatmapMaker(Protocol):
     def plot(self, methdata: MethylationData, reads2plot: int, output_suffix: str = "") -> None:
         ...
@@ -14,36 +18,75 @@ class HeatmapMaker(Protocol):
 
 class SimpleHeatmapMaker:
     """Makes individual heatmaps from data sets stored in MethylationData class instance.
+
+    seed makes the random selection of reads reproducible.
     """
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+
     def plot(self, methdata: MethylationData, reads2plot: int, output_suffix: str = "") -> None:
+        rng = _random_generator(self.seed)
         for data in methdata.data:
-            if not data.meth_patterns:
+            if not len(data.covered):
                 continue
-            sorted_reads = _get_random_reads_for_heatmap(data, reads2plot)
-            xaxisRange = len(data.meth_patterns[0])
+            sorted_reads = _get_random_reads_for_heatmap(data, reads2plot, rng)
+            xaxisRange = data.sites_number
             _generate_heatmap(sorted_reads, xaxisRange)
-            plt.savefig(data.file_name.strip(".sam") + output_suffix + "_heatmap.png",dpi=200)
+            plt.savefig(data.name + output_suffix + "_heatmap.png",dpi=HEATMAP_DPI)
+
+
+class RasterHeatmapMaker:
+    """Makes the heatmaps of SimpleHeatmapMaker, drawing the patterns as one image instead of a quad per CpG site.
+
+    Renders whole samples in about a second: when there are more reads than pixel rows,
+    neighbouring (sorted) reads are averaged into one row, and CpG site labels are thinned.
+    """
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+
+    def plot(self, methdata: MethylationData, reads2plot: int, output_suffix: str = "") -> None:
+        rng = _random_generator(self.seed)
+        for data in methdata.data:
+            if not len(data.covered):
+                continue
+            sorted_reads = _select_reads_for_heatmap(data, reads2plot, rng)
+            _generate_raster_heatmap(sorted_reads)
+            plt.savefig(data.name + output_suffix + "_heatmap.png", dpi=HEATMAP_DPI)
 
 
 def make_heatmap(methdata: MethylationData, heatmap_maker: HeatmapMaker, reads2plot: int, output_suffix: str = "") -> None:
     heatmap_maker.plot(methdata, reads2plot, output_suffix)
 
-def _get_random_reads_for_heatmap(methdata: OneSampleMethylationData, reads2plot: int):
+def _random_generator(seed: Optional[int]):
+    """The random module itself without a seed, so unseeded runs keep using the global state."""
+    return random if seed is None else random.Random(seed)
+
+def _get_random_reads_for_heatmap(methdata: OneSampleMethylationData, reads2plot: int, rng=random):
     """Generates a list of random methylation patterns for plotting."""
-    if reads2plot >= methdata.reads_number:
-        selected_reads = methdata.meth_patterns
+    return _select_reads_for_heatmap(methdata, reads2plot, rng).tolist()
+
+def _select_reads_for_heatmap(methdata: OneSampleMethylationData, reads2plot: int, rng=random) -> np.ndarray:
+    """Selects random reads for plotting, returns their patterns (reads x CpGs) sorted by methylated CpGs, most first."""
+    # reads represented by the stored patterns: fewer than reads_number for streamed samples,
+    # more than stored patterns for epialleles
+    reads_number = int(methdata.weights.sum())
+    if reads2plot >= reads_number:
+        randomlist = range(0, reads_number)
     else:
         # generate a list of random indices for visualisation
         randomlist = []
-        randomlist = random.sample(range(0, methdata.reads_number), reads2plot)
+        randomlist = rng.sample(range(0, reads_number), reads2plot)
         
-        # select the reads based on the list of random indices
-        selected_reads = []
-        selected_reads = [methdata.meth_patterns[ind] for ind in randomlist]
-    sorted_reads = sorted(selected_reads, key=lambda x: sum(x), reverse=True)
-    return sorted_reads
+    # unpack only the patterns of the selected reads
+    selected_reads = methdata.matrix(methdata.read_rows(randomlist))
+    # stable sort keeps the sampling order of reads with the same sum
+    order = np.argsort(-selected_reads.sum(axis=1, dtype=np.int64), kind="stable")
+    return selected_reads[order]
 
 def _generate_heatmap(data: list, xrange: int, color="copper"):
+    # seaborn is slow to import, it is only needed by this renderer
+    import seaborn as sns
+
     plt.close("all")
     reads_number = len(data)
     fig, ax = plt.subplots(figsize=(6,4))
@@ -66,4 +109,50 @@ def _generate_heatmap(data: list, xrange: int, color="copper"):
         fontweight="normal", #'normal' | 'bold' | 'heavy' | 'light' | 'ultrabold' | 'ultralight'    
     )
     # plt.tight_layout()
-    return
\ No newline at end of file
+    return
+
+
+def _generate_raster_heatmap(data: np.ndarray, color="copper"):
+    """Draws sorted patterns (reads x CpGs) as one image, looking like _generate_heatmap."""
+    plt.close("all")
+    reads_number, sites_number = data.shape
+    fig, ax = plt.subplots(figsize=(6,4))
+    pixel_rows = int(fig.get_figheight() * ax.get_position().height * HEATMAP_DPI)
+    ax.imshow(
+        _downsample_rows(data, pixel_rows),
+        aspect="auto",
+        interpolation="nearest",
+        cmap=color,
+        vmin=0,
+        vmax=1,
+    )
+    ticks = _thin_ticks(sites_number, MAX_SITE_LABELS)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(ticks + 1)
+    ax.set_yticks([])
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.set_xlabel("CpG site")
+    ax.set_ylabel(f"Reads ({reads_number})")
+    ax.set_title("Methylation of individual reads",
+        fontsize=14,
+        color="black",
+        fontweight="normal",
+    )
+    return
+
+
+def _downsample_rows(data: np.ndarray, max_rows: int) -> np.ndarray:
+    """Averages neighbouring rows so that at most max_rows are left, as many rows as pixels are drawn."""
+    data = data.astype(np.float32)
+    if len(data) <= max_rows:
+        return data
+    edges = np.linspace(0, len(data), max_rows + 1).round().astype(np.int64)
+    sums = np.add.reduceat(data, edges[:-1], axis=0)
+    return sums / np.diff(edges)[:, None]
+
+
+def _thin_ticks(sites_number: int, max_labels: int) -> np.ndarray:
+    """Positions of labelled CpG sites: every site, or every n-th one when there are more than max_labels."""
+    step = -(-sites_number // max_labels) if sites_number > max_labels else 1
+    return np.arange(0, sites_number, step)
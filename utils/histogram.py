@@ -1,11 +1,11 @@
 from matplotlib import pyplot as plt
-import seaborn as sns
-import pandas as pd
+from matplotlib.colors import to_rgba
+import numpy as np
 
 
 from typing import Protocol
 
-from utils.meth_data import MethylationData, OneSampleMethylationData
+from utils.meth_data import LEVEL_BINS, MethylationData
 
 class HistogramMaker(Protocol):
     """Interface for any histogarm maker"""
@@ -18,18 +18,15 @@ class SingleDataHistogramMaker:
     """
     def plot(self, methdata: MethylationData, output_suffix: str = "") -> None:
         for data in  methdata.data:
-            formated_data = _format_data_2_df(data)
-            _generate_histogram(formated_data)
-            plt.savefig(data.file_name.strip(".sam") + output_suffix + "_histogram.png")
+            _generate_histogram(data.level_counts())
+            plt.savefig(data.name + output_suffix + "_histogram.png")
 
 
 class MultipleDataHistogramMaker:
+    """Overlays histograms of all data sets, every sample is drawn from its binned counts."""
     def plot(self, methdata: MethylationData, output_suffix: str = "") -> None:
-        main_df = pd.DataFrame(columns=["meth_pattern", "meth_level", "sample"])
-        for data in  methdata.data:
-            formated_data = _format_data_2_df(data)
-            main_df = pd.concat([main_df, formated_data], axis=0, ignore_index=True)
-        _generate_histogram_multiple_data(main_df)
+        counts = {data.name: data.level_counts() for data in methdata.data}
+        _generate_histogram_multiple_data(counts)
         plt.savefig("overlay_histogram" + output_suffix + ".png")
 
 
@@ -37,49 +34,50 @@ def make_histogram(methdata: MethylationData, hist_maker: HistogramMaker, output
     """Make a histogram"""
     hist_maker.plot(methdata, output_suffix)
 
-def _format_data_2_df(methdata: OneSampleMethylationData) -> pd.DataFrame:
-    df = pd.DataFrame()
-    df["meth_pattern"] = methdata.meth_patterns
-    df["meth_level"] = methdata.meth_levels
-    df["sample"] = methdata.file_name.strip(".sam")
-    return df
+def _level_fractions(counts: np.ndarray) -> np.ndarray:
+    """Fraction of reads in every bin, stat="probability" of seaborn's histplot."""
+    total = counts.sum()
+    return counts / total if total else np.zeros(len(counts))
+
+def _plot_bins(ax, counts: np.ndarray, color, alpha: float, **kwargs) -> None:
+    """Draws binned counts of LEVEL_BINS as histogram bars, transparent fill with opaque edges."""
+    ax.bar(
+        LEVEL_BINS[:-1],
+        _level_fractions(counts),
+        width=np.diff(LEVEL_BINS),
+        align="edge",
+        facecolor=to_rgba(color, alpha),
+        edgecolor="black",
+        **kwargs,
+    )
 
-def _generate_histogram(data: pd.DataFrame):
+def _despine(ax) -> None:
+    ax.spines["top"].set_visible(False)
+    ax.spines["right"].set_visible(False)
+
+def _generate_histogram(counts: np.ndarray):
     plt.close("all")
     f, ax = plt.subplots(figsize=(6,4))
-    sns.histplot(
-        data=data,
-        x='meth_level',
-        stat="probability",
-        common_norm=False,
-        bins=10,
-        binrange=(0,1.),
-        color="0.8",
-        kde=False,
-        )
-    #ax.lines[0].set_color('crimson') # for kde=True
+    _plot_bins(ax, counts, "0.8", 0.75)
     ax.set_xlim(-0.05,1.05)
     ax.set_xlabel("Methylation level")
     ax.set_ylabel("Reads fraction")
     ax.set_title("Distribution of methylation levels within the sample")
-    sns.despine()
+    _despine(ax)
 
 
-def _generate_histogram_multiple_data(data: pd.DataFrame):
+def _generate_histogram_multiple_data(counts: dict):
+    """counts: dict of sample name: reads in every bin of LEVEL_BINS"""
     plt.close("all")
     f, ax = plt.subplots(figsize=(6,4))
-    sns.histplot(
-        data=data,
-        x="meth_level",
-        hue="sample",
-        stat="probability",
-        common_norm=False,
-        bins=10,
-        binrange=(0,1.),
-        kde=False,
-    )
-    sns.despine()
+    # the first sample is drawn last, on top, like seaborn's layered histograms
+    for i, (sample, sample_counts) in reversed(list(enumerate(counts.items()))):
+        _plot_bins(ax, sample_counts, f"C{i}", 0.5, label=sample)
+    if counts:
+        handles, labels = ax.get_legend_handles_labels()
+        ax.legend(handles[::-1], labels[::-1], title="sample")
+    _despine(ax)
     ax.set_xlim(-0.05,1.05)
     ax.set_ylabel("Reads fraction")
     ax.set_xlabel("Methylation level")
-    ax.set_title("Distribution of methylation levels in samples")
\ No newline at end of file
+    ax.set_title("Distribution of methylation levels in samples")
@@ -1,11 +1,155 @@
+import math
 from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+import numpy as np
+
+# Codes used in int8 call matrices (reads x CpGs)
+METHYLATED_CALL = 1
+UNMETHYLATED_CALL = 0
+MISSING_CALL = -1
+
+# Alignment file extensions accepted as input, longest first
+SAM_EXTENSIONS = (".sam.gz", ".sam", ".bam")
+
+# Bin edges of methylation level histograms, same as bins=10, binrange=(0, 1) in the plots
+LEVEL_BINS = np.linspace(0, 1, 11)
+
+
+# Number of set bits of every byte value, used to count CpGs in packed masks
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def sample_name(file_name: str) -> str:
+    """Returns the alignment file name without its extension, used to name output files."""
+    for extension in SAM_EXTENSIONS:
+        if file_name.endswith(extension):
+            return file_name[: -len(extension)]
+    return file_name
+
 
-@dataclass(frozen=True)
 class OneSampleMethylationData:
-    file_name: str
-    reads_number: int
-    meth_patterns: list
-    meth_levels: list[float]
+    """Methylation patterns of the reads of one sample, stored as two bit-packed masks per read.
+
+    covered: bit is set if the CpG site was called in the read
+    methylated: bit is set if the CpG site was methylated
+    Both are uint8 arrays (reads x ceil(sites / 8)) as produced by np.packbits.
+    counts: number of reads sharing every stored pattern (epiallele mode), None if one row is one read.
+    reads_number can exceed the number of stored reads when only a sample of them was kept.
+    contig: reference contig of the reads when the reference has several contigs, None otherwise.
+    read_ids: names (QNAME, bytes) of the stored reads if they were kept, None otherwise.
+    parsed_reads: number of alignments read for the sample, retained or not, None if unknown.
+    sites: SiteCounter with per CpG counts of all called reads if they were counted, None otherwise.
+    """
+    __slots__ = (
+        "file_name", "reads_number", "sites_number", "covered", "methylated", "counts", "level_histogram", "contig", "read_ids",
+        "parsed_reads", "sites",
+    )
+
+    def __init__(
+        self,
+        file_name: str,
+        sites_number: int,
+        covered: np.ndarray,
+        methylated: np.ndarray,
+        reads_number: Optional[int] = None,
+        counts: Optional[np.ndarray] = None,
+        level_histogram: Optional[np.ndarray] = None,
+        contig: Optional[str] = None,
+        read_ids: Optional[np.ndarray] = None,
+        parsed_reads: Optional[int] = None,
+        sites: Optional["SiteCounter"] = None,
+    ):
+        self.file_name = file_name
+        self.sites_number = sites_number
+        self.covered = covered
+        self.methylated = methylated
+        self.counts = counts
+        if reads_number is None:
+            reads_number = len(covered) if counts is None else int(counts.sum())
+        self.reads_number = reads_number
+        self.level_histogram = level_histogram
+        self.contig = contig
+        self.read_ids = read_ids
+        self.parsed_reads = parsed_reads
+        self.sites = sites
+
+    @classmethod
+    def from_matrices(cls, file_name: str, sites_number: int, matrices: Iterable[np.ndarray], **kwargs) -> "OneSampleMethylationData":
+        """Packs int8 call matrices (reads x CpGs, see METHYLATED_CALL etc.) into one sample.
+
+        matrices can be a generator, every matrix is packed as soon as it is produced.
+        """
+        covered = []
+        methylated = []
+        for m in matrices:
+            covered.append(np.packbits(m != MISSING_CALL, axis=1))
+            methylated.append(np.packbits(m == METHYLATED_CALL, axis=1))
+        width = (sites_number + 7) // 8
+        return cls(
+            file_name=file_name,
+            sites_number=sites_number,
+            covered=np.concatenate(covered) if covered else np.empty((0, width), dtype=np.uint8),
+            methylated=np.concatenate(methylated) if methylated else np.empty((0, width), dtype=np.uint8),
+            **kwargs,
+        )
+
+    @classmethod
+    def from_patterns(cls, file_name: str, sites_number: int, meth_patterns: list, **kwargs) -> "OneSampleMethylationData":
+        """Packs patterns given as lists of MethFlags into one sample."""
+        matrix = np.array([[_FLAG_CALLS[flag] for flag in pattern] for pattern in meth_patterns], dtype=np.int8)
+        matrix = matrix.reshape(len(meth_patterns), sites_number)
+        return cls.from_matrices(file_name, sites_number, [matrix], **kwargs)
+
+    @property
+    def name(self) -> str:
+        """Name of the sample in output files: file name without extension, followed by the contig if there is one."""
+        name = sample_name(self.file_name)
+        return f"{name}_{self.contig}" if self.contig else name
+
+    @property
+    def weights(self) -> np.ndarray:
+        """Number of reads represented by every stored pattern."""
+        if self.counts is None:
+            return np.ones(len(self.covered), dtype=np.int64)
+        return self.counts
+
+    def read_rows(self, reads) -> np.ndarray:
+        """Maps read indices (0 .. sum of weights) to the rows storing their patterns."""
+        reads = np.asarray(reads, dtype=np.int64)
+        if self.counts is None:
+            return reads
+        return np.searchsorted(np.cumsum(self.counts), reads, side="right")
+
+    @property
+    def levels(self) -> np.ndarray:
+        """Methylation level of every stored read: methylated CpGs / all CpGs."""
+        return _POPCOUNT[self.methylated].sum(axis=1, dtype=np.int64) / self.sites_number
+
+    def level_counts(self) -> np.ndarray:
+        """Number of reads in every bin of LEVEL_BINS, the running histogram of streamed samples."""
+        if self.level_histogram is not None:
+            return self.level_histogram
+        return np.histogram(self.levels, bins=LEVEL_BINS, weights=self.weights)[0].astype(np.int64)
+
+    @property
+    def meth_levels(self) -> list:
+        return self.levels.tolist()
+
+    def matrix(self, rows=slice(None)) -> np.ndarray:
+        """Unpacks (selected) reads into an int8 call matrix (reads x CpGs)."""
+        covered = np.unpackbits(self.covered[rows], axis=1, count=self.sites_number).astype(bool)
+        methylated = np.unpackbits(self.methylated[rows], axis=1, count=self.sites_number).astype(np.int8)
+        return np.where(covered, methylated, np.int8(MISSING_CALL))
+
+    @property
+    def meth_patterns(self) -> list:
+        """Patterns as lists of MethFlags, one per stored read."""
+        matrix = self.matrix()
+        if (matrix != MISSING_CALL).all():
+            return matrix.tolist()
+        flags = {call: flag for flag, call in _FLAG_CALLS.items()}
+        return [[flags[call] for call in row] for row in matrix.tolist()]
 
 
 @dataclass
@@ -16,8 +160,146 @@ class MethylationData:
         self.data.append(sample)
 
 
+class EpialleleCounter:
+    """Hash map of methylation pattern -> number of reads, filled during extraction.
+
+    Patterns are keyed by the bytes of their int8 call row and kept in order of first appearance.
+    """
+    def __init__(self, sites_number: int):
+        self.sites_number = sites_number
+        self.epialleles = {}
+
+    def add_pattern(self, meth_pattern: list) -> None:
+        """Counts one read given as a list of MethFlags."""
+        key = bytes(_FLAG_CALLS[flag] & 0xFF for flag in meth_pattern)
+        self.epialleles[key] = self.epialleles.get(key, 0) + 1
+
+    def add_matrix(self, matrix: np.ndarray) -> None:
+        """Counts a chunk of reads given as an int8 call matrix (reads x CpGs)."""
+        if not len(matrix):
+            return
+        patterns, first, counts = np.unique(matrix, axis=0, return_index=True, return_counts=True)
+        for row in np.argsort(first):
+            key = patterns[row].tobytes()
+            self.epialleles[key] = self.epialleles.get(key, 0) + int(counts[row])
+
+    def to_sample(self, file_name: str) -> OneSampleMethylationData:
+        matrix = np.frombuffer(b"".join(self.epialleles), dtype=np.int8).reshape(-1, self.sites_number)
+        counts = np.fromiter(self.epialleles.values(), dtype=np.int64, count=len(self.epialleles))
+        return OneSampleMethylationData.from_matrices(file_name, self.sites_number, [matrix], counts=counts)
+
+
+class SiteCounter:
+    """Per CpG counts of methylated and unmethylated calls, filled during extraction.
+
+    Every called read is counted, also reads dropped afterwards for partial coverage or a zero
+    level, so the counts describe every site of the sam file in the same pass.
+    """
+    def __init__(self, sites_number: int):
+        self.reads_number = 0
+        self.methylated = np.zeros(sites_number, dtype=np.int64)
+        self.unmethylated = np.zeros(sites_number, dtype=np.int64)
+
+    @property
+    def missing(self) -> np.ndarray:
+        """Reads without a call at every site: the site is outside the read, deleted or not read as CG/TG."""
+        return self.reads_number - self.methylated - self.unmethylated
+
+    def add_matrix(self, matrix: np.ndarray) -> None:
+        """Counts a chunk of reads given as an int8 call matrix (reads x CpGs)."""
+        self.methylated += (matrix == METHYLATED_CALL).sum(axis=0)
+        self.unmethylated += (matrix == UNMETHYLATED_CALL).sum(axis=0)
+        self.reads_number += len(matrix)
+
+    def add_pattern(self, meth_pattern: list) -> None:
+        """Counts one read given as a list of MethFlags."""
+        for site, flag in enumerate(meth_pattern):
+            if flag == MethFlags.methylated_motif_flag:
+                self.methylated[site] += 1
+            elif flag == MethFlags.unmethylated_motif_flag:
+                self.unmethylated[site] += 1
+        self.reads_number += 1
+
+    def merge(self, other: "SiteCounter") -> None:
+        """Adds the counts of another part of the same sam file."""
+        self.methylated += other.methylated
+        self.unmethylated += other.unmethylated
+        self.reads_number += other.reads_number
+
+
+class MethylationSummary:
+    """Running aggregates of one sample, updated chunk by chunk while a sam file is streamed.
+
+    Keeps a histogram of methylation levels and a reservoir sample of patterns for the
+    heatmap, so memory does not grow with the number of reads. Per CpG counts of a streamed
+    file are kept by the SiteCounter given to the stream, see utils.sam.stream_meth.
+    seed makes the sample reproducible.
+    """
+    def __init__(self, file_name: str, sites_number: int, reads2plot: int, seed: Optional[int] = None):
+        self.file_name = file_name
+        self.reads_number = 0
+        self.level_histogram = np.zeros(len(LEVEL_BINS) - 1, dtype=np.int64)
+        self.heatmap_reads = np.empty((reads2plot, sites_number), dtype=np.int8)
+        self.heatmap_size = 0
+        self._rng = np.random.default_rng(seed)
+        # algorithm L state: weight of the reservoir and index (over the whole file) of the next read to take
+        self._weight = None
+        self._next_read = None
+
+    def update(self, matrix: np.ndarray, levels: np.ndarray) -> None:
+        """Adds a chunk of reads: int8 call matrix (reads x CpGs) and their methylation levels."""
+        self.level_histogram += np.histogram(levels, bins=LEVEL_BINS)[0]
+        self._sample_reads(matrix)
+        self.reads_number += len(levels)
+
+    def _sample_reads(self, matrix: np.ndarray) -> None:
+        """Reservoir sampling (algorithm L) of reads for the heatmap.
+
+        Once the reservoir is full, the number of reads skipped before the next one is taken is drawn directly,
+        so random numbers are only drawn for reads entering the reservoir.
+        """
+        capacity = len(self.heatmap_reads)
+        free = min(capacity - self.heatmap_size, len(matrix))
+        self.heatmap_reads[self.heatmap_size : self.heatmap_size + free] = matrix[:free]
+        self.heatmap_size += free
+        if self.heatmap_size < capacity or capacity == 0:
+            return
+        if self._weight is None:
+            self._weight = 1.0
+            self._next_read = capacity - 1
+            self._skip_reads()
+        end = self.reads_number + len(matrix)
+        while self._next_read < end:
+            self.heatmap_reads[self._rng.integers(capacity)] = matrix[self._next_read - self.reads_number]
+            self._skip_reads()
+
+    def _skip_reads(self) -> None:
+        capacity = len(self.heatmap_reads)
+        # 1 - random() is in (0, 1], its log is defined
+        self._weight *= math.exp(math.log(1.0 - self._rng.random()) / capacity)
+        self._next_read += math.floor(math.log(1.0 - self._rng.random()) / math.log1p(-self._weight)) + 1
+
+    def to_sample(self) -> OneSampleMethylationData:
+        """Sample data for plotting: the reservoir as stored reads, levels as histogram counts."""
+        return OneSampleMethylationData.from_matrices(
+            self.file_name,
+            self.heatmap_reads.shape[1],
+            [self.heatmap_reads[: self.heatmap_size]],
+            reads_number=self.reads_number,
+            level_histogram=self.level_histogram.copy(),
+        )
+
+
 @dataclass(frozen=True)
 class MethFlags:
     methylated_motif_flag = 1
     unmethylated_motif_flag = 0
-    missing_motif_flag = "!"
\ No newline at end of file
+    missing_motif_flag = "!"
+
+
+# MethFlags of list patterns -> codes of call matrices
+_FLAG_CALLS = {
+    MethFlags.methylated_motif_flag: METHYLATED_CALL,
+    MethFlags.unmethylated_motif_flag: UNMETHYLATED_CALL,
+    MethFlags.missing_motif_flag: MISSING_CALL,
+}
@@ -0,0 +1,115 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PROFILE_VERSION = 1
+
+# Set once a process has run an analysis and runs another, see share_process
+_shared_process = False
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size in MB of this process and of its largest finished child, None where it cannot be read.
+
+    The peak only grows over the life of a process, a stage reports the peak reached until its end.
+    In a process shared by several runs (see share_process) the peak may be of an earlier run, None is returned.
+    """
+    if resource is None or _shared_process:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+
+
+def share_process() -> None:
+    """Marks this process as reused for further runs, e.g. a worker of a process pool.
+
+    Its peak RSS then includes earlier runs and is no longer reported, see peak_rss_mb.
+    """
+    global _shared_process
+    _shared_process = True
+
+
+def _cpu_seconds() -> float:
+    """User and system time of this process and of its finished children, e.g. extraction workers."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageProfiler:
+    """Records wall time, CPU time, reads and peak memory of the stages of a run.
+
+    A disabled profiler measures nothing, its stages still yield a record dict so callers need no checks.
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.records = []
+
+    @contextmanager
+    def stage(self, name: str, samfile: Optional[str] = None) -> Iterator[dict]:
+        """Profiles the block as stage name of samfile (None for stages of all sam files).
+
+        The block can add reads_parsed, reads_retained and reads_dropped to the yielded record,
+        reads/s is computed from the parsed reads, or the retained ones for stages writing outputs.
+        """
+        record = {"stage": name, "sam": samfile}
+        if not self.enabled:
+            yield record
+            return
+        wall = time.perf_counter()
+        cpu = _cpu_seconds()
+        yield record
+        record["wall_seconds"] = time.perf_counter() - wall
+        record["cpu_seconds"] = _cpu_seconds() - cpu
+        record["peak_rss_mb"] = peak_rss_mb()
+        reads = record.get("reads_parsed", record.get("reads_retained"))
+        if reads is not None and record["wall_seconds"] > 0:
+            record["reads_per_second"] = reads / record["wall_seconds"]
+        self.records.append(record)
+
+    def save(self, path: str, **metadata) -> None:
+        """Writes the records and metadata, e.g. input files and options, to a JSON file."""
+        with open(path, "w") as fh:
+            json.dump({"version": PROFILE_VERSION, **metadata, "stages": self.records}, fh, indent=2)
+
+
+def merge_profiles(profiles: list) -> dict:
+    """Totals of the stage records of several profiles by stage name, in order of first appearance.
+
+    Every stage gets runs, wall_seconds, cpu_seconds, reads_parsed, reads_retained,
+    reads_per_second (over the stages reporting reads) and the largest peak_rss_mb.
+    """
+    totals = {}
+    for profile in profiles:
+        for record in profile.get("stages", []):
+            total = totals.setdefault(
+                record["stage"],
+                {"runs": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "reads_parsed": 0, "reads_retained": 0, "peak_rss_mb": None, "_rate_seconds": 0.0, "_rate_reads": 0},
+            )
+            total["runs"] += 1
+            total["wall_seconds"] += record.get("wall_seconds", 0.0)
+            total["cpu_seconds"] += record.get("cpu_seconds", 0.0)
+            total["reads_parsed"] += record.get("reads_parsed") or 0
+            total["reads_retained"] += record.get("reads_retained") or 0
+            reads = record.get("reads_parsed", record.get("reads_retained"))
+            if reads is not None:
+                total["_rate_reads"] += reads
+                total["_rate_seconds"] += record.get("wall_seconds", 0.0)
+            if record.get("peak_rss_mb") is not None:
+                total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0.0, record["peak_rss_mb"])
+    for total in totals.values():
+        rate_reads = total.pop("_rate_reads")
+        rate_seconds = total.pop("_rate_seconds")
+        total["reads_per_second"] = rate_reads / rate_seconds if rate_seconds > 0 else None
+    return totals
@@ -1,102 +1,832 @@
-from utils.meth_data import MethFlags, MethylationData, OneSampleMethylationData
+import gzip
+import os
+import tempfile
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
+from typing import Iterator
 
-def extract_meth(coordinates: list, samfiles: list, storage: MethylationData, retain_methylated: bool = False):
+import numpy as np
+
+from utils.bam import iter_bam_records
+from utils.cigar import CigarProjection, is_ungapped
+from utils.meth_data import (
+    METHYLATED_CALL,
+    MISSING_CALL,
+    UNMETHYLATED_CALL,
+    EpialleleCounter,
+    MethFlags,
+    MethylationData,
+    OneSampleMethylationData,
+    SiteCounter,
+)
+from utils.sam_mmap import gather_strings, iter_sam_blocks
+
+# Number of reads converted to an array and called at once by the numpy engine
+BATCH_SIZE = 10000
+
+
+def extract_meth(coordinates: list, samfiles: list, storage: MethylationData, retain_methylated: bool = False, engine: str = "python", epialleles: bool = False, jobs: int = 1, read_ids: bool = False, sites: bool = False):
     """Extracts methylation patterns and methylation levels of individual reads from a list of sam files.
 
     Args:
         coordinates: List of CpG site coordinates from reference sequence
-        samfiles: List of SAM file paths to process
+        samfiles: List of SAM file paths to process, plain (.sam), gzip compressed (.sam.gz) or BAM (.bam)
         storage: MethylationData object to store results
         retain_methylated: If True, only keep reads with at least one methylated CpG site
+        engine: "python" calls reads one by one, "numpy" calls blocks of reads at once
+        epialleles: If True, store every distinct pattern once together with its number of reads
+        jobs: Number of processes extracting sam files in parallel. With fewer files than jobs,
+            every plain sam file is split into byte ranges called in parallel with the numpy engine instead
+        read_ids: If True, keep the names (QNAME) of the stored reads in the read_ids of every sample,
+            not available with epialleles
+        sites: If True, count methylated, unmethylated and missing calls per CpG site of all called reads,
+            also reads dropped for partial coverage, in the sites of every sample
     """
+    if engine not in _ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', use one of: {', '.join(_ENGINES)}")
+    get_meth_sam = partial(_ENGINES[engine], retain_methylated=retain_methylated, epialleles=epialleles, read_ids=read_ids, sites=sites)
+    if jobs > 1 and len(samfiles) < jobs:
+        # too few files to keep all processes busy, split every plain sam file into byte ranges instead
+        for s in samfiles:
+            if _is_compressed(s):
+                meth = get_meth_sam(coordinates, s)
+            else:
+                meth = _get_meth_sam_chunked(coordinates, s, retain_methylated=retain_methylated, epialleles=epialleles, jobs=jobs, read_ids=read_ids, sites=sites)
+            storage.add(meth)
+        return
+    if jobs > 1:
+        # coordinates are sent to every worker once, not with every sam file
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(samfiles)),
+            initializer=_init_worker,
+            initargs=(coordinates,),
+        ) as executor:
+            # map returns results in the order of samfiles
+            for meth in executor.map(_get_meth_sam_in_worker, samfiles, repeat(get_meth_sam)):
+                storage.add(meth)
+        return
     for s in samfiles:
-        meth = _get_meth_sam(coordinates, s, retain_methylated=retain_methylated)
+        meth = get_meth_sam(coordinates, s)
         storage.add(meth)
 
 
-def _get_meth_sam(coordinates: list, samfile: str, retain_methylated: bool = False) -> OneSampleMethylationData:
+def extract_meth_by_contig(contig_coordinates: dict, samfiles: list, storage: MethylationData, retain_methylated: bool = False, epialleles: bool = False, jobs: int = 1, read_ids: bool = False, sites: bool = False):
+    """Extracts methylation of sam files aligned to a reference with several contigs, e.g. a panel of amplicons.
+
+    Every read is routed to the CpG coordinates of its contig by RNAME, in one pass over the file.
+    One sample per contig with reads is added to storage, in the order of contig_coordinates.
+    With sites, contigs whose reads were all dropped are added as empty samples with their site counts.
+    Reads are called with the numpy engine.
+
+    Args:
+        contig_coordinates: Dict of contig name: list of CpG site coordinates in the contig
+        samfiles: List of SAM file paths to process, see extract_meth
+        storage: MethylationData object to store results
+        retain_methylated: If True, only keep reads with at least one methylated CpG site
+        epialleles: If True, store every distinct pattern once together with its number of reads
+        jobs: Number of processes extracting sam files in parallel
+        read_ids: If True, keep the names of the stored reads, see extract_meth
+        sites: If True, count calls per CpG site of every contig, see extract_meth
+    """
+    get_meth_contigs = partial(_get_meth_sam_by_contig, retain_methylated=retain_methylated, epialleles=epialleles, read_ids=read_ids, sites=sites)
+    if jobs > 1 and len(samfiles) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(samfiles)),
+            initializer=_init_worker,
+            initargs=(contig_coordinates,),
+        ) as executor:
+            for samples in executor.map(_get_meth_sam_in_worker, samfiles, repeat(get_meth_contigs)):
+                for meth in samples:
+                    storage.add(meth)
+        return
+    for s in samfiles:
+        for meth in get_meth_contigs(contig_coordinates, s):
+            storage.add(meth)
+
+
+class ReadCounter:
+    """Counts the alignments read from a sam file, in total and per reference contig (RNAME) when reads are routed to contigs."""
+    def __init__(self):
+        self.reads = 0
+        self.contigs = {}
+
+    def wrap(self, reads: Iterator[tuple]) -> Iterator[tuple]:
+        """Counts the alignments of an iterator as they are consumed."""
+        for read in reads:
+            self.reads += 1
+            yield read
+
+
+# Coordinates shared by all tasks of a worker process, set by _init_worker
+_worker_coordinates = None
+
+def _init_worker(coordinates: list) -> None:
+    global _worker_coordinates
+    _worker_coordinates = coordinates
+
+def _get_meth_sam_in_worker(samfile: str, get_meth_sam) -> OneSampleMethylationData:
+    return get_meth_sam(_worker_coordinates, samfile)
+
+
+def _get_meth_sam(coordinates: list, samfile: str, retain_methylated: bool = False, epialleles: bool = False, read_ids: bool = False, sites: bool = False) -> OneSampleMethylationData:
     """Extracts methylation patterns and methylation levels of individual reads in a sam file.
 
     Args:
         coordinates: List of CpG site coordinates from reference sequence
         samfile: Path to SAM file to process
         retain_methylated: If True, only keep reads with at least one methylated CpG site
+        epialleles: If True, collapse reads into distinct patterns with counts
+        read_ids: If True, keep the names of the stored reads
+        sites: If True, count the calls of every read per CpG site, before reads are dropped
 
     Returns
     -------
     OneSampleMethylationData class with the following variables:
         file_name: str,
         reads_number: int,
-        meth_patterns: list,
-        meth_levels: list
+        sites_number: int,
+        covered: packed mask of called CpGs,
+        methylated: packed mask of methylated CpGs,
+        counts: reads per pattern in epiallele mode
+        read_ids: names of the stored reads
+        parsed_reads: number of alignments read from the file
+        sites: SiteCounter of all called reads if sites is True
     """
-    total_read_number = 0
     all_meth_patterns = []
-    all_meth_levels = []
-    with open(samfile, "r") as fh:
-        for i in fh:
-            if i.startswith("@"):
+    read_names = []
+    counter = EpialleleCounter(len(coordinates))
+    projection = CigarProjection(coordinates)
+    read_counter = ReadCounter()
+    site_counter = SiteCounter(len(coordinates)) if sites else None
+    for sequence, sam_position, _, cigar, read_name in read_counter.wrap(_iter_sam_reads(samfile)):
+        if is_ungapped(cigar, len(sequence)):
+            if not _covers_all_cpgs(coordinates, sam_position, len(sequence)):
+                if sites:
+                    site_counter.add_pattern(_get_meth_pattern(coordinates, sequence, sam_position))
                 continue
-            sequence, sam_position = _parse_sam_line(i)
-            meth_pattern = _get_meth_pattern(coordinates=coordinates, sequence=sequence, sam_position=sam_position)
-            meth_level = _calculate_meth_level(meth_pattern)
-            if not meth_level:
+            offsets = None
+        else:
+            offsets = projection.offsets(cigar, sam_position)
+        meth_pattern = _get_meth_pattern(coordinates=coordinates, sequence=sequence, sam_position=sam_position, offsets=offsets)
+        if sites:
+            site_counter.add_pattern(meth_pattern)
+        meth_level = _calculate_meth_level(meth_pattern)
+        if not meth_level:
+            continue
+        # Filter: if retain_methylated is True, skip reads with no methylated CpGs
+        if retain_methylated:
+            methylated_count = meth_pattern.count(MethFlags.methylated_motif_flag)
+            if methylated_count == 0:
                 continue
-            # Filter: if retain_methylated is True, skip reads with no methylated CpGs
-            if retain_methylated:
-                methylated_count = meth_pattern.count(MethFlags.methylated_motif_flag)
-                if methylated_count == 0:
-                    continue
+        if epialleles:
+            counter.add_pattern(meth_pattern)
+        else:
             all_meth_patterns.append(meth_pattern)
-            all_meth_levels.append(meth_level)
-            total_read_number += 1
-    return OneSampleMethylationData(
-        file_name=samfile,
-        reads_number=total_read_number,
-        meth_patterns=all_meth_patterns,
-        meth_levels=all_meth_levels,
-    )
+            if read_ids:
+                read_names.append(read_name)
+    if epialleles:
+        meth = counter.to_sample(samfile)
+    else:
+        meth = OneSampleMethylationData.from_patterns(
+            samfile, len(coordinates), all_meth_patterns, read_ids=_read_ids_array(read_names) if read_ids else None
+        )
+    meth.parsed_reads = read_counter.reads
+    meth.sites = site_counter
+    return meth
 
 def _parse_sam_line(line: str) -> tuple:
     """Parse SAM line and extract sequence and alignment position.
 
     Returns tuple of (sequence, sam_position_0based)
     """
+    return _parse_alignment(line)[:2]
+
+def _parse_alignment(line: str) -> tuple:
+    """Parse SAM line and extract sequence, alignment position, reference name (RNAME), CIGAR and read name (QNAME).
+
+    Returns tuple of (sequence, sam_position_0based, reference_name, cigar, read_name)
+    """
     fields = line.strip().split("\t")
     sequence = fields[9]
     sam_position = int(fields[3]) - 1  # SAM uses 1-based, convert to 0-based
-    return sequence, sam_position
+    return sequence, sam_position, fields[2], fields[5], fields[0]
 
-def _get_meth_pattern(coordinates: list, sequence: str, sam_position: int) -> list:
+def _get_meth_pattern(coordinates: list, sequence: str, sam_position: int, offsets: tuple = None) -> list:
     """Analyse methylation pattern of a bisulfite read.
 
+    Only CpG sites inside the read span are looked at, the rest are missing.
+
     Args:
-        coordinates: List of reference CpG positions (0-based)
+        coordinates: Sorted list of reference CpG positions (0-based)
         sequence: Read sequence
         sam_position: Alignment position of read in reference (0-based)
+        offsets: (c_offsets, g_offsets) read offsets of the CpG sites from CigarProjection,
+            for reads with indels or clipping. If None, the read is aligned without gaps.
     """
-    meth_pattern = []
-    for start in coordinates:
-        # Calculate position in read: reference_position - read_alignment_position
-        read_pos = start - sam_position
-
-        # Check if position is within read bounds
-        if 0 <= read_pos < len(sequence) - 1:
-            fragment = sequence[read_pos : read_pos + 2]
+    if offsets is not None:
+        meth_pattern = []
+        read_length = len(sequence)
+        # offsets follow the CIGAR, SEQ may be shorter, e.g. '*' for secondary alignments
+        for c, g in zip(*offsets):
+            fragment = sequence[c] + sequence[g] if 0 <= c < read_length and 0 <= g < read_length else ""
             if fragment == "CG":
                 meth_pattern.append(MethFlags.methylated_motif_flag)
             elif fragment == "TG":
                 meth_pattern.append(MethFlags.unmethylated_motif_flag)
             else:
                 meth_pattern.append(MethFlags.missing_motif_flag)
+        return meth_pattern
+    first, last = _covered_cpg_range(coordinates, sam_position, len(sequence))
+    meth_pattern = [MethFlags.missing_motif_flag] * first
+    for start in coordinates[first:last]:
+        # Calculate position in read: reference_position - read_alignment_position
+        read_pos = start - sam_position
+        fragment = sequence[read_pos : read_pos + 2]
+        if fragment == "CG":
+            meth_pattern.append(MethFlags.methylated_motif_flag)
+        elif fragment == "TG":
+            meth_pattern.append(MethFlags.unmethylated_motif_flag)
         else:
-            # Position outside read bounds
             meth_pattern.append(MethFlags.missing_motif_flag)
+    meth_pattern += [MethFlags.missing_motif_flag] * (len(coordinates) - last)
     return meth_pattern
 
+def _covered_cpg_range(coordinates: list, sam_position: int, read_length: int) -> tuple:
+    """Finds CpG sites lying completely within a read.
+
+    Args:
+        coordinates: Sorted list of reference CpG positions (0-based)
+        sam_position: Alignment position of read in reference (0-based)
+        read_length: Length of the read
+
+    Returns tuple (first, last): coordinates[first:last] are inside [sam_position, sam_position + read_length)
+    """
+    first = bisect_left(coordinates, sam_position)
+    # the G of the last CpG has to be inside the read as well
+    last = bisect_right(coordinates, sam_position + read_length - 2, lo=first)
+    return first, last
+
+def _covers_all_cpgs(coordinates: list, sam_position: int, read_length: int) -> bool:
+    """Checks whether a read spans every CpG site, reads that do not are dropped anyway."""
+    if not coordinates:
+        return True
+    return coordinates[0] >= sam_position and coordinates[-1] <= sam_position + read_length - 2
+
 def _calculate_meth_level(meth_pattern: list):
     """Calculates methylation level of a bisulfite read."""
     if MethFlags.missing_motif_flag in meth_pattern:
         return None
     else:
-        return meth_pattern.count(MethFlags.methylated_motif_flag) / len(meth_pattern)
\ No newline at end of file
+        return meth_pattern.count(MethFlags.methylated_motif_flag) / len(meth_pattern)
+
+def stream_meth(coordinates: list, samfile: str, retain_methylated: bool = False, chunk_size: int = BATCH_SIZE, counter: ReadCounter = None, sites: SiteCounter = None) -> Iterator[tuple]:
+    """Extracts methylation of reads in a sam file chunk by chunk, without keeping earlier chunks.
+
+    Args:
+        coordinates: List of CpG site coordinates from reference sequence
+        samfile: Path to SAM file to process
+        retain_methylated: If True, only keep reads with at least one methylated CpG site
+        chunk_size: Number of reads called at once
+        counter: ReadCounter counting the alignments read, retained or not
+        sites: SiteCounter counting the calls of all called reads per CpG site, retained or not
+
+    Yields
+    ------
+    Tuple (matrix, levels) of the retained reads of a chunk:
+        matrix: int8 array reads x CpGs, see _call_meth_batch
+        levels: float array with methylation levels
+    """
+    chunks = _call_sam(coordinates, samfile, retain_methylated, chunk_size, counter=counter, sites=sites)
+    return ((matrix, levels) for matrix, levels, _, _ in chunks)
+
+def _count_reads(reads: Iterator[tuple], counter: ReadCounter = None) -> Iterator[tuple]:
+    return reads if counter is None else counter.wrap(reads)
+
+def stream_reads(coordinates: list, samfile: str, retain_methylated: bool = False, chunk_size: int = BATCH_SIZE, counter: ReadCounter = None, sites: SiteCounter = None) -> Iterator[tuple]:
+    """Same as stream_meth, but also yields the names and alignment positions of the retained reads.
+
+    Yields
+    ------
+    Tuple (matrix, levels, read_ids, positions):
+        read_ids: bytes array with read names (QNAME)
+        positions: int array with 0-based alignment positions
+    """
+    return _call_sam(coordinates, samfile, retain_methylated, chunk_size, read_ids=True, counter=counter, sites=sites)
+
+def _call_sam(coordinates: list, samfile: str, retain_methylated: bool, chunk_size: int, read_ids: bool = False, counter: ReadCounter = None, sites: SiteCounter = None) -> Iterator[tuple]:
+    """Calls the reads of a sam, sam.gz or bam file in chunks, see _call_reads.
+
+    Plain sam files are memory-mapped and called from byte offsets, see _call_sam_blocks.
+    """
+    if _is_compressed(samfile):
+        return _call_reads(coordinates, _count_reads(_iter_sam_reads(samfile), counter), retain_methylated, chunk_size, read_ids, sites)
+    return _call_sam_blocks(coordinates, iter_sam_blocks(samfile), retain_methylated, chunk_size, read_ids, counter, sites)
+
+def _call_sam_blocks(coordinates: list, blocks: Iterator, retain_methylated: bool, chunk_size: int, read_ids: bool = False, counter: ReadCounter = None, sites: SiteCounter = None) -> Iterator[tuple]:
+    """Same as _call_reads for the SamBlocks of a memory-mapped sam file, with the same chunks.
+
+    Reads are selected and called from their offsets into the map without a string per read,
+    only CIGARs other than '*' and '<read length>M' are decoded to project the CpG sites.
+    """
+    batch = _OffsetBatch(coordinates, chunk_size, sites)
+    for block in blocks:
+        if counter is not None:
+            counter.reads += len(block)
+        yield from batch.add(block, np.arange(len(block)), block.ungapped(), retain_methylated, read_ids)
+    yield from batch.flush(retain_methylated, read_ids)
+
+class _OffsetBatch:
+    """Reads of SamBlocks waiting to be called, as offsets into the mapped file, cut into chunks of chunk_size reads.
+
+    With a SiteCounter, the calls of all reads are counted before reads are selected.
+    """
+    def __init__(self, coordinates: list, chunk_size: int, sites: SiteCounter = None):
+        self.coordinates = np.asarray(coordinates, dtype=np.int64)
+        self.projection = CigarProjection(self.coordinates)
+        self.chunk_size = chunk_size
+        self.sites = sites
+        self.buffer = None
+        # (seq_start, lengths, positions, qname_start, qname_end) arrays of every added block
+        self.pending = []
+        self.pending_reads = 0
+        self.projected = {}
+
+    def add(self, block, rows: np.ndarray, ungapped: np.ndarray, retain_methylated: bool, read_ids: bool) -> Iterator[tuple]:
+        """Adds the rows of a block and yields (matrix, levels, read_ids, positions) of every full chunk.
+
+        ungapped is the mask of SamBlock.ungapped of the whole block.
+        """
+        coordinates = self.coordinates
+        lengths = block.lengths[rows]
+        positions = block.positions[rows]
+        ungapped = ungapped[rows]
+        # same as _covers_all_cpgs, ungapped reads not spanning every CpG site are dropped before calling
+        if len(coordinates):
+            ungapped_kept = (coordinates[0] >= positions) & (coordinates[-1] <= positions + lengths - 2)
+            selected = np.flatnonzero(~ungapped | ungapped_kept)
+            if self.sites is not None and len(selected) < len(rows):
+                # dropped reads are only counted, they never enter a chunk
+                partial = np.flatnonzero(ungapped & ~ungapped_kept)
+                matrix, _ = _call_meth_buffer(coordinates, block.buffer, block.seq_start[rows[partial]], lengths[partial], positions[partial])
+                self.sites.add_matrix(matrix)
+        else:
+            selected = np.arange(len(rows))
+        for row in np.flatnonzero(~ungapped[selected]).tolist():
+            read = rows[selected[row]]
+            cigar = block.text(block.cigar_start[read], block.cigar_end[read])
+            self.projected[self.pending_reads + row] = self.projection.offsets(cigar, int(block.positions[read]))
+        rows = rows[selected]
+        self.buffer = block.buffer
+        self.pending.append((block.seq_start[rows], lengths[selected], positions[selected], block.qname_start[rows], block.qname_end[rows]))
+        self.pending_reads += len(rows)
+        while self.pending_reads >= self.chunk_size:
+            columns = [np.concatenate(column) for column in zip(*self.pending)]
+            chunk = [column[:self.chunk_size] for column in columns]
+            self.pending = [tuple(column[self.chunk_size:] for column in columns)]
+            self.pending_reads -= self.chunk_size
+            projected = {row: offsets for row, offsets in self.projected.items() if row < self.chunk_size}
+            self.projected = {row - self.chunk_size: offsets for row, offsets in self.projected.items() if row >= self.chunk_size}
+            yield self._call(chunk, projected, retain_methylated, read_ids)
+
+    def flush(self, retain_methylated: bool, read_ids: bool) -> Iterator[tuple]:
+        """Yields the chunk of the remaining reads."""
+        if self.pending_reads:
+            columns = [np.concatenate(column) for column in zip(*self.pending)]
+            yield self._call(columns, self.projected, retain_methylated, read_ids)
+        self.pending = []
+        self.pending_reads = 0
+        self.projected = {}
+
+    def _call(self, columns: list, projected: dict, retain_methylated: bool, read_ids: bool) -> tuple:
+        seq_start, lengths, positions, qname_start, qname_end = columns
+        matrix, levels = _call_meth_buffer(self.coordinates, self.buffer, seq_start, lengths, positions, projected)
+        if self.sites is not None:
+            self.sites.add_matrix(matrix)
+        keep = _select_reads(matrix, levels, retain_methylated)
+        if not read_ids:
+            return matrix[keep], levels[keep], None, None
+        return matrix[keep], levels[keep], gather_strings(self.buffer, qname_start[keep], qname_end[keep]), positions[keep]
+
+def _call_reads(coordinates: list, reads: Iterator[tuple], retain_methylated: bool, chunk_size: int, read_ids: bool = False, sites: SiteCounter = None) -> Iterator[tuple]:
+    """Calls (sequence, sam_position, reference_name, cigar, read_name) reads in chunks.
+
+    Yields (matrix, levels, read_ids, positions) of the retained ones, see _call_and_select.
+    With a SiteCounter, the calls of all reads are counted, also of reads dropped for partial coverage.
+    """
+    coords = np.asarray(coordinates, dtype=np.int64)
+    projection = CigarProjection(coords)
+    partial = _PartialReads(coords, sites, chunk_size)
+    sequences = []
+    positions = []
+    projected = {}
+    names = [] if read_ids else None
+    for sequence, sam_position, _, cigar, read_name in reads:
+        read_length = len(sequence)
+        # same as is_ungapped, written out as this loop runs for every read
+        if cigar == "*" or cigar == f"{read_length}M":
+            if not _covers_all_cpgs(coordinates, sam_position, read_length):
+                partial.add(sequence, sam_position)
+                continue
+        else:
+            projected[len(sequences)] = projection.offsets(cigar, sam_position)
+        sequences.append(sequence)
+        positions.append(sam_position)
+        if read_ids:
+            names.append(read_name)
+        if len(sequences) >= chunk_size:
+            yield _call_and_select(coords, sequences, positions, retain_methylated, projected, names, sites)
+            sequences = []
+            positions = []
+            projected = {}
+            names = [] if read_ids else None
+    if sequences:
+        yield _call_and_select(coords, sequences, positions, retain_methylated, projected, names, sites)
+    partial.flush()
+
+class _PartialReads:
+    """Ungapped reads not spanning every CpG site, called in chunks only to be counted in a SiteCounter.
+
+    Does nothing without a SiteCounter.
+    """
+    def __init__(self, coordinates: np.ndarray, sites: SiteCounter, chunk_size: int):
+        self.coordinates = coordinates
+        self.sites = sites
+        self.chunk_size = chunk_size
+        self.sequences = []
+        self.positions = []
+
+    def add(self, sequence: str, sam_position: int) -> None:
+        if self.sites is None:
+            return
+        self.sequences.append(sequence)
+        self.positions.append(sam_position)
+        if len(self.sequences) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.sequences:
+            matrix, _ = _call_meth_batch(self.coordinates, self.sequences, self.positions)
+            self.sites.add_matrix(matrix)
+        self.sequences = []
+        self.positions = []
+
+def stream_meth_by_contig(contig_coordinates: dict, samfile: str, retain_methylated: bool = False, chunk_size: int = BATCH_SIZE, counter: ReadCounter = None, sites: dict = None) -> Iterator[tuple]:
+    """Same as stream_meth for a reference with several contigs, reads are routed to their contig by RNAME.
+
+    Reads of contigs not in contig_coordinates or without CpG sites are skipped.
+    counter counts the alignments read, also per contig. A SiteCounter per contig with reads
+    is added to the sites dict, if given.
+
+    Yields
+    ------
+    Tuple (contig, matrix, levels), see stream_meth
+    """
+    chunks = _call_reads_by_contig(contig_coordinates, samfile, retain_methylated, chunk_size, counter=counter, sites=sites)
+    return ((contig, matrix, levels) for contig, matrix, levels, _, _ in chunks)
+
+def stream_reads_by_contig(contig_coordinates: dict, samfile: str, retain_methylated: bool = False, chunk_size: int = BATCH_SIZE, counter: ReadCounter = None, sites: dict = None) -> Iterator[tuple]:
+    """Same as stream_reads for a reference with several contigs.
+
+    Yields
+    ------
+    Tuple (contig, matrix, levels, read_ids, positions), see stream_reads
+    """
+    return _call_reads_by_contig(contig_coordinates, samfile, retain_methylated, chunk_size, read_ids=True, counter=counter, sites=sites)
+
+def _call_reads_by_contig(contig_coordinates: dict, samfile: str, retain_methylated: bool, chunk_size: int, read_ids: bool = False, counter: ReadCounter = None, sites: dict = None) -> Iterator[tuple]:
+    """Routes the reads of a sam file to their contigs and calls them in chunks per contig.
+
+    Yields (contig, matrix, levels, read_ids, positions) of the retained reads, see _call_and_select.
+    sites is a dict of contig: SiteCounter, filled for every contig with reads.
+    """
+    if not _is_compressed(samfile):
+        yield from _call_sam_blocks_by_contig(contig_coordinates, iter_sam_blocks(samfile), retain_methylated, chunk_size, read_ids, counter, sites)
+        return
+    coords = {contig: np.asarray(c, dtype=np.int64) for contig, c in contig_coordinates.items()}
+    projections = {contig: CigarProjection(c) for contig, c in coords.items()}
+    batches = {}
+    partials = {}
+    for sequence, sam_position, contig, cigar, read_name in _count_reads(_iter_sam_reads(samfile), counter):
+        if counter is not None:
+            counter.contigs[contig] = counter.contigs.get(contig, 0) + 1
+        coordinates = contig_coordinates.get(contig)
+        if not coordinates:
+            continue
+        sequences, positions, projected, names = batches.setdefault(contig, ([], [], {}, [] if read_ids else None))
+        site_counter = _contig_sites(sites, contig, coordinates)
+        if is_ungapped(cigar, len(sequence)):
+            if not _covers_all_cpgs(coordinates, sam_position, len(sequence)):
+                if contig not in partials:
+                    partials[contig] = _PartialReads(coords[contig], site_counter, chunk_size)
+                partials[contig].add(sequence, sam_position)
+                continue
+        else:
+            projected[len(sequences)] = projections[contig].offsets(cigar, sam_position)
+        sequences.append(sequence)
+        positions.append(sam_position)
+        if read_ids:
+            names.append(read_name)
+        if len(sequences) >= chunk_size:
+            del batches[contig]
+            yield (contig, *_call_and_select(coords[contig], sequences, positions, retain_methylated, projected, names, site_counter))
+    for contig, (sequences, positions, projected, names) in batches.items():
+        if sequences:
+            yield (contig, *_call_and_select(coords[contig], sequences, positions, retain_methylated, projected, names, _contig_sites(sites, contig)))
+    for partial in partials.values():
+        partial.flush()
+
+def _contig_sites(sites: dict, contig: str, coordinates: list = None) -> SiteCounter:
+    """SiteCounter of a contig in sites, added with coordinates on first use; None without sites."""
+    if sites is None:
+        return None
+    if contig not in sites:
+        sites[contig] = SiteCounter(len(coordinates))
+    return sites[contig]
+
+def _call_sam_blocks_by_contig(contig_coordinates: dict, blocks: Iterator, retain_methylated: bool, chunk_size: int, read_ids: bool = False, counter: ReadCounter = None, sites: dict = None) -> Iterator[tuple]:
+    """Same as _call_reads_by_contig for the SamBlocks of a memory-mapped sam file, reads are grouped by RNAME block by block."""
+    batches = {}
+    for block in blocks:
+        rnames, first, inverse, counts = np.unique(
+            gather_strings(block.buffer, block.rname_start, block.rname_end), return_index=True, return_inverse=True, return_counts=True
+        )
+        if counter is not None:
+            counter.reads += len(block)
+        order = np.argsort(first, kind="stable")
+        ungapped = block.ungapped()
+        rows_by_rname = np.split(np.argsort(inverse, kind="stable"), np.cumsum(counts)[:-1])
+        # contigs are added in the order they first appear, as reads are routed one by one by _call_reads_by_contig
+        for index in order.tolist():
+            contig = rnames[index].decode("ascii")
+            if counter is not None:
+                counter.contigs[contig] = counter.contigs.get(contig, 0) + int(counts[index])
+            coordinates = contig_coordinates.get(contig)
+            if not coordinates:
+                continue
+            if contig not in batches:
+                batches[contig] = _OffsetBatch(coordinates, chunk_size, _contig_sites(sites, contig, coordinates))
+            for chunk in batches[contig].add(block, rows_by_rname[index], ungapped, retain_methylated, read_ids):
+                yield (contig, *chunk)
+    for contig, batch in batches.items():
+        for chunk in batch.flush(retain_methylated, read_ids):
+            yield (contig, *chunk)
+
+def _get_meth_sam_by_contig(contig_coordinates: dict, samfile: str, retain_methylated: bool = False, epialleles: bool = False, read_ids: bool = False, sites: bool = False) -> list:
+    """Extracts a sam file aligned to several contigs, returns a list with one sample per contig with reads.
+
+    With sites, contigs whose reads were all dropped get an empty sample carrying their site counts.
+    """
+    collected = {}
+    counter = ReadCounter()
+    site_counters = {} if sites else None
+    chunks = _call_reads_by_contig(contig_coordinates, samfile, retain_methylated, BATCH_SIZE, read_ids and not epialleles, counter, site_counters)
+    for contig, matrix, _, names, _ in chunks:
+        if epialleles:
+            collected.setdefault(contig, EpialleleCounter(matrix.shape[1])).add_matrix(matrix)
+        else:
+            # pack every chunk right away, chunks of all contigs are held until the end of the file
+            chunk = OneSampleMethylationData.from_matrices(samfile, matrix.shape[1], [matrix], read_ids=names)
+            collected.setdefault(contig, []).append(chunk)
+    samples = []
+    for contig in contig_coordinates:
+        if contig not in collected:
+            if not sites or contig not in site_counters:
+                continue
+            # every read of the contig was dropped, the sample only carries its site counts
+            sites_number = len(site_counters[contig].methylated)
+            if epialleles:
+                collected[contig] = EpialleleCounter(sites_number)
+            else:
+                collected[contig] = [OneSampleMethylationData.from_matrices(samfile, sites_number, [], read_ids=_read_ids_array([]))]
+        if epialleles:
+            meth = collected[contig].to_sample(samfile)
+        else:
+            chunks = collected[contig]
+            meth = OneSampleMethylationData(
+                samfile,
+                chunks[0].sites_number,
+                np.concatenate([c.covered for c in chunks]),
+                np.concatenate([c.methylated for c in chunks]),
+                read_ids=np.concatenate([c.read_ids for c in chunks]) if read_ids else None,
+            )
+        meth.contig = contig
+        meth.parsed_reads = counter.contigs[contig]
+        meth.sites = site_counters[contig] if sites else None
+        samples.append(meth)
+    return samples
+
+def _get_meth_sam_numpy(coordinates: list, samfile: str, retain_methylated: bool = False, epialleles: bool = False, batch_size: int = BATCH_SIZE, read_ids: bool = False, sites: bool = False) -> OneSampleMethylationData:
+    """Same as _get_meth_sam, but calls methylation for blocks of reads with numpy.
+    """
+    read_ids = read_ids and not epialleles
+    counter = ReadCounter()
+    site_counter = SiteCounter(len(coordinates)) if sites else None
+    chunks = _call_sam(coordinates, samfile, retain_methylated, batch_size, read_ids, counter, site_counter)
+    meth = _collect_matrices(samfile, len(coordinates), ((matrix, names) for matrix, _, names, _ in chunks), epialleles, read_ids)
+    meth.parsed_reads = counter.reads
+    meth.sites = site_counter
+    return meth
+
+def _collect_matrices(samfile: str, sites_number: int, chunks: Iterator[tuple], epialleles: bool, read_ids: bool = False) -> OneSampleMethylationData:
+    """Packs (call matrix, read names) chunks of retained reads, or counts their epialleles, into one sample."""
+    if epialleles:
+        counter = EpialleleCounter(sites_number)
+        for matrix, _ in chunks:
+            counter.add_matrix(matrix)
+        return counter.to_sample(samfile)
+    names = []
+
+    def matrices():
+        # names are collected while the matrices are packed one by one
+        for matrix, chunk_names in chunks:
+            names.append(chunk_names)
+            yield matrix
+
+    meth = OneSampleMethylationData.from_matrices(samfile, sites_number, matrices())
+    if read_ids:
+        meth.read_ids = np.concatenate(names) if names else _read_ids_array([])
+    return meth
+
+def _read_ids_array(read_names: list) -> np.ndarray:
+    """Read names as a fixed width bytes array, which can be saved without pickling."""
+    return np.array(read_names, dtype="S") if read_names else np.empty(0, dtype="S1")
+
+def _get_meth_sam_chunked(coordinates: list, samfile: str, retain_methylated: bool = False, epialleles: bool = False, jobs: int = 2, read_ids: bool = False, sites: bool = False) -> OneSampleMethylationData:
+    """Extracts one sam file with several processes, every process calls its own byte range of the file.
+
+    Reads are called with the numpy engine. Every worker writes the call matrix of its range
+    to a memory-mapped .npy file; ranges are merged in file order, so the reads keep their order.
+    """
+    ranges = _split_sam(samfile, jobs)
+    if len(ranges) < 2:
+        # nothing to split, e.g. a file with only a header
+        return _get_meth_sam_numpy(coordinates, samfile, retain_methylated, epialleles, read_ids=read_ids, sites=sites)
+    read_ids = read_ids and not epialleles
+    with tempfile.TemporaryDirectory(prefix="allelicMeth_") as tmpdir:
+        outputs = [os.path.join(tmpdir, f"range{i}.npy") for i in range(len(ranges))]
+        with ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_worker, initargs=(coordinates,)) as executor:
+            futures = [
+                executor.submit(_extract_byte_range, samfile, start, end, retain_methylated, output, read_ids, sites)
+                for (start, end), output in zip(ranges, outputs)
+            ]
+            parsed_reads = 0
+            site_counter = SiteCounter(len(coordinates)) if sites else None
+            for future in futures:
+                range_reads, range_sites = future.result()
+                parsed_reads += range_reads
+                if sites:
+                    site_counter.merge(range_sites)
+        chunks = (
+            (np.load(output, mmap_mode="r"), np.load(output + ".names.npy") if read_ids else None)
+            for output in outputs
+        )
+        meth = _collect_matrices(samfile, len(coordinates), chunks, epialleles, read_ids)
+        meth.parsed_reads = parsed_reads
+        meth.sites = site_counter
+        return meth
+
+def _split_sam(samfile: str, parts: int) -> list:
+    """Splits the alignment section of a sam file (after the @ header) into byte ranges of whole lines.
+
+    Returns list of (start, end) byte offsets.
+    """
+    size = os.path.getsize(samfile)
+    with open(samfile, "rb") as fh:
+        body_start = 0
+        line = fh.readline()
+        while line.startswith(b"@"):
+            body_start += len(line)
+            line = fh.readline()
+        boundaries = [body_start]
+        for i in range(1, parts):
+            offset = body_start + (size - body_start) * i // parts
+            # move to the start of the next line; offset - 1 keeps a line starting exactly at offset
+            fh.seek(max(offset - 1, body_start))
+            fh.readline()
+            if fh.tell() > boundaries[-1]:
+                boundaries.append(fh.tell())
+    if boundaries[-1] < size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _extract_byte_range(samfile: str, start: int, end: int, retain_methylated: bool, output: str, read_ids: bool = False, sites: bool = False) -> tuple:
+    """Worker: calls the reads of a byte range and saves the call matrix of the retained ones to output.
+
+    With read_ids, their names are saved to output + ".names.npy". Returns tuple of
+    (number of alignments read, SiteCounter of the range if sites is True, None otherwise).
+    """
+    counter = ReadCounter()
+    site_counter = SiteCounter(len(_worker_coordinates)) if sites else None
+    blocks = iter_sam_blocks(samfile, start, end)
+    chunks = list(_call_sam_blocks(_worker_coordinates, blocks, retain_methylated, BATCH_SIZE, read_ids, counter, site_counter))
+    if chunks:
+        matrix = np.concatenate([matrix for matrix, _, _, _ in chunks])
+    else:
+        matrix = np.empty((0, len(_worker_coordinates)), dtype=np.int8)
+    np.save(output, matrix)
+    if read_ids:
+        names = [names for _, _, names, _ in chunks]
+        np.save(output + ".names.npy", np.concatenate(names) if names else _read_ids_array([]))
+    return counter.reads, site_counter
+
+def _iter_sam_reads(samfile: str) -> Iterator[tuple]:
+    """Yields (sequence, sam_position_0based, reference_name, cigar, read_name) of every alignment in a sam, sam.gz or bam file."""
+    if samfile.endswith(".bam"):
+        for sequence, sam_position, _, cigar, reference_name, read_name in iter_bam_records(samfile):
+            yield sequence, sam_position, reference_name, cigar, read_name
+        return
+    with _open_sam(samfile) as fh:
+        for i in fh:
+            if i.startswith("@"):
+                continue
+            yield _parse_alignment(i)
+
+def _is_compressed(samfile: str) -> bool:
+    return samfile.endswith(".bam") or samfile.endswith(".gz")
+
+def _open_sam(samfile: str):
+    """Opens a plain or gzip compressed sam file for reading text."""
+    if samfile.endswith(".gz"):
+        return gzip.open(samfile, "rt")
+    return open(samfile, "r")
+
+def _call_and_select(coordinates: np.ndarray, sequences: list, sam_positions: list, retain_methylated: bool, projected: dict = None, read_names: list = None, sites: SiteCounter = None) -> tuple:
+    """Calls a block of reads and returns (matrix, levels, read_ids, positions) of the reads kept.
+
+    read_ids and the 0-based alignment positions are None without read_names.
+    The calls of all reads, kept or not, are counted in sites if given.
+    """
+    matrix, levels = _call_meth_batch(coordinates, sequences, sam_positions, projected)
+    if sites is not None:
+        sites.add_matrix(matrix)
+    keep = _select_reads(matrix, levels, retain_methylated)
+    if read_names is None:
+        return matrix[keep], levels[keep], None, None
+    return matrix[keep], levels[keep], _read_ids_array(read_names)[keep], np.asarray(sam_positions, dtype=np.int64)[keep]
+
+def _encode_reads(sequences: list) -> tuple:
+    """Concatenates read sequences into one uint8 buffer.
+
+    Returns tuple of (buffer, starts, read_lengths): read i is buffer[starts[i]:starts[i] + read_lengths[i]]
+    """
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    starts = np.zeros(len(sequences), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    buffer = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8)
+    return buffer, starts, lengths
+
+def _call_meth_batch(coordinates: np.ndarray, sequences: list, sam_positions: list, projected: dict = None) -> tuple:
+    """Calls methylation of all CpG sites in a block of reads at once.
+
+    Args:
+        coordinates: Array of reference CpG positions (0-based)
+        sequences: Read sequences
+        sam_positions: Alignment positions of reads in reference (0-based)
+        projected: Dict of row: (c_offsets, g_offsets) from CigarProjection for reads with indels or clipping,
+            the other reads are aligned without gaps
+
+    Returns tuple of (matrix, levels):
+        matrix: int8 array reads x CpGs with METHYLATED_CALL/UNMETHYLATED_CALL/MISSING_CALL
+        levels: float array, methylation level of fully covered reads, NaN otherwise
+    """
+    buffer, starts, lengths = _encode_reads(sequences)
+    return _call_meth_buffer(coordinates, buffer, starts, lengths, sam_positions, projected)
+
+def _call_meth_buffer(coordinates: np.ndarray, buffer: np.ndarray, starts: np.ndarray, lengths: np.ndarray, sam_positions, projected: dict = None) -> tuple:
+    """Same as _call_meth_batch for reads given as offsets into a uint8 buffer, read i is buffer[starts[i]:starts[i] + lengths[i]]."""
+    c_pos = coordinates[None, :] - np.asarray(sam_positions, dtype=np.int64)[:, None]
+    g_pos = c_pos + 1
+    for row, (c_offsets, g_offsets) in (projected or {}).items():
+        c_pos[row] = c_offsets
+        g_pos[row] = g_offsets
+    in_read = (c_pos >= 0) & (g_pos >= 0) & (g_pos < lengths[:, None]) & (c_pos < lengths[:, None])
+    # sites outside the read look at the first byte of the buffer, their calls are masked
+    first = buffer[np.where(in_read, starts[:, None] + c_pos, 0)] if len(buffer) else np.zeros(c_pos.shape, dtype=np.uint8)
+    second = buffer[np.where(in_read, starts[:, None] + g_pos, 0)] if len(buffer) else np.zeros(c_pos.shape, dtype=np.uint8)
+    is_cpg = in_read & (second == ord("G"))
+
+    matrix = np.full(c_pos.shape, MISSING_CALL, dtype=np.int8)
+    matrix[is_cpg & (first == ord("C"))] = METHYLATED_CALL
+    matrix[is_cpg & (first == ord("T"))] = UNMETHYLATED_CALL
+
+    covered = (matrix != MISSING_CALL).all(axis=1)
+    methylated = (matrix == METHYLATED_CALL).sum(axis=1)
+    levels = np.full(len(lengths), np.nan)
+    levels[covered] = methylated[covered] / matrix.shape[1]
+    return matrix, levels
+
+def _select_reads(matrix: np.ndarray, levels: np.ndarray, retain_methylated: bool = False) -> np.ndarray:
+    """Boolean mask of reads kept by _get_meth_sam: fully covered with a non-zero level.
+    """
+    keep = ~np.isnan(levels) & (levels != 0)
+    if retain_methylated:
+        keep &= (matrix == METHYLATED_CALL).any(axis=1)
+    return keep
+
+
+_ENGINES = {
+    "python": _get_meth_sam,
+    "numpy": _get_meth_sam_numpy,
+}
@@ -0,0 +1,168 @@
+import mmap
+import os
+from typing import Iterator
+
+import numpy as np
+
+# Bytes of a sam file scanned at once, a block ends at the end of its last line
+SAM_BLOCK_SIZE = 1 << 21
+
+_TAB = ord("\t")
+_NEWLINE = ord("\n")
+_RETURN = ord("\r")
+_ZERO = ord("0")
+# Tabs ending the columns QNAME ... TLEN, SEQ is the 10th column
+_SEQ_COLUMN = 9
+# Longest decimal integer parsed, more digits could overflow int64
+_MAX_DIGITS = 18
+
+
+class SamBlock:
+    """Alignments of a block of sam lines as byte offsets into the mapped file.
+
+    buffer is a uint8 view of the whole file. The other attributes are int64 arrays with one
+    value per alignment: start and end offsets of QNAME, RNAME, CIGAR and SEQ in buffer, and
+    the 0-based alignment position. Nothing is decoded or copied until it is used.
+    """
+    __slots__ = ("buffer", "qname_start", "qname_end", "rname_start", "rname_end", "positions", "cigar_start", "cigar_end", "seq_start", "seq_end")
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.seq_end - self.seq_start
+
+    def text(self, start: int, end: int) -> str:
+        """Decodes the bytes between two offsets, e.g. the CIGAR of one alignment."""
+        return self.buffer[start:end].tobytes().decode("ascii")
+
+    def ungapped(self) -> np.ndarray:
+        """Mask of alignments whose read offsets are reference offsets, same as utils.cigar.is_ungapped:
+        CIGAR '*' or one match over the whole read."""
+        width = self.cigar_end - self.cigar_start
+        last = self.buffer[np.maximum(self.cigar_end - 1, 0)]
+        star = (width == 1) & (last == ord("*"))
+        matches, valid = _parse_integers(self.buffer, self.cigar_start, self.cigar_end - 1)
+        return star | ((last == ord("M")) & valid & (matches == self.lengths))
+
+
+def iter_sam_blocks(samfile: str, start: int = None, end: int = None, block_size: int = SAM_BLOCK_SIZE) -> Iterator[SamBlock]:
+    """Memory-maps a plain sam file and yields its alignments block by block.
+
+    Newlines and tabs of a block are found with numpy at once and only the columns needed
+    for calling are located, lines are never split into strings. start and end are line
+    aligned byte offsets of a part of the alignment section, the whole file (after the @
+    header) by default.
+    """
+    size = os.path.getsize(samfile)
+    if size == 0:
+        return
+    with open(samfile, "rb") as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        buffer = np.frombuffer(mapped, dtype=np.uint8)
+        position = _body_start(mapped) if start is None else start
+        end = size if end is None else end
+        while position < end:
+            block_end = min(position + block_size, end)
+            if block_end < end:
+                newline = mapped.rfind(b"\n", position, block_end)
+                if newline < 0:
+                    # a line longer than the block
+                    newline = mapped.find(b"\n", block_end, end)
+                block_end = end if newline < 0 else newline + 1
+            block = _parse_block(buffer, position, block_end)
+            if len(block):
+                yield block
+            position = block_end
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # blocks are still referenced, the map is released with the last of them
+            pass
+
+
+def _body_start(mapped: mmap.mmap) -> int:
+    """Offset of the first alignment line, after the @ header lines."""
+    position = 0
+    while mapped[position:position + 1] == b"@":
+        newline = mapped.find(b"\n", position)
+        if newline < 0:
+            return len(mapped)
+        position = newline + 1
+    return position
+
+
+def _parse_block(buffer: np.ndarray, start: int, end: int) -> SamBlock:
+    data = buffer[start:end]
+    line_ends = np.flatnonzero(data == _NEWLINE)
+    if not len(line_ends) or line_ends[-1] != len(data) - 1:
+        # the last line of the file may end without a newline
+        line_ends = np.append(line_ends, len(data))
+    line_starts = np.empty_like(line_ends)
+    line_starts[0] = 0
+    line_starts[1:] = line_ends[:-1] + 1
+    # empty lines, e.g. trailing newlines, hold no alignment
+    nonempty = line_ends > line_starts
+    line_starts = line_starts[nonempty]
+    line_ends = line_ends[nonempty]
+
+    tabs = np.flatnonzero(data == _TAB)
+    columns = np.searchsorted(tabs, line_starts)[:, None] + np.arange(_SEQ_COLUMN + 1)
+    column_ends = tabs[np.minimum(columns, max(len(tabs) - 1, 0))] if len(tabs) else np.zeros(columns.shape, dtype=np.int64)
+    has_column = (columns < len(tabs)) & (column_ends < line_ends[:, None])
+    malformed = ~has_column[:, _SEQ_COLUMN - 1]
+    if malformed.any():
+        line = int(line_starts[np.argmax(malformed)]) + start
+        raise ValueError(f"Alignment line at byte {line} has fewer than 10 columns")
+    # SEQ ends at the next tab, or at the end of the line without QUAL and tags
+    seq_end = np.where(has_column[:, _SEQ_COLUMN], column_ends[:, _SEQ_COLUMN], line_ends)
+    seq_end -= (seq_end == line_ends) & (data[np.maximum(seq_end - 1, 0)] == _RETURN)
+
+    block = SamBlock()
+    block.buffer = buffer
+    block.qname_start = line_starts + start
+    block.qname_end = column_ends[:, 0] + start
+    block.rname_start = column_ends[:, 1] + 1 + start
+    block.rname_end = column_ends[:, 2] + start
+    positions, valid = _parse_integers(buffer, column_ends[:, 2] + 1 + start, column_ends[:, 3] + start)
+    if not valid.all():
+        line = int(line_starts[np.argmax(~valid)]) + start
+        raise ValueError(f"Alignment line at byte {line} has an invalid POS")
+    # SAM uses 1-based, convert to 0-based
+    block.positions = positions - 1
+    block.cigar_start = column_ends[:, 4] + 1 + start
+    block.cigar_end = column_ends[:, 5] + start
+    block.seq_start = column_ends[:, 8] + 1 + start
+    block.seq_end = seq_end + start
+    return block
+
+
+def _parse_integers(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> tuple:
+    """Parses the decimal numbers between pairs of offsets at once, digit column by digit column.
+
+    Returns tuple of (values, valid): valid is False where the bytes are empty, too long or not digits.
+    """
+    widths = ends - starts
+    values = np.zeros(len(widths), dtype=np.int64)
+    valid = (widths > 0) & (widths <= _MAX_DIGITS)
+    for column in range(min(int(widths.max(initial=0)), _MAX_DIGITS)):
+        inside = column < widths
+        digits = buffer[np.where(inside, starts + column, 0)].astype(np.int64) - _ZERO
+        valid &= ~inside | ((digits >= 0) & (digits <= 9))
+        values = np.where(inside, values * 10 + digits, values)
+    return values, valid
+
+
+def gather_strings(buffer: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Copies the bytes between pairs of offsets into a fixed width bytes array, e.g. the read names of selected alignments."""
+    widths = ends - starts
+    width = max(int(widths.max(initial=0)), 1)
+    columns = np.arange(width)
+    inside = columns < widths[:, None]
+    chars = np.where(inside, buffer[np.where(inside, starts[:, None] + columns, 0)], 0).astype(np.uint8)
+    return np.ascontiguousarray(chars).view(f"S{width}").ravel()
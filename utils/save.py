@@ -1,6 +1,24 @@
-from typing import Protocol
+import gzip
+import io
+import json
+import os
+from typing import Optional, Protocol
 
-from utils.meth_data import MethylationData
+import numpy as np
+
+from utils.meth_data import METHYLATED_CALL, MISSING_CALL, UNMETHYLATED_CALL, MethFlags, MethylationData, sample_name
+
+# Size of the write buffer of streaming writers, in bytes
+WRITE_BUFFER_SIZE = 1 << 20
+# Number of reads formatted at once by writers of stored samples
+WRITE_BLOCK_ROWS = 65536
+# gzip level of compressed outputs, fast as files are compressed while reads are called
+GZIP_LEVEL = 1
+
+# Characters of pattern strings, indexed by call - MISSING_CALL
+_PATTERN_CHARS = np.zeros(METHYLATED_CALL - MISSING_CALL + 1, dtype=np.uint8)
+for _call, _char in ((METHYLATED_CALL, "1"), (UNMETHYLATED_CALL, "0"), (MISSING_CALL, MethFlags.missing_motif_flag)):
+    _PATTERN_CHARS[_call - MISSING_CALL] = ord(_char)
 
 
 class DataWriter(Protocol):
@@ -18,9 +36,209 @@ class WriteMethlation2CSV:
 
     def save(self, data: MethylationData) -> None:
         for d in data.data:
-            save_name = d.file_name.strip(".sam") + self.output_suffix + ".csv"
+            levels = d.levels
+            weights = d.weights
+            with StreamingCSVWriter(d.name, self.output_suffix) as csv_writer:
+                # written block by block, epialleles once per read
+                for start in range(0, len(levels), WRITE_BLOCK_ROWS):
+                    block = slice(start, start + WRITE_BLOCK_ROWS)
+                    csv_writer.write(np.repeat(levels[block], weights[block]))
+
+
+class WriteEpialleles2CSV:
+    """Saves distinct methylation patterns of every sample with their read counts to csv file.
+    """
+    def __init__(self, output_suffix: str = ""):
+        self.output_suffix = output_suffix
+
+    def save(self, data: MethylationData) -> None:
+        flags = {METHYLATED_CALL: "1", UNMETHYLATED_CALL: "0", MISSING_CALL: MethFlags.missing_motif_flag}
+        for d in data.data:
+            save_name = d.name + self.output_suffix + "_epialleles.csv"
+            rows = ["pattern,reads,meth_level"]
+            for pattern, reads, level in zip(d.matrix().tolist(), d.weights.tolist(), d.levels.tolist()):
+                rows.append(f"{''.join([flags[i] for i in pattern])},{reads},{level}")
             with open(save_name, "w") as fh:
-                fh.write("\n".join([str(i) for i in d.meth_levels]))
+                fh.write("\n".join(rows))
+
+
+class WriteSites2CSV:
+    """Saves the per CpG site counts of every sample to csv file, <name><suffix>_sites.csv.
+
+    One line per CpG site: site (1-based index), position (1-based reference position of the C,
+    only with coordinates), methylated, unmethylated and missing calls, coverage (called reads)
+    and meth_level (methylated / coverage, nan without coverage). Counts include the reads dropped
+    for partial coverage or a zero level. Samples extracted without site counts are skipped.
+    coordinates is the list of CpG coordinates, or a dict of contig: list for references with several contigs.
+    """
+    def __init__(self, output_suffix: str = "", coordinates=None):
+        self.output_suffix = output_suffix
+        self.coordinates = coordinates
+
+    def save(self, data: MethylationData) -> None:
+        for d in data.data:
+            if d.sites is None:
+                continue
+            coordinates = self.coordinates
+            if isinstance(coordinates, dict):
+                coordinates = coordinates.get(d.contig)
+            sites = d.sites
+            coverage = sites.methylated + sites.unmethylated
+            with np.errstate(invalid="ignore", divide="ignore"):
+                levels = sites.methylated / coverage
+            columns = [range(1, len(coverage) + 1)]
+            header = "site"
+            if coordinates is not None:
+                columns.append((np.asarray(coordinates, dtype=np.int64) + 1).tolist())
+                header += ",position"
+            columns += [sites.methylated.tolist(), sites.unmethylated.tolist(), sites.missing.tolist(), coverage.tolist(), levels.tolist()]
+            rows = [header + ",methylated,unmethylated,missing,coverage,meth_level"]
+            rows += [",".join(map(str, row)) for row in zip(*columns)]
+            with open(d.name + self.output_suffix + "_sites.csv", "w") as fh:
+                fh.write("\n".join(rows))
+
+
+class StreamingCSVWriter:
+    """Writes methylation levels of one sample to csv file chunk by chunk, while the sam file is read.
+
+    Produces the same file as WriteMethlation2CSV. Use as a context manager.
+    """
+    def __init__(self, file_name: str, output_suffix: str = ""):
+        self.save_name = sample_name(file_name) + output_suffix + ".csv"
+        self._fh = None
+        self._empty = True
+
+    def __enter__(self):
+        self._fh = open(self.save_name, "w", buffering=WRITE_BUFFER_SIZE)
+        return self
+
+    def write(self, levels: np.ndarray) -> None:
+        if not len(levels):
+            return
+        if not self._empty:
+            self._fh.write("\n")
+        self._fh.write("\n".join([str(i) for i in levels.tolist()]))
+        self._empty = False
+
+    def __exit__(self, *exc) -> None:
+        self._fh.close()
+
+
+class StreamingReadsWriter:
+    """Writes one line per read of one sample to a tab separated file chunk by chunk, while the sam file is read.
+
+    Columns: read name, 1-based alignment position as in the sam file, pattern (1 methylated,
+    0 unmethylated, ! not called), number of called CpG sites and methylation level.
+    compress: if True, the file is gzip compressed and saved as .tsv.gz. Use as a context manager.
+    """
+    HEADER = "read_name\tposition\tpattern\tcovered_cpgs\tmeth_level\n"
+
+    def __init__(self, file_name: str, output_suffix: str = "", compress: bool = False):
+        self.save_name = sample_name(file_name) + output_suffix + "_reads.tsv" + (".gz" if compress else "")
+        self.compress = compress
+        self._fh = None
+
+    def __enter__(self):
+        if self.compress:
+            self._fh = io.BufferedWriter(gzip.open(self.save_name, "wb", compresslevel=GZIP_LEVEL), WRITE_BUFFER_SIZE)
+        else:
+            self._fh = open(self.save_name, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._fh.write(self.HEADER.encode("ascii"))
+        return self
+
+    def write(self, matrix: np.ndarray, levels: np.ndarray, read_ids: np.ndarray, positions: np.ndarray) -> None:
+        """Writes a chunk of reads, as yielded by stream_reads."""
+        if not len(matrix):
+            return
+        # every row of pattern characters is viewed as one fixed width string
+        patterns = np.ascontiguousarray(_PATTERN_CHARS[matrix - MISSING_CALL]).view(f"S{max(matrix.shape[1], 1)}")
+        covered = (matrix != MISSING_CALL).sum(axis=1)
+        lines = zip(
+            read_ids.astype(str).tolist(),
+            (positions + 1).tolist(),
+            patterns.ravel().astype(str).tolist() if matrix.shape[1] else [""] * len(matrix),
+            covered.tolist(),
+            levels.tolist(),
+        )
+        self._fh.write("".join([f"{n}\t{p}\t{pattern}\t{c}\t{level}\n" for n, p, pattern, c, level in lines]).encode("ascii"))
+
+    def __exit__(self, *exc) -> None:
+        self._fh.close()
+
+
+# Version of the directory layout written by WriteMethylation2Binary
+BINARY_FORMAT_VERSION = 1
+# Number of reads unpacked at once when the call matrix is written
+BINARY_BLOCK_ROWS = 65536
+
+
+class WriteMethylation2Binary:
+    """Saves every sample of class MethylationData to a directory of numpy files, <name><suffix>_meth/.
+
+    matrix.npy: int8 call matrix (reads x CpGs, see METHYLATED_CALL etc.), open it with mmap_mode="r"
+    levels.npy: methylation level of every read
+    weights.npy: reads per pattern, only for epialleles
+    read_ids.npy: read names (bytes), only if they were extracted
+    coordinates.npy: 0-based coordinates of the CpG sites, the matrix columns
+    metadata.json: sample, fasta, motif, options of the run and array shapes
+    coordinates is the list of CpG coordinates, or a dict of contig: list for references with several contigs.
+    """
+    def __init__(self, output_suffix: str = "", metadata: Optional[dict] = None, coordinates=None):
+        self.output_suffix = output_suffix
+        self.metadata = metadata or {}
+        self.coordinates = coordinates
+
+    def save(self, data: MethylationData) -> None:
+        for d in data.data:
+            directory = d.name + self.output_suffix + "_meth"
+            os.makedirs(directory, exist_ok=True)
+            # the matrix is unpacked block by block straight into the file
+            matrix = np.lib.format.open_memmap(
+                os.path.join(directory, "matrix.npy"), mode="w+", dtype=np.int8, shape=(len(d.covered), d.sites_number)
+            )
+            for start in range(0, len(d.covered), BINARY_BLOCK_ROWS):
+                stop = start + BINARY_BLOCK_ROWS
+                matrix[start:stop] = d.matrix(slice(start, stop))
+            matrix.flush()
+            del matrix
+            np.save(os.path.join(directory, "levels.npy"), d.levels)
+            if d.counts is not None:
+                np.save(os.path.join(directory, "weights.npy"), d.counts)
+            if d.read_ids is not None:
+                np.save(os.path.join(directory, "read_ids.npy"), d.read_ids)
+            coordinates = self.coordinates
+            if isinstance(coordinates, dict):
+                coordinates = coordinates.get(d.contig)
+            if coordinates is not None:
+                np.save(os.path.join(directory, "coordinates.npy"), np.asarray(coordinates, dtype=np.int64))
+            metadata = {
+                "format_version": BINARY_FORMAT_VERSION,
+                "sample": d.name,
+                "file_name": d.file_name,
+                "contig": d.contig,
+                "reads_number": d.reads_number,
+                "sites_number": d.sites_number,
+                "stored_reads": len(d.covered),
+                **self.metadata,
+            }
+            with open(os.path.join(directory, "metadata.json"), "w") as fh:
+                json.dump(metadata, fh, indent=2)
+
+
+def load_binary_results(directory: str, mmap_mode: Optional[str] = "r") -> dict:
+    """Opens a directory written by WriteMethylation2Binary.
+
+    Returns a dict with the arrays by file name without extension and "metadata".
+    The matrix is memory mapped with mmap_mode, None loads it into memory.
+    """
+    results = {}
+    for name in ("matrix", "levels", "weights", "read_ids", "coordinates"):
+        path = os.path.join(directory, name + ".npy")
+        if os.path.exists(path):
+            results[name] = np.load(path, mmap_mode=mmap_mode if name == "matrix" else None)
+    with open(os.path.join(directory, "metadata.json")) as fh:
+        results["metadata"] = json.load(fh)
+    return results
 
 
 def save_data(data, datawriter: DataWriter) -> None: